@@ -8,20 +8,6 @@ import logging
 import json  # config file read/write
 
 appConfLogger = logging.getLogger(__name__)
-appConfLogger.setLevel(logging.DEBUG)
-infoHandler = logging.FileHandler('CiscoInfo.log', mode='w')
-infoHandler.setLevel(logging.INFO)
-debugHandler = logging.FileHandler('CiscoDebug.log', mode='w')
-debugHandler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - \
-                                %(message)s')
-infoHandler.setFormatter(formatter)
-debugHandler.setFormatter(formatter)
-appConfLogger.addHandler(infoHandler)
-appConfLogger.addHandler(debugHandler)
-# appConfLogger.addHandler(logging.StreamHandler(sys.stdout))
-appConfLogger.info("Begin configCreator Info Logging")
-appConfLogger.debug("Begin configCreator Debug Logging")
 
 
 class appConfig:
@@ -33,6 +19,8 @@ class appConfig:
     _appUsername = ''
     _appPassword = ''
     _appVerify = ''
+    _appApiUrl = ''  # optional, replaces the URL built from the host
+    _appSubscribers = []  # optional, hosts or URLs that take reads
     _localDir = os.getcwd()
 
     def __init__(self, cfgFileName):
@@ -100,6 +88,18 @@ class appConfig:
     def _setAppCert(self, certFileName):
         self._appCertFileName = certFileName
 
+    def getAppApiUrlOverride(self):
+        return self._appApiUrl
+
+    def _setAppApiUrl(self, apiUrl):
+        self._appApiUrl = apiUrl
+
+    def getAppSubscribers(self):
+        return self._appSubscribers
+
+    def _setAppSubscribers(self, subscribers):
+        self._appSubscribers = list(subscribers)
+
     def getAppCfgFileName(self):
         return self._appCfgFileName
 
@@ -113,6 +113,8 @@ class appConfig:
                 self._setAppHost(appCfg['url'])
                 self._setAppCert(appCfg['verifyFile'])
                 self._setAppVerify(appCfg['verify'])
+                self._setAppApiUrl(appCfg.get('apiUrl', ''))
+                self._setAppSubscribers(appCfg.get('subscribers', []))
                 appConfLogger.debug("File Read successfully")
         except Exception as e:
             appConfLogger.debug("Unable to open Config file")
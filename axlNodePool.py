@@ -0,0 +1,170 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from zeep.exceptions import Fault, TransportError
+from requests.exceptions import RequestException
+from axlRateLimiter import axlThrottledError
+
+anpLogger = logging.getLogger(__name__)
+
+# Read offloading: get / list / executeSQLQuery calls are spread over the
+# AXL service of the subscriber nodes, writes stay on the publisher. Node
+# health is passive: a node that fails at the transport level (connection
+# refused, timeout, HTTP error, throttled) is taken out of the rotation for
+# a while and the call is retried on the next node, and on the publisher
+# when no subscriber is left. A SOAP fault is an answer, the node is fine.
+#
+# Subscribers get the changes of the publisher through database
+# replication, usually within seconds. axlRecentWrites remembers what this
+# process wrote, reads of those objects go to the publisher until the lag
+# has passed.
+
+
+class axlNode:
+    # one subscriber AXL endpoint, its gated service and health
+
+    def __init__(self, name, service):
+        self.name = name
+        self.service = service
+        self.inFlight = 0
+        self.latency = 0.0  # seconds, moving average
+        self.failures = 0  # consecutive
+        self.downUntil = 0.0
+
+    def isHealthy(self, now):
+        return now >= self.downUntil
+
+    def getState(self):
+        return {"node": self.name, "inFlight": self.inFlight,
+                "latency": round(self.latency, 4),
+                "failures": self.failures,
+                "healthy": self.isHealthy(time.monotonic())}
+
+
+class axlNodePool:
+    # service like proxy: pool.getUser(...) runs on the healthy subscriber
+    # with the fewest calls in flight, then the lowest latency
+
+    _ejectSeconds = 5.0  # first time out of rotation, doubled per failure
+    _maxEjectSeconds = 300.0
+    _latencyWeight = 0.2
+
+    def __init__(self, publisher, nodes):
+        # publisher: gated service used when no subscriber is healthy
+        self._publisher = publisher
+        self._nodes = list(nodes)
+        self._lock = threading.Lock()
+        self.failovers = 0
+
+    def getNodes(self):
+        return list(self._nodes)
+
+    def getStates(self):
+        with self._lock:
+            return [node.getState() for node in self._nodes]
+
+    @staticmethod
+    def isNodeFailure(error):
+        # True when the node did not answer, False for AXL answers
+        if isinstance(error, Fault):
+            return False
+        return isinstance(error, (TransportError, RequestException,
+                                  axlThrottledError, ConnectionError,
+                                  TimeoutError))
+
+    def _pick(self, tried):
+        with self._lock:
+            now = time.monotonic()
+            healthy = [node for node in self._nodes
+                       if node not in tried and node.isHealthy(now)]
+            if not healthy:
+                return None
+            node = min(healthy, key=lambda node: (node.inFlight,
+                                                  node.latency))
+            node.inFlight += 1
+            return node
+
+    def _succeeded(self, node, seconds):
+        with self._lock:
+            node.inFlight -= 1
+            if node.failures:
+                anpLogger.info("AXL node %s back in rotation", node.name)
+            node.failures = 0
+            node.latency += self._latencyWeight * (seconds - node.latency)
+
+    def _failed(self, node, error):
+        with self._lock:
+            node.inFlight -= 1
+            node.failures += 1
+            eject = min(self._maxEjectSeconds,
+                        self._ejectSeconds * (2 ** (node.failures - 1)))
+            node.downUntil = time.monotonic() + eject
+            self.failovers += 1
+        anpLogger.info("AXL node %s out of rotation for %.0fs: %s",
+                       node.name, eject, error)
+
+    def call(self, opName, *args, **kwargs):
+        tried = set()
+        while True:
+            node = self._pick(tried)
+            if node is None:
+                return getattr(self._publisher, opName)(*args, **kwargs)
+            tried.add(node)
+            started = time.monotonic()
+            try:
+                result = getattr(node.service, opName)(*args, **kwargs)
+            except Exception as e:
+                if self.isNodeFailure(e):
+                    self._failed(node, e)
+                    continue
+                self._succeeded(node, time.monotonic() - started)
+                raise
+            self._succeeded(node, time.monotonic() - started)
+            return result
+
+    def __getattr__(self, opName):
+        if opName.startswith('_'):
+            raise AttributeError(opName)
+
+        def offloaded(*args, **kwargs):
+            return self.call(opName, *args, **kwargs)
+        return offloaded
+
+
+class axlRecentWrites:
+    # (kind, name) of the objects this process wrote in the last lag
+    # seconds, kinds and names as in cucmAxlWriter._invalidate
+
+    _lag = 30.0  # seconds
+
+    def __init__(self, lag=None):
+        if lag is not None:
+            self._lag = lag
+        self._written = OrderedDict()  # oldest write first
+        self._lock = threading.Lock()
+
+    def record(self, kind, name):
+        now = time.monotonic()
+        with self._lock:
+            self._written.pop((kind, name), None)
+            self._written[(kind, name)] = now
+            # entries are in write order, drop the expired ones
+            while self._written:
+                key, written = next(iter(self._written.items()))
+                if now - written < self._lag:
+                    break
+                del self._written[key]
+
+    def isRecent(self, kind, name):
+        with self._lock:
+            written = self._written.get((kind, name))
+        return written is not None and time.monotonic() - written < self._lag
+
+    def getCount(self):
+        with self._lock:
+            return len(self._written)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import logging
+import threading
+from contextlib import contextmanager
+from types import MappingProxyType
+from collections import OrderedDict
+
+apLogger = logging.getLogger(__name__)
+
+# Jabber device types, in the order cucmJabberWriter creates them. The key
+# is also the device name prefix (CSF<username>). A new type is one more
+# entry here.
+jabberDeviceTypes = OrderedDict([
+    ('CSF', {'product': 'Cisco Unified Client Services Framework',
+             'model': 'Cisco Unified Client Services Framework'}),
+    ('TCT', {'product': 'Cisco Dual Mode for iPhone',
+             'model': 'Cisco Dual Mode for iPhone'}),
+    ('BOT', {'product': 'Cisco Dual Mode for Android',
+             'model': 'Cisco Dual Mode for Android'}),
+    ('TAB', {'product': 'Cisco Jabber for Tablet',
+             'model': 'Cisco Jabber for Tablet'})])
+
+# call forward settings of a line that go to voicemail when enabled
+_forwardFields = ['callForwardBusy', 'callForwardBusyInt',
+                  'callForwardNoAnswer', 'callForwardNoAnswerInt',
+                  'callForwardNoCoverage', 'callForwardNoCoverageInt',
+                  'callForwardOnFailure', 'callForwardAlternateParty',
+                  'callForwardNotRegistered', 'callForwardNotRegisteredInt']
+
+
+def deviceType(devicetype):
+    # product / model of a Jabber device type
+    try:
+        return jabberDeviceTypes[devicetype]
+    except KeyError:
+        raise Exception("Invalid Device Type Specified, unrecoverable")
+
+
+class axlProfileCache:
+    # The constant part of the line, phone and RDP payloads, built once per
+    # site specific combination (device pool, CSS, call forward CSS,
+    # voicemail profile, device type) and shared by every user of that
+    # combination. Profiles are read only mappings; the nested settings
+    # dicts are shared as well and must not be modified, zeep only reads
+    # them when it serializes the payload.
+
+    def __init__(self):
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._state = threading.local()
+
+    @contextmanager
+    def uncached(self):
+        # profiles the calling thread builds in the block are not kept,
+        # e.g. those of the placeholder values a template is compiled from
+        previous = getattr(self._state, 'uncached', False)
+        self._state.uncached = True
+        try:
+            yield
+        finally:
+            self._state.uncached = previous
+
+    def _profile(self, key, build):
+        if getattr(self._state, 'uncached', False):
+            return MappingProxyType(build())
+        with self._lock:
+            profile = self._profiles.get(key)
+        if profile is None:
+            profile = MappingProxyType(build())
+            apLogger.debug("%s profile compiled for %s", key[0], key[1:])
+            with self._lock:
+                profile = self._profiles.setdefault(key, profile)
+        return profile
+
+    def lineProfile(self, city, vm, vmProfileName, partition, usage,
+                    cfw_css):
+        def build():
+            vmConfig = {'forwardToVoiceMail': vm,
+                        'callingSearchSpaceName': cfw_css}
+            profile = {'usage': usage,
+                       'routePartitionName': partition,
+                       'callForwardAll': {'forwardToVoiceMail': 'False',
+                                          'callingSearchSpaceName': cfw_css},
+                       'voiceMailProfileName': vmProfileName,
+                       'shareLineAppearanceCssName': city}
+            for field in _forwardFields:
+                profile[field] = vmConfig
+            return profile
+        return self._profile(('line', city, vm, vmProfileName, partition,
+                              usage, cfw_css), build)
+
+    def phoneProfile(self, device_pool, calling_search_space, devicetype):
+        def build():
+            productModel = deviceType(devicetype)
+            return {'product': productModel['product'],
+                    'model': productModel['model'],
+                    'class': 'Phone',
+                    'protocol': 'SIP',
+                    'commonPhoneConfigName': 'Standard Common Phone Profile',
+                    'locationName': 'Hub_None',
+                    'devicePoolName': device_pool,
+                    'callingSearchSpaceName': calling_search_space}
+        return self._profile(('phone', device_pool, calling_search_space,
+                              devicetype), build)
+
+    def rdpProfile(self, device_pool, calling_search_space):
+        def build():
+            return {'product': 'Remote Destination Profile',
+                    'model': 'Remote Destination Profile',
+                    'class': 'Remote Destination Profile',
+                    'protocol': 'Remote Destination',
+                    'protocolSide': 'User',
+                    'callingSearchSpaceName': calling_search_space,
+                    'devicePoolName': device_pool,
+                    'callInfoPrivacyStatus': 'Default',
+                    'rerouteCallingSearchSpaceName': calling_search_space}
+        return self._profile(('rdp', device_pool, calling_search_space),
+                             build)
+
+    def getProfileCount(self):
+        with self._lock:
+            return len(self._profiles)
+
+    def clear(self):
+        with self._lock:
+            self._profiles = {}
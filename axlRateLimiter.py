@@ -0,0 +1,211 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import time
+import asyncio
+import functools
+import random
+import logging
+import threading
+from zeep.exceptions import Fault, TransportError
+from requests.exceptions import HTTPError
+from ciscoMetrics import ciscoMetrics
+
+arlLogger = logging.getLogger(__name__)
+
+
+class axlThrottledError(Exception):
+    # CUCM kept rejecting a request because of AXL throttling. This is never
+    # a "does not exist" answer and must not be treated as one.
+    pass
+
+
+class tokenBucket:
+    # classic token bucket, rate tokens per second up to burst tokens
+
+    def __init__(self, rate, burst):
+        if rate <= 0 or burst < 1:
+            raise Exception("rate must be > 0 and burst >= 1")
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def getRate(self):
+        return self._rate
+
+    def reserve(self):
+        # takes one token and returns how many seconds the caller has to
+        # wait before using it. Callers sleep outside the lock.
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens +
+                               (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self._rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class axlRequestGate:
+    # every AXL request passes through here. Reads and writes have their own
+    # budget, throttle faults are retried with jittered exponential backoff
+    # and surface as axlThrottledError when CUCM keeps refusing.
+
+    _readRate = 15.0  # requests per second
+    _readBurst = 15
+    _writeRate = 5.0
+    _writeBurst = 5
+    _maxRetries = 5
+    _baseDelay = 1.0  # seconds, doubled on every retry
+    _maxDelay = 30.0
+    _readPrefixes = ('get', 'list', 'executeSQLQuery')
+    _throttleStatus = [503]
+    _throttleMessages = ['maximum axl memory allocation consumed',
+                         'throttl',
+                         'too many concurrent requests',
+                         'axl is busy',
+                         'service unavailable']
+    _notFoundPrefixes = ('get',)  # lookups that may miss
+    _notFoundMessages = ['not found']  # 'The specified Phone was not found'
+
+    def __init__(self, readRate=None, writeRate=None, readBurst=None,
+                 writeBurst=None, maxRetries=None):
+        if readRate is not None:
+            self._readRate = readRate
+        if writeRate is not None:
+            self._writeRate = writeRate
+        if readBurst is not None:
+            self._readBurst = readBurst
+        if writeBurst is not None:
+            self._writeBurst = writeBurst
+        if maxRetries is not None:
+            self._maxRetries = maxRetries
+        self._readBucket = tokenBucket(self._readRate, self._readBurst)
+        self._writeBucket = tokenBucket(self._writeRate, self._writeBurst)
+        self.throttled = 0
+
+    def isRead(self, opName):
+        return opName.startswith(self._readPrefixes)
+
+    def getBucket(self, opName):
+        if self.isRead(opName):
+            return self._readBucket
+        return self._writeBucket
+
+    def isThrottle(self, error):
+        if isinstance(error, TransportError):
+            if error.status_code in self._throttleStatus:
+                return True
+        if isinstance(error, HTTPError) and error.response is not None:
+            if error.response.status_code in self._throttleStatus:
+                return True
+        if isinstance(error, (Fault, TransportError)):
+            message = str(error.message).lower()
+            return any(text in message for text in self._throttleMessages)
+        return False
+
+    def isNotFound(self, opName, error):
+        # a get that was answered with a not found fault, the exists
+        # probes expect these
+        if not opName.startswith(self._notFoundPrefixes):
+            return False
+        if not isinstance(error, Fault):
+            return False
+        message = str(error.message).lower()
+        return any(text in message for text in self._notFoundMessages)
+
+    def backoffDelay(self, attempt):
+        # equal jitter, half fixed and half random
+        delay = min(self._maxDelay, self._baseDelay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _retryDelay(self, opName, error, attempt):
+        # seconds to wait before retrying, or raises when it is not a
+        # throttle fault or the retries are used up
+        if not self.isThrottle(error):
+            raise error
+        self.throttled += 1
+        if attempt >= self._maxRetries:
+            arlLogger.info("%s throttled, giving up after %s retries",
+                           opName, attempt)
+            raise axlThrottledError(
+                "{0} throttled by CUCM: {1}".format(opName, error))
+        delay = self.backoffDelay(attempt)
+        arlLogger.info("%s throttled, retry %s in %.2fs", opName,
+                       attempt + 1, delay)
+        return delay
+
+    def call(self, opName, operation, *args, **kwargs):
+        bucket = self.getBucket(opName)
+        notFound = functools.partial(self.isNotFound, opName)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            try:
+                with ciscoMetrics.timer('axl', opName, notFound):
+                    return operation(*args, **kwargs)
+            except Exception as e:
+                delay = self._retryDelay(opName, e, attempt)
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, opName, operation, *args, **kwargs):
+        # same as call for operations returning a coroutine
+        bucket = self.getBucket(opName)
+        notFound = functools.partial(self.isNotFound, opName)
+        attempt = 0
+        while True:
+            wait = bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                with ciscoMetrics.timer('axl', opName, notFound):
+                    return await operation(*args, **kwargs)
+            except Exception as e:
+                delay = self._retryDelay(opName, e, attempt)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+class axlGatedService:
+    # wraps a zeep service proxy so every operation goes through the gate.
+    # With asyncMode the operations are coroutines (zeep AsyncTransport).
+
+    def __init__(self, service, gate, asyncMode=False):
+        self._service = service
+        self._gate = gate
+        self._asyncMode = asyncMode
+        self._operations = {}
+
+    def getGate(self):
+        return self._gate
+
+    def getRawService(self):
+        return self._service
+
+    def __getattr__(self, opName):
+        attribute = getattr(self._service, opName)
+        if opName.startswith('_') or not callable(attribute):
+            return attribute
+        gated = self._operations.get(opName)
+        if gated is None:
+            if self._asyncMode:
+                async def gated(*args, **kwargs):
+                    return await self._gate.acall(opName, attribute, *args,
+                                                  **kwargs)
+            else:
+                def gated(*args, **kwargs):
+                    return self._gate.call(opName, attribute, *args,
+                                           **kwargs)
+            self._operations[opName] = gated
+        return gated
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import re
+import logging
+import threading
+from zeep.wsdl.utils import etree_to_string
+
+atsLogger = logging.getLogger(__name__)
+
+# Renders the envelopes of the hot write operations from templates instead
+# of zeep objects. A template is compiled once by letting zeep serialize a
+# payload whose per call values are placeholder tokens; the serialized
+# bytes are then split at the tokens. Rendering a call is a join of the
+# constant chunks with the escaped values.
+#
+# Placeholders and values are plain text, so only values zeep copies into
+# the envelope unchanged can be slots. Before a template is used it is
+# rendered once with a second set of values (with characters that need
+# escaping) and compared byte for byte with zeep's envelope; a template
+# that differs is never used and the operation stays on zeep.
+
+_token = 'zZtPl{0}Zz'
+_tokenPattern = re.compile(b'zZtPl([0-9]+)Zz')
+# characters lxml refuses or encodes differently, such values go to zeep
+_unsafeText = re.compile('[\x00-\x08\x0b-\x1f\ud800-\udfff\ufffe\uffff]')
+_checkText = 'Ab&<>"\'é{0}'
+
+
+def escapeText(value):
+    # XML text content escaped as lxml writes it
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '>', '&gt;')
+
+
+class axlTemplateError(Exception):
+    pass
+
+
+class axlEnvelopeTemplate:
+    # constant chunks of one serialized envelope and the slot index found
+    # between each pair of chunks
+
+    __slots__ = ('chunks', 'order', 'headers')
+
+    def __init__(self, chunks, order, headers):
+        self.chunks = chunks
+        self.order = order
+        self.headers = headers
+
+    def render(self, values):
+        # values: flat list of strings in slot order
+        parts = [self.chunks[0]]
+        for index, chunk in zip(self.order, self.chunks[1:]):
+            parts.append(escapeText(values[index]).encode('utf-8'))
+            parts.append(chunk)
+        return b''.join(parts)
+
+
+class axlTemplateSerializer:
+    # Templates are keyed by operation, the fixed arguments (values that
+    # change the payload structure, e.g. the device type) and the length
+    # of list slots, and compiled on first use.
+    #
+    # build(**slots, **fixed) returns the (args, kwargs) the operation is
+    # called with.
+
+    def __init__(self, client, service):
+        # service is the raw zeep proxy, not the gated one
+        self._client = client
+        self._binding = service._binding
+        self._options = service._binding_options
+        self._address = service._binding_options['address']
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _flatten(slots):
+        # slot values in a stable order, list slots expanded
+        values = []
+        for name in sorted(slots):
+            value = slots[name]
+            if isinstance(value, (list, tuple)):
+                values.extend(value)
+            else:
+                values.append(value)
+        return values
+
+    @staticmethod
+    def _unflatten(slots, values):
+        # slots with the values of a flat list put in place
+        values = iter(values)
+        filled = {}
+        for name in sorted(slots):
+            if isinstance(slots[name], (list, tuple)):
+                filled[name] = [next(values) for value in slots[name]]
+            else:
+                filled[name] = next(values)
+        return filled
+
+    @staticmethod
+    def canRender(values):
+        # None drops the element in zeep and other types are converted by
+        # the schema, both are left to zeep
+        return all(isinstance(value, str) and not _unsafeText.search(value)
+                   for value in values)
+
+    def zeepEnvelope(self, opName, args, kwargs):
+        # what zeep itself sends: (bytes, http headers). _create is what
+        # Client.create_message uses, it also returns the headers.
+        envelope, headers = self._binding._create(
+            opName, args, kwargs, client=self._client,
+            options=self._options)
+        return etree_to_string(envelope), dict(headers)
+
+    def _key(self, opName, slots, fixed):
+        return (opName, tuple(sorted(fixed.items())),
+                tuple(sorted((name, len(value))
+                             for name, value in slots.items()
+                             if isinstance(value, (list, tuple)))))
+
+    def compile(self, opName, build, slots, fixed):
+        values = self._flatten(slots)
+        tokens = [_token.format(index) for index in range(len(values))]
+        args, kwargs = build(**dict(self._unflatten(slots, tokens), **fixed))
+        body, headers = self.zeepEnvelope(opName, args, kwargs)
+        pieces = _tokenPattern.split(body)
+        chunks = pieces[0::2]
+        order = [int(index) for index in pieces[1::2]]
+        template = axlEnvelopeTemplate(chunks, order, headers)
+
+        checkValues = [_checkText.format(index)
+                       for index in range(len(values))]
+        if not self.isEquivalent(opName, build, template, slots, checkValues,
+                                 fixed):
+            raise axlTemplateError(
+                "{0} template differs from the zeep envelope".format(opName))
+        atsLogger.info("%s template compiled, %s slots", opName,
+                       len(set(order)))
+        return template
+
+    def isEquivalent(self, opName, build, template, slots, values, fixed):
+        args, kwargs = build(**dict(self._unflatten(slots, values), **fixed))
+        body, headers = self.zeepEnvelope(opName, args, kwargs)
+        return template.render(values) == body and \
+            template.headers == headers
+
+    def template(self, opName, build, slots, fixed):
+        # compiled template, or None when the operation can not be templated
+        key = self._key(opName, slots, fixed)
+        with self._lock:
+            if key in self._templates:
+                return self._templates[key]
+        try:
+            template = self.compile(opName, build, slots, fixed)
+        except Exception as e:
+            atsLogger.info("%s stays on zeep serialization: %s", opName, e)
+            template = None
+        with self._lock:
+            return self._templates.setdefault(key, template)
+
+    def render(self, opName, build, slots, fixed=None):
+        # (body, headers), or None when zeep has to serialize this call
+        fixed = fixed or {}
+        values = self._flatten(slots)
+        if not self.canRender(values):
+            return None
+        template = self.template(opName, build, slots, fixed)
+        if template is None:
+            return None
+        return template.render(values), template.headers
+
+    def checkEquivalence(self, opName, build, slots, fixed=None):
+        # renders slots through the template and through zeep and tells
+        # whether the two envelopes are identical
+        fixed = fixed or {}
+        values = self._flatten(slots)
+        if not self.canRender(values):
+            return False
+        template = self.template(opName, build, slots, fixed)
+        if template is None:
+            return False
+        return self.isEquivalent(opName, build, template, slots, values,
+                                 fixed)
+
+    def send(self, opName, body, headers):
+        # posts a rendered envelope and parses the reply like the zeep
+        # service proxy does, faults are raised as zeep.exceptions.Fault
+        response = self._client.transport.post(self._address, body, headers)
+        return self._binding.process_reply(
+            self._client, self._binding.get(opName), response)
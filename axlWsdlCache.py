@@ -0,0 +1,29 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import os  # absolute WSDL path
+import logging
+
+awcLogger = logging.getLogger(__name__)
+
+
+class axlWsdlCache:
+    # Where the AXL client loads its WSDL from. Nothing is cached: zeep 2.4
+    # builds a Client from a WSDL location only, and its Transport cache
+    # only keeps documents loaded over http(s). AXLAPI.wsdl, AXLSoap.xsd
+    # and AXLEnums.xsd are local files, so zeep parses the full schema on
+    # every start.
+
+    _wsdlFileName = ''
+    _axlVersion = ''
+
+    def __init__(self, wsdlFileName, axlVersion):
+        self._wsdlFileName = os.path.abspath(wsdlFileName)
+        self._axlVersion = axlVersion
+
+    def getWsdlFileName(self):
+        return self._wsdlFileName
+
+    def getAxlVersion(self):
+        return self._axlVersion
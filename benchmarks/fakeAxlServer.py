@@ -0,0 +1,308 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import re
+import uuid
+import threading
+from xml.sax.saxutils import escape
+import xml.etree.ElementTree as ElementTree
+from fakeServerBase import fakeHandler, buildOptionParser, runServer
+
+# stand-in for the CUCM AXLAPIService at /axl/. It answers the operations
+# cucmAxlWriter uses with the smallest reply zeep accepts, and keeps users,
+# lines, phones and RDPs in memory so a get after an add finds the object.
+# Every getUser succeeds, like a cluster with all users LDAP synced; users
+# seen so far, or seeded through /_bench/reset, are returned by listUser.
+
+_soapNs = 'http://schemas.xmlsoap.org/soap/envelope/'
+_envelope = ('<?xml version="1.0" encoding="UTF-8"?>'
+             '<soapenv:Envelope xmlns:soapenv="{0}"><soapenv:Body>'
+             '{{0}}</soapenv:Body></soapenv:Envelope>').format(_soapNs)
+_throttleMessage = 'Maximum AXL Memory Allocation Consumed'
+
+
+def _localName(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child(element, name):
+    for child in element:
+        if _localName(child.tag) == name:
+            return child
+    return None
+
+
+def _childText(element, name):
+    child = _child(element, name) if element is not None else None
+    if child is None or child.text is None:
+        return ''
+    return child.text.strip()
+
+
+def _newUuid():
+    return '{' + str(uuid.uuid4()).upper() + '}'
+
+
+class axlStore:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, seed=None):
+        with self._lock:
+            self.users = {}  # lower case userid -> userid
+            for userid in (seed or {}).get('users', []):
+                self.users[userid.lower()] = userid
+            self.phones = {}  # upper case name -> uuid
+            self.lines = {}  # (pattern, partition) -> uuid
+            self.rdps = {}
+            self.remoteDestinations = {}
+
+    def get(self, table, key):
+        with self._lock:
+            return getattr(self, table).get(key)
+
+    def add(self, table, key):
+        with self._lock:
+            objects = getattr(self, table)
+            if key in objects:
+                return None
+            objects[key] = _newUuid()
+            return objects[key]
+
+    def remove(self, table, key):
+        with self._lock:
+            return getattr(self, table).pop(key, None)
+
+    def touchUser(self, userid):
+        with self._lock:
+            self.users.setdefault(userid.lower(), userid)
+
+    def matchUsers(self, search):
+        # userid search with a trailing % wildcard, case insensitive
+        search = search.lower()
+        with self._lock:
+            if search.endswith('%'):
+                return sorted(userid for key, userid in self.users.items()
+                              if key.startswith(search[:-1]))
+            return [self.users[search]] if search in self.users else []
+
+    def keys(self, table):
+        with self._lock:
+            return list(getattr(self, table))
+
+
+class axlFault(Exception):
+
+    def __init__(self, message, status=500, code=5007):
+        Exception.__init__(self, message)
+        self.message = message
+        self.status = status
+        self.code = code
+
+
+class axlHandler(fakeHandler):
+
+    def handleRequest(self, method):
+        body = self.readBody()
+        if method != 'POST' or not self.path.startswith('/axl'):
+            self.reply(404, '', 'text/plain')
+            return
+        try:
+            request = ElementTree.fromstring(body)
+            operation = [child for child in _child(request, 'Body')][0]
+        except Exception:
+            self._fault('unknown', axlFault('Malformed request', code=5000))
+            return
+        opName = _localName(operation.tag)
+        self.server.countRequest(opName)
+        fault = self.inject()
+        if fault == 'throttle':
+            self._fault(opName, axlFault(_throttleMessage, status=503))
+            return
+        if fault == 'error':
+            self._fault(opName, axlFault('Simulated server error'))
+            return
+        handler = getattr(self, '_op_' + opName, None)
+        if handler is None:
+            self._fault(opName, axlFault(
+                'Operation {0} not supported'.format(opName), code=5000))
+            return
+        try:
+            content = handler(operation)
+        except axlFault as e:
+            self._fault(opName, e)
+            return
+        namespace = operation.tag[1:].split('}')[0]
+        self.reply(200, _envelope.format(
+            '<ns:{0}Response xmlns:ns="{1}"><return>{2}</return>'
+            '</ns:{0}Response>'.format(opName, namespace, content)),
+            'text/xml; charset=utf-8')
+
+    def _fault(self, opName, error):
+        self.reply(error.status, _envelope.format(
+            '<soapenv:Fault><faultcode>soapenv:Server</faultcode>'
+            '<faultstring>{0}</faultstring><detail><axlError>'
+            '<axlcode>{1}</axlcode><axlmessage>{0}</axlmessage>'
+            '<request>{2}</request></axlError></detail></soapenv:Fault>'
+            .format(escape(error.message), error.code, opName)),
+            'text/xml; charset=utf-8')
+
+    @staticmethod
+    def _notFound(kind):
+        return axlFault('Item not valid: The specified {0} was not found'
+                        .format(kind))
+
+    # users
+
+    def _op_getUser(self, operation):
+        userid = _childText(operation, 'userid')
+        self.server.store.touchUser(userid)
+        return ('<user uuid="{0}"><firstName>Bench</firstName>'
+                '<lastName>{1}</lastName><userid>{1}</userid></user>'
+                .format(_newUuid(), escape(userid)))
+
+    def _op_listUser(self, operation):
+        search = _childText(_child(operation, 'searchCriteria'), 'userid')
+        skip = int(_childText(operation, 'skip') or 0)
+        first = _childText(operation, 'first')
+        users = self.server.store.matchUsers(search)[skip:]
+        if first:
+            users = users[:int(first)]
+        return ''.join('<user uuid="{0}"><firstName>Bench</firstName>'
+                       '<lastName>{1}</lastName><userid>{1}</userid></user>'
+                       .format(_newUuid(), escape(userid))
+                       for userid in users)
+
+    def _op_updateUser(self, operation):
+        return _newUuid()
+
+    # lines
+
+    @staticmethod
+    def _lineKey(element):
+        return (_childText(element, 'pattern'),
+                _childText(element, 'routePartitionName'))
+
+    def _op_getLine(self, operation):
+        pattern, partition = self._lineKey(operation)
+        lineUuid = self.server.store.get('lines', (pattern, partition))
+        if lineUuid is None:
+            raise self._notFound('Line')
+        return ('<line uuid="{0}"><pattern>{1}</pattern>'
+                '<routePartitionName>{2}</routePartitionName></line>'
+                .format(lineUuid, escape(pattern), escape(partition)))
+
+    def _op_addLine(self, operation):
+        key = self._lineKey(_child(operation, 'line'))
+        lineUuid = self.server.store.add('lines', key)
+        if lineUuid is None:
+            raise axlFault('Could not insert new row - duplicate value in a '
+                           'UNIQUE INDEX column', code=-239)
+        return lineUuid
+
+    def _op_updateLine(self, operation):
+        for key in self.server.store.keys('lines'):
+            if key[0] == _childText(operation, 'pattern'):
+                return self.server.store.get('lines', key)
+        raise self._notFound('Line')
+
+    def _op_removeLine(self, operation):
+        lineUuid = self.server.store.remove('lines',
+                                            self._lineKey(operation))
+        if lineUuid is None:
+            raise self._notFound('Line')
+        return lineUuid
+
+    # phones, RDPs and remote destinations
+
+    def _getNamed(self, table, kind, element, name):
+        objectName = _childText(element, 'name')
+        objectUuid = self.server.store.get(table, objectName.upper())
+        if objectUuid is None:
+            raise self._notFound(kind)
+        return '<{0} uuid="{1}"><name>{2}</name></{0}>'.format(
+            name, objectUuid, escape(objectName))
+
+    def _addNamed(self, table, element):
+        objectUuid = self.server.store.add(
+            table, _childText(element, 'name').upper())
+        if objectUuid is None:
+            raise axlFault('Could not insert new row - duplicate value in a '
+                           'UNIQUE INDEX column', code=-239)
+        return objectUuid
+
+    def _removeNamed(self, table, kind, element):
+        objectUuid = self.server.store.remove(
+            table, _childText(element, 'name').upper())
+        if objectUuid is None:
+            raise self._notFound(kind)
+        return objectUuid
+
+    def _op_getPhone(self, operation):
+        return self._getNamed('phones', 'Phone', operation, 'phone')
+
+    def _op_addPhone(self, operation):
+        return self._addNamed('phones', _child(operation, 'phone'))
+
+    def _op_removePhone(self, operation):
+        return self._removeNamed('phones', 'Phone', operation)
+
+    def _op_getRemoteDestinationProfile(self, operation):
+        return self._getNamed('rdps', 'Remote Destination Profile',
+                              operation, 'remoteDestinationProfile')
+
+    def _op_addRemoteDestinationProfile(self, operation):
+        return self._addNamed('rdps',
+                              _child(operation, 'remoteDestinationProfile'))
+
+    def _op_removeRemoteDestinationProfile(self, operation):
+        return self._removeNamed('rdps', 'Remote Destination Profile',
+                                 operation)
+
+    def _op_getRemoteDestination(self, operation):
+        destination = _childText(operation, 'destination')
+        objectUuid = self.server.store.get('remoteDestinations', destination)
+        if objectUuid is None:
+            raise self._notFound('Remote Destination')
+        return ('<remoteDestination uuid="{0}"><destination>{1}'
+                '</destination></remoteDestination>'
+                .format(objectUuid, escape(destination)))
+
+    def _op_addRemoteDestination(self, operation):
+        destination = _childText(_child(operation, 'remoteDestination'),
+                                 'destination')
+        objectUuid = self.server.store.add('remoteDestinations', destination)
+        if objectUuid is None:
+            raise axlFault('Could not insert new row - duplicate value in a '
+                           'UNIQUE INDEX column', code=-239)
+        return objectUuid
+
+    # the two prefetch queries of cucmAxlWriter._prefetchQueries
+
+    def _op_executeSQLQuery(self, operation):
+        sql = _childText(operation, 'sql')
+        names = re.findall(r"'((?:[^']|'')*)'",
+                           sql[sql.rfind(' in ('):])
+        names = [name.replace("''", "'") for name in names]
+        if 'from device' in sql:
+            rows = ['<row><name>{0}</name></row>'.format(escape(name))
+                    for name in names
+                    if self.server.store.get('phones', name.upper()) or
+                    self.server.store.get('rdps', name.upper())]
+        elif 'from numplan' in sql:
+            partition = re.search(r"rp\.name = '((?:[^']|'')*)'", sql)
+            partition = partition.group(1) if partition else ''
+            rows = ['<row><dnorpattern>{0}</dnorpattern></row>'
+                    .format(escape(name)) for name in names
+                    if self.server.store.get('lines', (name, partition))]
+        else:
+            raise axlFault('Query not supported by the stand-in', code=-201)
+        return ''.join(rows)
+
+
+if __name__ == '__main__':
+    (options, args) = buildOptionParser().parse_args()
+    runServer(axlHandler, axlStore(), options)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import re
+import json
+import uuid
+import threading
+from urllib.parse import urlparse, parse_qs, unquote
+from fakeServerBase import fakeHandler, buildOptionParser, runServer
+
+# stand-in for the Unity Connection /vmrest/ API calls of cupiRestWriter.
+# Every alias is found in the LDAP import list; imported or created users
+# are kept in memory until they are deleted. The users seeded through
+# /_bench/reset are also listed by (alias startswith ...) queries and
+# queries without a filter, paged with rowsPerPage / pageNumber.
+
+_aliasQuery = re.compile(r'\(alias (is|startswith) (.*)\)')
+
+
+class cupiStore:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, seed=None):
+        with self._lock:
+            self.users = {}  # alias -> ObjectId
+            self.ldapUsers = sorted((seed or {}).get('users', []))
+
+    def importable(self, prefix):
+        with self._lock:
+            return [alias for alias in self.ldapUsers
+                    if alias.startswith(prefix) and alias not in self.users]
+
+    def mailboxes(self, prefix):
+        with self._lock:
+            return sorted((alias, objectId)
+                          for alias, objectId in self.users.items()
+                          if alias.startswith(prefix))
+
+    def findUser(self, alias):
+        with self._lock:
+            return self.users.get(alias)
+
+    def addUser(self, alias):
+        with self._lock:
+            if alias in self.users:
+                return None
+            self.users[alias] = str(uuid.uuid4())
+            return self.users[alias]
+
+    def hasObjectId(self, objectId):
+        with self._lock:
+            return objectId in self.users.values()
+
+    def removeUser(self, objectId):
+        with self._lock:
+            for alias, userObjectId in list(self.users.items()):
+                if userObjectId == objectId:
+                    del self.users[alias]
+                    return True
+            return False
+
+
+class cupiHandler(fakeHandler):
+
+    def _json(self, code, body=None):
+        self.reply(code, json.dumps(body) if body is not None else '',
+                   'application/json')
+
+    def _page(self, query, key, records):
+        # one rowsPerPage / pageNumber page, a single record is an object
+        # as on a real Unity Connection
+        rowsPerPage = int(query.get('rowsPerPage', 2000))
+        pageNumber = int(query.get('pageNumber', 1))
+        page = records[(pageNumber - 1) * rowsPerPage:
+                       pageNumber * rowsPerPage]
+        body = {"@total": str(len(records))}
+        if len(page) == 1:
+            body[key] = page[0]
+        elif page:
+            body[key] = page
+        self._json(200, body)
+
+    def handleRequest(self, method):
+        body = self.readBody()
+        parsed = urlparse(self.path)
+        if not parsed.path.startswith('/vmrest/'):
+            self._json(404, {"errors": {"message": "Not found"}})
+            return
+        path = parsed.path[len('/vmrest/'):].rstrip('/')
+        query = {key: values[0]
+                 for key, values in parse_qs(parsed.query).items()}
+        operation = '{0} {1}'.format(
+            method, re.sub(r'^users/.+$', 'users/{ObjectId}', path))
+        self.server.countRequest(operation)
+        fault = self.inject()
+        if fault == 'throttle':
+            self._json(503, {"errors": {"message": "Service Unavailable"}})
+            return
+        if fault == 'error':
+            self._json(500, {"errors": {"message": "Simulated error"}})
+            return
+        match = _aliasQuery.match(unquote(query.get('query', '')))
+        alias = match.group(2) if match and match.group(1) == 'is' else None
+        prefix = None
+        if not query.get('query'):
+            prefix = ''
+        elif match and match.group(1) == 'startswith':
+            prefix = match.group(2)
+
+        if operation == 'GET import/users/ldap' and prefix is not None:
+            self._page(query, 'ImportUser', [
+                {"alias": found, "pkid": "ldap-" + found}
+                for found in self.server.store.importable(prefix)])
+        elif operation == 'GET import/users/ldap':
+            if alias is None or self.server.store.findUser(alias):
+                self._json(200, {"@total": "0"})
+            else:
+                self._json(200, {"@total": "1", "ImportUser": {
+                    "alias": alias, "pkid": "ldap-" + alias}})
+        elif operation == 'POST import/users/ldap':
+            pkid = json.loads(body.decode('utf-8') or '{}').get('pkid', '')
+            if not pkid.startswith('ldap-') or \
+                    self.server.store.addUser(pkid[len('ldap-'):]) is None:
+                self._json(400, {"errors": {"message": "Import failed"}})
+            else:
+                self._json(201)
+        elif operation == 'POST users':
+            newUser = json.loads(body.decode('utf-8') or '{}')
+            if self.server.store.addUser(newUser.get('Alias', '')) is None:
+                self._json(400, {"errors": {"message": "Duplicate alias"}})
+            else:
+                self._json(201)
+        elif operation == 'GET users' and prefix is not None:
+            self._page(query, 'User', [
+                {"Alias": found, "ObjectId": objectId}
+                for found, objectId in self.server.store.mailboxes(prefix)])
+        elif operation == 'GET users':
+            objectId = self.server.store.findUser(alias) if alias else None
+            if objectId is None:
+                self._json(200, {"@total": "0"})
+            else:
+                self._json(200, {"@total": "1", "User": {
+                    "Alias": alias, "ObjectId": objectId}})
+        elif operation == 'DELETE users/{ObjectId}':
+            if self.server.store.removeUser(path[len('users/'):]):
+                self._json(204)
+            else:
+                self._json(404, {"errors": {"message": "User not found"}})
+        elif operation == 'PUT users/{ObjectId}':
+            if self.server.store.hasObjectId(path[len('users/'):]):
+                self._json(204)
+            else:
+                self._json(404, {"errors": {"message": "User not found"}})
+        elif operation == 'POST usertemplates':
+            self._json(201)
+        else:
+            self._json(404, {"errors": {"message": "Not supported"}})
+
+
+if __name__ == '__main__':
+    (options, args) = buildOptionParser().parse_args()
+    runServer(cupiHandler, cupiStore(), options)
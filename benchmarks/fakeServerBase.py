@@ -0,0 +1,170 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import sys
+import json
+import time
+import random
+import threading
+from optparse import OptionParser
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# shared by fakeAxlServer and fakeCupiServer: a threaded HTTP server whose
+# replies can be delayed, failed or throttled, and a /_bench/ control path
+# the benchmark runner uses to reset state and read request counts
+
+
+class faultInjector:
+    # decides per request how long to wait and whether to fail or throttle.
+    # Seeded, so a run with the same options sees the same faults.
+
+    def __init__(self, latency=0.0, jitter=0.0, errorRate=0.0,
+                 throttleRate=0.0, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.throttleRate = throttleRate
+        self._seed = seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._random = random.Random(self._seed)
+
+    def nextFault(self):
+        # (seconds to wait, None / 'error' / 'throttle')
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            draw = self._random.random()
+        if draw < self.throttleRate:
+            return delay, 'throttle'
+        if draw < self.throttleRate + self.errorRate:
+            return delay, 'error'
+        return delay, None
+
+
+class fakeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, handlerClass, faults, store):
+        HTTPServer.__init__(self, address, handlerClass)
+        self.faults = faults
+        self.store = store
+        self.requests = {}
+        self._countLock = threading.Lock()
+
+    def countRequest(self, operation):
+        with self._countLock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+
+    def resetState(self, seed=None):
+        self.store.reset(seed)
+        self.faults.reset()
+        with self._countLock:
+            self.requests = {}
+
+
+class fakeHandler(BaseHTTPRequestHandler):
+    # subclasses implement handleRequest(method) for everything outside
+    # /_bench/
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, like CUCM and Unity
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, code, body, contentType):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def readBody(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def _control(self, method, body):
+        if self.path == '/_bench/reset' and method == 'POST':
+            # an optional JSON body seeds the store, e.g. existing users
+            self.server.resetState(json.loads(body.decode('utf-8'))
+                                   if body else None)
+            self.reply(200, '{}', 'application/json')
+        elif self.path == '/_bench/stats':
+            self.reply(200, json.dumps({"requests": self.server.requests}),
+                       'application/json')
+        else:
+            self.reply(404, '{}', 'application/json')
+
+    def inject(self):
+        delay, fault = self.server.faults.nextFault()
+        if delay > 0:
+            time.sleep(delay)
+        return fault
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method):
+        if self.path.startswith('/_bench/'):
+            self._control(method, self.readBody())
+        else:
+            self.handleRequest(method)
+
+
+def buildOptionParser():
+    parser = OptionParser()
+    parser.add_option("--host", action="store", type="string", dest="host",
+                      default="127.0.0.1")
+    parser.add_option("--port", action="store", type="int", dest="port",
+                      default=0, help="0 picks a free port")
+    parser.add_option("--latency", action="store", type="float",
+                      dest="latency", default=0.0,
+                      help="seconds added to every reply")
+    parser.add_option("--jitter", action="store", type="float",
+                      dest="jitter", default=0.0,
+                      help="up to this many random seconds on top")
+    parser.add_option("--errorrate", action="store", type="float",
+                      dest="errorRate", default=0.0,
+                      help="fraction of requests answered with a server "
+                      "error")
+    parser.add_option("--throttlerate", action="store", type="float",
+                      dest="throttleRate", default=0.0,
+                      help="fraction of requests answered with a throttle "
+                      "reply")
+    parser.add_option("--seed", action="store", type="int", dest="seed",
+                      default=1)
+    return parser
+
+
+def runServer(handlerClass, store, options):
+    faults = faultInjector(latency=options.latency, jitter=options.jitter,
+                           errorRate=options.errorRate,
+                           throttleRate=options.throttleRate,
+                           seed=options.seed)
+    server = fakeServer((options.host, options.port), handlerClass, faults,
+                        store)
+    # the runner reads the port from the first line
+    print("listening on {0}".format(server.server_address[1]))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import os  # work directory, paths
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import subprocess
+from optparse import OptionParser
+from urllib.request import urlopen, Request
+
+# Runs the provisioning flows against fakeAxlServer and fakeCupiServer.
+# The writers are pointed at the stand-ins through the apiUrl key of a
+# ucm.cfg / cxn.cfg written to a scratch directory; the AXL toolkit WSDL is
+# still required (--toolkit), exactly as for a real cluster.
+#
+# Every run uses fixed usernames and a seeded fault injector, so two runs
+# of the same commit issue the same requests. Results go to
+# bench_output.txt and, with --json, to a file that a later run can be
+# compared against with --baseline.
+#
+# No results are checked in; the numbers of a run are only comparable to
+# runs on the same machine.
+
+_benchDir = os.path.dirname(os.path.abspath(__file__))
+_repoDir = os.path.dirname(_benchDir)
+_benchmarks = ['startup', 'serialize', 'template', 'single', 'bulk']
+
+
+def benchRow(index):
+    # one provisioning row, the same for every run
+    return {'username': 'bench{0:05d}'.format(index),
+            'firstname': 'Bench',
+            'lastname': 'User{0:05d}'.format(index),
+            'extension': '{0:05d}'.format(20000 + index),
+            'did': '206555{0:04d}'.format(index),
+            'city': 'Tampa',
+            'building': 'Northwoods',
+            'pin': '54321',
+            'vm': 'True',
+            'emailaddress': 'bench{0:05d}@apitest.org'.format(index),
+            'vmprofile': 'voicemailusertemplate',
+            'country_code': '1',
+            'cfw_css': 'None',
+            'device_css': 'None',
+            'vmtemplate': 'voicemailusertemplate',
+            'cos': 'International',
+            'snr': 'False',
+            'snrphone': None,
+            'perform': None}
+
+
+def userSeed(count):
+    # the LDAP synced users the stand-in AXL server starts with
+    return {'users': [benchRow(index)['username'] for index in range(count)]}
+
+
+class stubServer:
+    # one fakeAxlServer / fakeCupiServer subprocess
+
+    def __init__(self, script, options):
+        command = [sys.executable, os.path.join(_benchDir, script),
+                   '--latency', str(options.latency),
+                   '--jitter', str(options.jitter),
+                   '--errorrate', str(options.errorRate),
+                   '--throttlerate', str(options.throttleRate),
+                   '--seed', str(options.seed)]
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                         universal_newlines=True)
+        line = self._process.stdout.readline().strip()
+        if not line.startswith('listening on '):
+            self.stop()
+            raise Exception("{0} did not start: {1}".format(script, line))
+        self.port = int(line.rsplit(' ', 1)[1])
+
+    def getUrl(self, path):
+        return 'http://127.0.0.1:{0}{1}'.format(self.port, path)
+
+    def reset(self, seed=None):
+        data = json.dumps(seed).encode('utf-8') if seed else b''
+        urlopen(Request(self.getUrl('/_bench/reset'), data=data,
+                        method='POST')).read()
+
+    def getRequests(self):
+        with urlopen(self.getUrl('/_bench/stats')) as response:
+            return json.loads(response.read().decode('utf-8'))['requests']
+
+    def stop(self):
+        self._process.terminate()
+        self._process.wait()
+
+
+def writeConfigs(workDir, axlServer, cupiServer):
+    for cfgFileName, server, path in [('ucm.cfg', axlServer, '/axl/'),
+                                      ('cxn.cfg', cupiServer, '/vmrest/')]:
+        with open(os.path.join(workDir, cfgFileName), 'w') as cfgFile:
+            json.dump({'username': 'bench', 'password': 'bench',
+                       'url': '127.0.0.1', 'verify': False,
+                       'verifyFile': False,
+                       'apiUrl': server.getUrl(path)}, cfgFile)
+
+
+def summarize(name, unit, samples, calls=None, errors=0):
+    return {'name': name,
+            'unit': unit,
+            'median': statistics.median(samples),
+            'min': min(samples),
+            'max': max(samples),
+            'samples': len(samples),
+            'errors': errors,
+            'calls': calls or {}}
+
+
+def callCounts():
+    # client side request counts of the last benchmark, identical between
+    # runs of the same commit unless faults are injected
+    from ciscoMetrics import ciscoMetrics
+    counts = {}
+    for system, operations in ciscoMetrics.summary()['operations'].items():
+        for operation, stats in operations.items():
+            counts['{0} {1}'.format(system, operation)] = stats['count']
+    return counts
+
+
+def benchStartup(options, servers):
+    # cucmAxlWriter construction, zeep parses the WSDL every time
+    from cucmAxlWriter import cucmAxlWriter
+    samples = []
+    for attempt in range(options.repeat):
+        started = time.perf_counter()
+        cucmAxlWriter()
+        samples.append(time.perf_counter() - started)
+    return [summarize('startup', 's', samples)]
+
+
+def benchSerialize(options, servers):
+    # cost of turning one payload into a SOAP envelope, no network
+    from cucmAxlWriter import axlWriterRegistry
+    writer = axlWriterRegistry.getWriter()
+    service = writer.service.getRawService()
+    row = benchRow(0)
+    e164 = '+1' + row['did']
+    payloads = [
+        ('getPhone', (), {'name': 'CSF' + row['username']}),
+        ('addLine', (writer._linePackage(
+            e164, row['firstname'], row['lastname'], row['building'],
+            row['city'], 'True', row['vmprofile'], 'Internal PAR',
+            'Device', 'None'),), {}),
+        ('addPhone', (writer._devicePackage(
+            row['username'], row['firstname'], row['lastname'], e164,
+            row['extension'], row['did'], row['building'], 'None', 'CSF'),),
+         {}),
+        ('updateUser', (), writer._userUpdatePackage(
+            row['username'], e164, row['did'],
+            ['CSF' + row['username']], 'Internal PAR'))]
+    results = []
+    for opName, args, kwargs in payloads:
+        samples = []
+        for attempt in range(options.repeat):
+            started = time.perf_counter()
+            for iteration in range(options.iterations):
+                writer.client.create_message(service, opName, *args,
+                                             **kwargs)
+            samples.append((time.perf_counter() - started) * 1e6 /
+                           options.iterations)
+        results.append(summarize('serialize ' + opName, 'us/call', samples))
+    return results
+
+
+def templatePayloads(writer, row):
+    # (operation, package method, slots, fixed, keywords) of the write
+    # operations cucmAxlWriter renders from templates with fastSerialize
+    e164 = '+1' + row['did']
+    person = {'username': row['username'], 'firstname': row['firstname'],
+              'lastname': row['lastname'], 'e164ext': e164,
+              'extension': row['extension'], 'did': row['did'],
+              'device_pool': row['building'], 'calling_search_space': 'None',
+              'partition': 'Internal PAR'}
+    return [
+        ('addLine', writer._linePackage,
+         {'extension': e164, 'firstname': row['firstname'],
+          'lastname': row['lastname'], 'device_pool': row['building'],
+          'city': row['city'], 'vm': 'True',
+          'vmProfileName': row['vmprofile'], 'partition': 'Internal PAR',
+          'usage': 'Device', 'cfw_css': 'None'}, None, False),
+        ('addPhone', writer._devicePackage,
+         dict(person, deviceName=writer.deviceGetName(row['username'],
+                                                      'CSF')),
+         {'devicetype': 'CSF'}, False),
+        ('addRemoteDestinationProfile', writer._rdpPackage, person, None,
+         False),
+        ('updateUser', writer._userUpdatePackage,
+         {'username': row['username'], 'extension': e164,
+          'did': row['did'], 'deviceList': ['CSF' + row['username'],
+                                            'TCT' + row['username']],
+          'partition': 'Internal PAR'}, None, True)]
+
+
+def benchTemplate(options, servers):
+    # zeep (package objects + schema walk + lxml) against the template
+    # serializer for the same envelope. errors=1 marks a template that
+    # did not render zeep's envelope byte for byte.
+    from cucmAxlWriter import cucmAxlWriter
+    writer = cucmAxlWriter(fastSerialize=True)
+    templates = writer.templates
+    row = benchRow(0)
+    results = []
+    for opName, packageMethod, slots, fixed, keywords in \
+            templatePayloads(writer, row):
+        def build(**values):
+            package = packageMethod(**values)
+            return ((), package) if keywords else ((package,), {})
+        values = dict(slots, **(fixed or {}))
+        equivalent = writer.checkTemplate(opName, packageMethod, slots, fixed,
+                                          keywords)
+        zeepSamples = []
+        templateSamples = []
+        for attempt in range(options.repeat):
+            started = time.perf_counter()
+            for iteration in range(options.iterations):
+                args, kwargs = build(**values)
+                templates.zeepEnvelope(opName, args, kwargs)
+            zeepSamples.append((time.perf_counter() - started) * 1e6 /
+                               options.iterations)
+            started = time.perf_counter()
+            for iteration in range(options.iterations):
+                templates.render(opName, build, slots, fixed)
+            templateSamples.append((time.perf_counter() - started) * 1e6 /
+                                   options.iterations)
+        results.append(summarize('template zeep ' + opName, 'us/call',
+                                 zeepSamples))
+        results.append(summarize('template render ' + opName, 'us/call',
+                                 templateSamples,
+                                 errors=0 if equivalent else 1))
+    return results
+
+
+def benchSingle(options, servers):
+    # one user at a time through ciscoWriter's processUser, as the CLI does
+    from ciscoMetrics import ciscoMetrics
+    from ciscoBatchWriter import normalizeRow, processUser
+    from cucmAxlWriter import axlWriterRegistry
+    axlWriterRegistry.getWriter()  # startup is measured separately
+    results = []
+    for perform in ['create', 'delete']:
+        for server in servers:
+            server.reset(userSeed(options.repeat))
+        if perform == 'delete':
+            for index in range(options.repeat):
+                processUser(normalizeRow(benchRow(index)), 'create')
+        ciscoMetrics.reset()
+        samples = []
+        errors = 0
+        for index in range(options.repeat):
+            started = time.perf_counter()
+            try:
+                processUser(normalizeRow(benchRow(index)), perform)
+            except Exception:
+                errors += 1
+            samples.append(time.perf_counter() - started)
+        results.append(summarize('single ' + perform, 's/user', samples,
+                                 callCounts(), errors))
+    return results
+
+
+def benchBulk(options, servers):
+    # ciscoBatchWriter over --users rows with --workers threads
+    from ciscoMetrics import ciscoMetrics
+    from ciscoBatchWriter import ciscoBatchWriter, normalizeRow
+    results = []
+    for perform in ['create', 'delete']:
+        samples = []
+        errors = 0
+        for attempt in range(options.repeat):
+            for server in servers:
+                server.reset(userSeed(options.users))
+            if perform == 'delete':
+                for result in ciscoBatchWriter(
+                        'create', workers=options.workers).run(
+                            [normalizeRow(benchRow(index))
+                             for index in range(options.users)]):
+                    pass
+            ciscoMetrics.reset()
+            rows = [normalizeRow(benchRow(index))
+                    for index in range(options.users)]
+            batch = ciscoBatchWriter(perform, workers=options.workers)
+            started = time.perf_counter()
+            for result in batch.run(rows):
+                if 'error' in result:
+                    errors += 1
+            samples.append(options.users / (time.perf_counter() - started))
+        results.append(summarize(
+            'bulk {0} x{1} w{2}'.format(perform, options.users,
+                                         options.workers),
+            'users/s', samples, callCounts(), errors))
+    return results
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=_repoDir,
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def formatReport(report, baseline=None):
+    baseResults = {}
+    if baseline:
+        baseResults = {result['name']: result
+                       for result in baseline['results']}
+    lines = ['commit {0}  python {1}  zeep {2}'.format(
+        report['commit'], report['python'], report['zeep']),
+        'options {0}'.format(json.dumps(report['options'],
+                                        sort_keys=True)), '']
+    for result in report['results']:
+        line = '{0:<34} {1:>12.4f} {2:<8} (min {3:.4f} max {4:.4f})'.format(
+            result['name'], result['median'], result['unit'], result['min'],
+            result['max'])
+        if result['errors']:
+            line += ' errors={0}'.format(result['errors'])
+        base = baseResults.get(result['name'])
+        if base and base['median']:
+            line += ' {0:+.1f}% vs {1}'.format(
+                (result['median'] - base['median']) * 100 / base['median'],
+                baseline['commit'])
+        lines.append(line)
+        if result['calls']:
+            lines.append('    calls ' + ', '.join(
+                '{0}={1}'.format(name, count)
+                for name, count in sorted(result['calls'].items())))
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--toolkit", action="store", type="string",
+                      dest="toolkit",
+                      default=os.path.join(_repoDir, 'axlsqltoolkit'),
+                      help="axlsqltoolkit directory with the AXL WSDL")
+    parser.add_option("--only", action="append", type="choice",
+                      choices=_benchmarks, dest="only",
+                      help="run only these benchmarks: " +
+                      "/".join(_benchmarks))
+    parser.add_option("--repeat", action="store", type="int",
+                      dest="repeat", default=5)
+    parser.add_option("--iterations", action="store", type="int",
+                      dest="iterations", default=200,
+                      help="payloads serialized per serialize / template "
+                      "sample")
+    parser.add_option("--users", action="store", type="int", dest="users",
+                      default=200, help="rows per bulk run")
+    parser.add_option("--workers", action="store", type="int",
+                      dest="workers", default=8)
+    parser.add_option("--latency", action="store", type="float",
+                      dest="latency", default=0.005,
+                      help="seconds added to every stand-in reply")
+    parser.add_option("--jitter", action="store", type="float",
+                      dest="jitter", default=0.0)
+    parser.add_option("--errorrate", action="store", type="float",
+                      dest="errorRate", default=0.0)
+    parser.add_option("--throttlerate", action="store", type="float",
+                      dest="throttleRate", default=0.0)
+    parser.add_option("--seed", action="store", type="int", dest="seed",
+                      default=1)
+    parser.add_option("--output", action="store", type="string",
+                      dest="output",
+                      default=os.path.join(_repoDir, 'bench_output.txt'))
+    parser.add_option("--json", action="store", type="string", dest="json",
+                      help="also write the results as JSON")
+    parser.add_option("--baseline", action="store", type="string",
+                      dest="baseline", help="JSON of an earlier run to "
+                      "compare against")
+    (options, args) = parser.parse_args()
+
+    if not os.path.isdir(options.toolkit):
+        parser.error("AXL toolkit not found at {0}".format(options.toolkit))
+    toolkit = os.path.abspath(options.toolkit)
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+    output = os.path.abspath(options.output)
+    jsonOutput = os.path.abspath(options.json) if options.json else None
+
+    axlServer = stubServer('fakeAxlServer.py', options)
+    cupiServer = stubServer('fakeCupiServer.py', options)
+    servers = [axlServer, cupiServer]
+    workDir = tempfile.mkdtemp(prefix='ciscoBench')
+    try:
+        writeConfigs(workDir, axlServer, cupiServer)
+        os.symlink(toolkit, os.path.join(workDir, 'axlsqltoolkit'))
+        # appConfig resolves ucm.cfg / cxn.cfg against the directory the
+        # modules are imported from
+        os.chdir(workDir)
+        sys.path.insert(0, _repoDir)
+        import zeep
+        from ciscoLogging import setupLogging
+        setupLogging(level='WARNING', logDir=workDir)
+
+        runners = {'startup': benchStartup, 'serialize': benchSerialize,
+                   'template': benchTemplate, 'single': benchSingle,
+                   'bulk': benchBulk}
+        results = []
+        for name in _benchmarks:
+            if options.only and name not in options.only:
+                continue
+            results.extend(runners[name](options, servers))
+        report = {'commit': gitRevision(),
+                  'python': platform.python_version(),
+                  'zeep': zeep.__version__,
+                  'options': {key: value
+                              for key, value in vars(options).items()
+                              if key not in ['toolkit', 'output', 'json',
+                                             'baseline']},
+                  'results': results}
+    finally:
+        os.chdir(_repoDir)
+        shutil.rmtree(workDir, ignore_errors=True)
+        for server in servers:
+            server.stop()
+
+    text = formatReport(report, baseline)
+    with open(output, 'w') as outputFile:
+        outputFile.write(text)
+    if jsonOutput:
+        with open(jsonOutput, 'w') as jsonFile:
+            json.dump(report, jsonFile, indent=2, sort_keys=True)
+    print(text, end='')
+
+
+if __name__ == '__main__':
+    main()
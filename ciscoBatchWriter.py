@@ -0,0 +1,418 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import os  # file extension
+import csv
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cucmAxlWriter import axlWriterRegistry, axlExistenceSnapshot, \
+    axlExistenceBlocks
+from cucmJabberWriter import cucmJabberWriter
+from cupiRestWriter import cupiRestWriter, cupiSessionPool
+from cupiBulkWriter import cupiBulkWriter
+
+cbwLogger = logging.getLogger(__name__)
+
+# batch rows use the ciscoWriter option names (dest), the long switch names
+# are accepted as aliases so a header row can be copied from the CLI help
+_fieldAliases = {'action': 'perform',
+                 'ext': 'extension',
+                 'site': 'city',
+                 'subsite': 'building',
+                 'voicemail': 'vm',
+                 'countrycode': 'country_code',
+                 'cfwcss': 'cfw_css',
+                 'devicess': 'device_css',
+                 'classofservice': 'cos',
+                 'singlenumberreach': 'snr',
+                 'snrdid': 'snrphone'}
+_rowFields = ['perform', 'username', 'firstname', 'lastname', 'extension',
+              'did', 'city', 'building', 'pin', 'vm', 'emailaddress',
+              'vmprofile', 'country_code', 'cfw_css', 'device_css',
+              'vmtemplate', 'cos', 'snr', 'snrphone', 'cluster']
+# fields that say how a row is run, not what is provisioned
+_runFields = ['perform', 'cluster']
+
+
+def normalizeRow(row):
+    # maps a raw batch row onto the ciscoWriter option names
+    normalized = dict.fromkeys(_rowFields)
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip().lower().lstrip('-')
+        key = _fieldAliases.get(key, key)
+        if key not in normalized:
+            cbwLogger.debug("Ignoring unknown batch field %s", key)
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        if value not in (None, ''):
+            normalized[key] = str(value)
+    if not normalized['firstname']:
+        normalized['firstname'] = 'GetAD!'
+    if not normalized['lastname']:
+        normalized['lastname'] = 'GetAD!'
+    return normalized
+
+
+def provisioningFields(row):
+    # the ciscoWriter fields of a row, without the action and cluster
+    return {key: row.get(key) for key in _rowFields
+            if key not in _runFields}
+
+
+def rowHash(row):
+    # changes when any provisioning field of the row changes
+    fields = json.dumps(provisioningFields(row), sort_keys=True)
+    return hashlib.sha256(fields.encode('utf-8')).hexdigest()
+
+
+def readBatchFile(filename):
+    # yields one normalized row per user from a CSV or JSON Lines file
+    extension = os.path.splitext(filename)[1].lower()
+    with open(filename, newline='') as batchFile:
+        if extension in ['.jsonl', '.json', '.ndjson']:
+            for line in batchFile:
+                line = line.strip()
+                if line:
+                    yield normalizeRow(json.loads(line))
+        else:
+            for row in csv.DictReader(batchFile):
+                yield normalizeRow(row)
+
+
+# steps whose bare "Fail" means the object was already there, or already
+# gone, which is what a retried user finds
+_alreadyDone = ['lineCreate', 'deviceCreate', 'lineDelete']
+
+
+def statusFailures(result, path=()):
+    # the "Fail..." statuses anywhere in a result of processUser as
+    # 'path: status'. The ccm / cxn parts are JSON text, reconcile steps
+    # have a result.
+    if isinstance(result, str):
+        if result.startswith('Fail'):
+            if result == 'Fail' and set(path) & set(_alreadyDone):
+                return []
+            return ['{0}: {1}'.format('/'.join(path), result)]
+        if result.startswith(('{', '[')):
+            try:
+                return statusFailures(json.loads(result), path)
+            except ValueError:
+                return []
+        return []
+    if isinstance(result, dict):
+        return [failure for key, value in sorted(result.items())
+                for failure in statusFailures(value, path + (str(key),))]
+    if isinstance(result, list):
+        return [failure for value in result
+                for failure in statusFailures(value, path)]
+    return []
+
+
+def voicemailEnabled(row):
+    return (row.get('vm') or '').lower() in ['true', '1', 't', 'y', 'yes']
+
+
+def buildJabberWriter(row, resolvedUser=None, journal=None, axlWriter=None):
+    return cucmJabberWriter(sAMAccountName=row['username'],
+                            DID=row['did'],
+                            EpriseExt=row['extension'],
+                            device_pool=row['building'],
+                            City=row['city'],
+                            VM=row['vm'],
+                            VMprofile=row['vmprofile'],
+                            CoS=row['cos'],
+                            SNR=row['snr'],
+                            SNRphone=row['snrphone'],
+                            PIN=row['pin'],
+                            gFirstName=row['firstname'],
+                            gLastName=row['lastname'],
+                            country_code=row['country_code'],
+                            cfw_css=row['cfw_css'],
+                            device_css=row['device_css'],
+                            resolvedUser=resolvedUser,
+                            journal=journal,
+                            axlWriter=axlWriter)
+
+
+def buildVoicemailWriter(row, session=None, config=None):
+    return cupiRestWriter(Alias=row['username'],
+                          Extension="+1" + row['did'],
+                          FirstName=row['firstname'],
+                          LastName=row['lastname'],
+                          EmailAddress=row['emailaddress'],
+                          Template=row['vmtemplate'],
+                          session=session,
+                          config=config)
+
+
+def processUser(row, perform, session=None, resolvedUser=None,
+                journal=None, axlWriter=None, cxnConfig=None, vmPkid=None,
+                vmObjectId=None):
+    # runs the create, delete, reconcile or plan action for a single user
+    # row. journal (ciscoJournal.journalUser) records the finished steps,
+    # the steps done in an earlier run are skipped. axlWriter / cxnConfig
+    # select the cluster, None uses the shared writer and cxn.cfg.
+    # vmPkid / vmObjectId: the user's Unity Connection ids when already
+    # looked up in bulk.
+    if journal is not None and journal.isDone(perform):
+        return {"journal": journal.skipped}
+    myJabber = buildJabberWriter(row, resolvedUser=resolvedUser,
+                                 journal=journal, axlWriter=axlWriter)
+    myVoicemail = buildVoicemailWriter(row, session=session,
+                                       config=cxnConfig)
+
+    status = {}
+    if perform == 'create':
+        status.update({"ccm": myJabber.writeJabber()})
+        # myVoicemail.createNewVoicemail()  # would use for non LDAP use case
+        if voicemailEnabled(row):
+            if journal is not None:
+                status.update({"cxn": journal.run(
+                    'vmImport', myVoicemail.importNewVoicemail, vmPkid)})
+            else:
+                status.update({"cxn": myVoicemail.importNewVoicemail(
+                    vmPkid)})
+    elif perform == 'delete':
+        status.update({"ccm": myJabber.cleanJabber()})
+        status.update({"cxn": myVoicemail.deleteVoicemail(vmObjectId)})
+    elif perform in ['reconcile', 'plan']:
+        # CUCM only, plan reports the writes without making them
+        status.update({"ccm": myJabber.reconcileJabber(
+            dryRun=(perform == 'plan'))})
+    else:
+        raise Exception("Invalid action: {0}".format(perform))
+    if journal is not None and not statusFailures(status):
+        # the whole user, a resumed run does not even build its writers
+        journal.run(perform, lambda: "Success")
+    return status
+
+
+class _prefetchedBlock:
+    # the existence snapshot of a block of rows and how many of its rows
+    # have not completed yet
+
+    def __init__(self, snapshot, pending):
+        self.snapshot = snapshot
+        self.pending = pending
+
+
+class ciscoBatchWriter:
+    # runs ciscoWriter create/delete actions for many users over a bounded
+    # worker pool. All workers share the AXL client from axlWriterRegistry
+    # (or the one given) and one CUPI session.
+
+    _workers = 4
+    _perform = ''
+    _session = None
+    _prefetchSize = 500  # rows whose devices / lines are resolved at once
+
+    def __init__(self, perform, workers=4, session=None, prefetch=True,
+                 journal=None, axlWriter=None, cxnConfig=None):
+        # journal: ciscoJournal recording per user steps, for resume.
+        # axlWriter / cxnConfig: the cluster of this batch, see ciscoClusters
+        if workers < 1:
+            raise Exception("At least one worker is required")
+        self._perform = perform
+        self._workers = workers
+        self._prefetch = prefetch
+        self._resolvedUsers = {}  # username -> names from listUser
+        self._vmPkids = {}  # username -> pkid of the LDAP user to import
+        self._vmObjectIds = {}  # username -> ObjectId of the mailbox
+        self._cupiBulk = None
+        self._blocks = None  # axlExistenceBlocks of a prefetched run
+        self._rowBlocks = {}  # row number -> _prefetchedBlock
+        self._blockLock = threading.Lock()
+        self._journal = journal
+        self._axlWriter = axlWriter
+        self._cxnConfig = cxnConfig
+        if session is None:
+            # one keep-alive connection per worker, a shared session that
+            # is big enough stays in use
+            cupiSessionPool.configure(poolSize=workers)
+            session = cupiSessionPool.getSession()
+        self._session = session
+
+    def getWorkers(self):
+        return self._workers
+
+    def getPerform(self):
+        return self._perform
+
+    def _prefetchedRows(self, rows, axlWriter):
+        # resolves existing devices and lines for each block of rows with a
+        # few SQL queries, so the per user exists checks need no round trip.
+        # Each block keeps its own snapshot until its last row completes,
+        # rows of the previous block still running keep their answers.
+        # Rows are numbered as _runPool numbers them.
+        block = []
+        for index, row in enumerate(rows, start=1):
+            block.append(row)
+            if len(block) >= self._prefetchSize:
+                yield from self._startBlock(axlWriter, index, block)
+                block = []
+        if block:
+            yield from self._startBlock(axlWriter, index, block)
+
+    def _startBlock(self, axlWriter, lastIndex, block):
+        snapshot = axlExistenceSnapshot()
+        self._prefetchBlock(axlWriter, snapshot, block)
+        prefetched = _prefetchedBlock(snapshot, len(block))
+        with self._blockLock:
+            for index in range(lastIndex - len(block) + 1, lastIndex + 1):
+                self._rowBlocks[index] = prefetched
+        self._blocks.add(snapshot)
+        yield from block
+
+    def _rowDone(self, index):
+        # releases the snapshot of a block once its last row completed
+        with self._blockLock:
+            prefetched = self._rowBlocks.pop(index, None)
+            if prefetched is None:
+                return
+            prefetched.pending -= 1
+            if prefetched.pending:
+                return
+        self._blocks.release(prefetched.snapshot)
+
+    def _journalUser(self, row):
+        if self._journal is None or not row.get('username'):
+            return None
+        return self._journal.forUser(row['username'], rowHash(row))
+
+    def _prefetchBlock(self, axlWriter, snapshot, block):
+        # users finished in an earlier run need no lookups
+        block = [row for row in block if not self._isJournaled(row)]
+        if not block:
+            return
+        usernames = [row['username'] for row in block
+                     if row.get('username')]
+        patterns = [cucmJabberWriter.e164Pattern(row['country_code'] or '1',
+                                                 row['did'])
+                    for row in block if row.get('did')]
+        try:
+            axlWriter.prefetchExistence(usernames, patterns,
+                                        snapshot=snapshot)
+        except Exception as e:
+            # the per user checks still work, just one call at a time
+            cbwLogger.info("Existence prefetch failed: %s", e)
+        try:
+            self._resolvedUsers.update(axlWriter.resolveUserNames(usernames))
+        except Exception as e:
+            # each writer falls back to its own getUser
+            cbwLogger.info("User name resolution failed: %s", e)
+        self._prefetchVoicemail(block)
+
+    def _prefetchVoicemail(self, block):
+        # LDAP pkids of the users to import and ObjectIds of the mailboxes
+        # to delete, with a few paged CUPI queries per block
+        imports = [row['username'] for row in block if row.get('username')
+                   and (row.get('perform') or self._perform) == 'create'
+                   and voicemailEnabled(row)]
+        deletes = [row['username'] for row in block if row.get('username')
+                   and (row.get('perform') or self._perform) == 'delete']
+        if not imports and not deletes:
+            return
+        try:
+            if self._cupiBulk is None:
+                self._cupiBulk = cupiBulkWriter(config=self._cxnConfig,
+                                                session=self._session)
+            if imports:
+                self._vmPkids.update(self._cupiBulk.importPkids(imports))
+            if deletes:
+                self._vmObjectIds.update(self._cupiBulk.objectIds(deletes))
+        except Exception as e:
+            # each voicemail writer falls back to its own lookup
+            cbwLogger.info("Voicemail id lookup failed: %s", e)
+
+    def _isJournaled(self, row):
+        journal = self._journalUser(row)
+        return journal is not None and \
+            journal.isDone(row.get('perform') or self._perform)
+
+    def runRow(self, index, row):
+        # never raises, a failure is reported in the result of that row
+        perform = row.get('perform') or self._perform
+        result = {"row": index, "username": row.get('username'),
+                  "action": perform}
+        try:
+            if not row.get('username') or not row.get('did'):
+                raise Exception("username and did are required")
+            result.update(processUser(
+                row, perform, session=self._session,
+                resolvedUser=self._resolvedUsers.pop(row['username'], None),
+                journal=self._journalUser(row), axlWriter=self._axlWriter,
+                cxnConfig=self._cxnConfig,
+                vmPkid=self._vmPkids.pop(row['username'], None),
+                vmObjectId=self._vmObjectIds.pop(row['username'], None)))
+        except Exception as e:
+            cbwLogger.info("Row %s (%s) failed: %s", index,
+                           row.get('username'), e)
+            result.update({"error": str(e)})
+        return result
+
+    def run(self, rows):
+        # yields one result per row, in completion order
+        axlWriter = None
+        if self._prefetch:
+            axlWriter = self._axlWriter or axlWriterRegistry.getWriter()
+            self._blocks = axlExistenceBlocks()
+            axlWriter.usePrefetch(self._blocks)
+            rows = self._prefetchedRows(rows, axlWriter)
+        try:
+            for result in self._runPool(rows):
+                yield result
+        finally:
+            if axlWriter is not None:
+                axlWriter.usePrefetch(None)
+            self._blocks = None
+            self._rowBlocks = {}
+            self._resolvedUsers = {}
+            self._vmPkids = {}
+            self._vmObjectIds = {}
+            self._cupiBulk = None
+
+    def _runPool(self, rows):
+        # At most 2 x workers rows are read ahead of the pool so very large
+        # batch files are never held in memory.
+        window = threading.BoundedSemaphore(self._workers * 2)
+        results = []
+        resultReady = threading.Condition()
+
+        def work(index, row):
+            try:
+                result = self.runRow(index, row)
+            finally:
+                self._rowDone(index)
+                window.release()
+            with resultReady:
+                results.append(result)
+                resultReady.notify()
+
+        submitted = 0
+        returned = 0
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            for index, row in enumerate(rows, start=1):
+                window.acquire()
+                pool.submit(work, index, row)
+                submitted += 1
+                with resultReady:
+                    ready, results[:] = list(results), []
+                for result in ready:
+                    returned += 1
+                    yield result
+            while returned < submitted:
+                with resultReady:
+                    while not results:
+                        resultReady.wait()
+                    ready, results[:] = list(results), []
+                for result in ready:
+                    returned += 1
+                    yield result
+        cbwLogger.info("Batch completed, %s rows processed", returned)
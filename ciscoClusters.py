@@ -0,0 +1,283 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import json
+import queue
+import logging
+import threading
+from cucmAxlWriter import cucmAxlWriter
+from cupiRestWriter import cupiSessionPool
+from ucAppConfig import cxnAppConfig
+from ciscoBatchWriter import ciscoBatchWriter
+
+ccLogger = logging.getLogger(__name__)
+
+# Several CUCM / Unity Connection clusters in one run. clusters.json names
+# the clusters, the ucm / cxn config files of each and the sites and
+# subsites it serves:
+#
+# {"default": "amer",
+#  "clusters": {
+#     "amer": {"ucm": "ucm.cfg", "cxn": "cxn.cfg", "workers": 8,
+#              "axlReadRate": 20, "axlWriteRate": 10},
+#     "emea": {"ucm": "ucm-emea.cfg", "cxn": "cxn-emea.cfg", "workers": 4,
+#              "axlWriteRate": 5, "cupiPoolSize": 4,
+#              "sites": ["London", "Paris"], "subsites": ["Canary Wharf"]}}}
+#
+# A row goes to the cluster in its cluster field, else the cluster of its
+# subsite (building), else of its site (city), else the default. Each
+# cluster has its own AXL client, rate budget, CUPI session and workers,
+# built when its first row arrives, and runs its rows on its own thread.
+
+
+class ciscoCluster:
+
+    def __init__(self, name, settings, readRate=None, writeRate=None,
+                 fastSerialize=False, replicationLag=None):
+        # readRate / writeRate / replicationLag apply when the cluster sets
+        # none of its own
+        self.name = name
+        self.ucmCfg = settings.get('ucm', 'ucm.cfg')
+        self.cxnCfg = settings.get('cxn', 'cxn.cfg')
+        self.workers = int(settings.get('workers', 4))
+        self.readRate = settings.get('axlReadRate', readRate)
+        self.writeRate = settings.get('axlWriteRate', writeRate)
+        self.replicationLag = settings.get('replicationLag', replicationLag)
+        self.cupiPoolSize = int(settings.get('cupiPoolSize', self.workers))
+        self.sites = settings.get('sites', [])
+        self.subsites = settings.get('subsites', [])
+        if self.workers < 1:
+            raise Exception("Cluster {0} needs at least one worker".format(
+                name))
+        self._fastSerialize = fastSerialize
+        self._axlWriter = None
+        self._cxnConfig = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def getAxlWriter(self):
+        with self._lock:
+            if self._axlWriter is None:
+                ccLogger.info("Building cucmAxlWriter for cluster %s",
+                              self.name)
+                self._axlWriter = cucmAxlWriter(
+                    readRate=self.readRate, writeRate=self.writeRate,
+                    fastSerialize=self._fastSerialize,
+                    cfgFileName=self.ucmCfg,
+                    replicationLag=self.replicationLag)
+            return self._axlWriter
+
+    def getCxnConfig(self):
+        with self._lock:
+            if self._cxnConfig is None:
+                self._cxnConfig = cxnAppConfig(self.cxnCfg)
+            return self._cxnConfig
+
+    def getSession(self):
+        # keep-alive CUPI connections of this cluster only
+        with self._lock:
+            if self._session is None:
+                self._session = cupiSessionPool.buildSession(
+                    self.cupiPoolSize, cupiSessionPool._retries,
+                    cupiSessionPool._backoff)
+                ccLogger.info("CUPI session for cluster %s created, pool=%s",
+                              self.name, self.cupiPoolSize)
+            return self._session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class ciscoClusters:
+    # the clusters of clusters.json and the routing of rows to them
+
+    def __init__(self, fileName, readRate=None, writeRate=None,
+                 fastSerialize=False, replicationLag=None):
+        with open(fileName) as clustersFile:
+            clustersCfg = json.load(clustersFile)
+        self._clusters = {}
+        self._sites = {}
+        self._subsites = {}
+        for name, settings in sorted(clustersCfg['clusters'].items()):
+            cluster = ciscoCluster(name, settings, readRate=readRate,
+                                   writeRate=writeRate,
+                                   fastSerialize=fastSerialize,
+                                   replicationLag=replicationLag)
+            self._clusters[name.lower()] = cluster
+            self._addRoutes(self._sites, cluster.sites, cluster, 'Site')
+            self._addRoutes(self._subsites, cluster.subsites, cluster,
+                            'Subsite')
+        self._default = None
+        if clustersCfg.get('default'):
+            self._default = self.getCluster(clustersCfg['default'])
+        ccLogger.info("%s clusters loaded from %s", len(self._clusters),
+                      fileName)
+
+    @staticmethod
+    def _addRoutes(routes, names, cluster, kind):
+        for name in names:
+            key = name.strip().lower()
+            if key in routes and routes[key] is not cluster:
+                raise Exception("{0} {1} is in clusters {2} and {3}".format(
+                    kind, name, routes[key].name, cluster.name))
+            routes[key] = cluster
+
+    def getCluster(self, name):
+        try:
+            return self._clusters[name.strip().lower()]
+        except KeyError:
+            raise Exception("Unknown cluster: {0}".format(name))
+
+    def getClusterNames(self):
+        return [cluster.name for cluster in self._clusters.values()]
+
+    def route(self, row):
+        # cluster of a row, raises when no cluster serves it
+        if row.get('cluster'):
+            return self.getCluster(row['cluster'])
+        for field, routes in [('building', self._subsites),
+                              ('city', self._sites)]:
+            value = (row.get(field) or '').strip().lower()
+            if value in routes:
+                return routes[value]
+        if self._default is None:
+            raise Exception("No cluster for site {0} / subsite {1}".format(
+                row.get('city'), row.get('building')))
+        return self._default
+
+    def close(self):
+        for cluster in self._clusters.values():
+            cluster.close()
+
+
+class ciscoClusterBatchWriter:
+    # runs a batch over several clusters at once: one ciscoBatchWriter per
+    # cluster on its own thread, fed through a queue. A cluster that falls
+    # behind only blocks the reading of the batch file once _backlog of its
+    # rows are waiting, until then the other clusters keep going.
+
+    _backlog = 5000  # rows queued per cluster
+    _end = None  # end of a cluster's rows
+
+    def __init__(self, clusters, perform, journal=None, prefetch=True):
+        self._clusters = clusters
+        self._perform = perform
+        self._journal = journal
+        self._prefetch = prefetch
+
+    def _clusterRows(self, feed, indexes):
+        # the rows of a cluster, remembering the batch row number and the
+        # row of each until its result arrives
+        for local, (index, row) in enumerate(iter(feed.get, self._end),
+                                             start=1):
+            indexes[local] = (index, row)
+            yield row
+
+    def _runCluster(self, cluster, feed, results):
+        indexes = {}  # cluster row number -> (batch row number, row)
+        rows = self._clusterRows(feed, indexes)
+        try:
+            batch = ciscoBatchWriter(self._perform, workers=cluster.workers,
+                                     session=cluster.getSession(),
+                                     prefetch=self._prefetch,
+                                     journal=self._journal,
+                                     axlWriter=cluster.getAxlWriter(),
+                                     cxnConfig=cluster.getCxnConfig())
+            for result in batch.run(rows):
+                result['row'] = indexes.pop(result['row'])[0]
+                result['cluster'] = cluster.name
+                results.put(result)
+        except Exception as e:
+            # the cluster could not be set up or its batch stopped: the
+            # rows still waiting for a result and the rest of the feed fail
+            ccLogger.info("Cluster %s failed: %s", cluster.name, e)
+            for row in rows:
+                pass
+            for local in sorted(indexes):
+                index, row = indexes.pop(local)
+                results.put({"row": index, "username": row.get('username'),
+                             "action": row.get('perform') or self._perform,
+                             "cluster": cluster.name, "error": str(e)})
+        finally:
+            results.put(self._end)
+
+    @staticmethod
+    def _ready(results):
+        ready = []
+        while True:
+            try:
+                ready.append(results.get_nowait())
+            except queue.Empty:
+                return ready
+
+    def _put(self, feed, item, results, finished):
+        # yields the results that arrive while the feed is full
+        while True:
+            try:
+                feed.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                for result in self._ready(results):
+                    if result is self._end:
+                        finished.append(result)
+                    else:
+                        yield result
+
+    def _close(self, feed, thread):
+        # the end marker waits for room only while the cluster thread is
+        # still there to make it
+        while thread.is_alive():
+            try:
+                feed.put(self._end, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def run(self, rows):
+        # yields one result per row, in completion order. The result has
+        # the batch row number and the cluster.
+        results = queue.Queue()
+        feeds = {}
+        threads = {}
+        finished = []
+        try:
+            for index, row in enumerate(rows, start=1):
+                try:
+                    cluster = self._clusters.route(row)
+                except Exception as e:
+                    yield {"row": index, "username": row.get('username'),
+                           "action": row.get('perform') or self._perform,
+                           "error": str(e)}
+                    continue
+                if cluster.name not in feeds:
+                    feeds[cluster.name] = queue.Queue(self._backlog)
+                    thread = threading.Thread(
+                        target=self._runCluster,
+                        args=(cluster, feeds[cluster.name], results),
+                        name='cluster-' + cluster.name)
+                    thread.start()
+                    threads[cluster.name] = thread
+                yield from self._put(feeds[cluster.name], (index, row),
+                                     results, finished)
+                for result in self._ready(results):
+                    if result is self._end:
+                        finished.append(result)
+                    else:
+                        yield result
+        finally:
+            for name, feed in feeds.items():
+                self._close(feed, threads[name])
+        while len(finished) < len(threads):
+            result = results.get()
+            if result is self._end:
+                finished.append(result)
+            else:
+                yield result
+        for thread in threads.values():
+            thread.join()
+        ccLogger.info("Cluster batch completed on %s clusters",
+                      len(threads))
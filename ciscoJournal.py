@@ -0,0 +1,122 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import json
+import time
+import logging
+import sqlite3
+import threading
+
+cjLogger = logging.getLogger(__name__)
+
+# Write-ahead journal of a bulk run. Every step of every user (lineCreate,
+# lineUpdate, deviceCreate.CSF, ..., endUserUpdate, rdpCreate, vmImport and
+# the user as a whole) is recorded in SQLite as soon as it finishes. A run
+# resumed with the same journal skips the steps recorded as done, so a
+# restart after a crash, a CUCM failover or Ctrl-C only costs the work
+# that is left. Steps are tied to a hash of the user's row; when the row
+# changed between runs its steps are run again.
+#
+# WAL mode with synchronous=NORMAL: a committed step survives the process
+# dying, and recording it costs no fsync of the whole database.
+
+
+class ciscoJournal:
+
+    def __init__(self, fileName, resume=False):
+        # resume=False starts a new run and clears what an earlier run
+        # recorded in this file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(fileName, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS steps ('
+                'username TEXT NOT NULL, step TEXT NOT NULL, '
+                'rowHash TEXT NOT NULL, status TEXT NOT NULL, detail TEXT, '
+                'updated REAL NOT NULL, PRIMARY KEY (username, step))')
+            if not resume:
+                self._db.execute('DELETE FROM steps')
+        # completed steps are held in memory, a lookup costs no query
+        self._done = set(self._db.execute(
+            "SELECT username, step, rowHash FROM steps "
+            "WHERE status = 'done'"))
+        if resume:
+            cjLogger.info("Journal %s resumed, %s steps done", fileName,
+                          len(self._done))
+
+    def forUser(self, username, rowHash):
+        return journalUser(self, username, rowHash)
+
+    def isDone(self, username, step, rowHash):
+        with self._lock:
+            return (username, step, rowHash) in self._done
+
+    def record(self, username, step, rowHash, status, detail=None):
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO steps (username, step, rowHash, '
+                    'status, detail, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                    (username, step, rowHash, status, detail, time.time()))
+            if status == 'done':
+                self._done.add((username, step, rowHash))
+            else:
+                self._done.discard((username, step, rowHash))
+
+    def getCounts(self):
+        # {status: steps}
+        with self._lock:
+            return dict(self._db.execute(
+                'SELECT status, COUNT(*) FROM steps GROUP BY status'))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class journalUser:
+    # the journal as seen by the writers of one user
+
+    skipped = "Skipped, done in an earlier run"
+
+    def __init__(self, journal, username, rowHash):
+        self._journal = journal
+        self._username = username
+        self._rowHash = rowHash
+
+    def isDone(self, step):
+        return self._journal.isDone(self._username, step, self._rowHash)
+
+    @staticmethod
+    def isSuccess(result):
+        # "Success", or a JSON status (vmImport) whose values all are
+        if result == "Success":
+            return True
+        try:
+            status = json.loads(result)
+        except (TypeError, ValueError):
+            return False
+        return isinstance(status, dict) and bool(status) and \
+            all(value == "Success" for value in status.values())
+
+    def run(self, step, operation, *args):
+        # operation(*args) unless the step is already done. Only a Success
+        # result is recorded as done, any other result as failed so a
+        # resumed run tries the step again. An exception is recorded as
+        # failed and raised again.
+        if self.isDone(step):
+            cjLogger.debug("%s %s skipped", self._username, step)
+            return self.skipped
+        try:
+            result = operation(*args)
+        except Exception as e:
+            self._journal.record(self._username, step, self._rowHash,
+                                 'failed', str(e)[:1000])
+            raise
+        state = 'done' if self.isSuccess(result) else 'failed'
+        self._journal.record(self._username, step, self._rowHash, state,
+                             str(result)[:1000])
+        return result
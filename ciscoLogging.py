@@ -0,0 +1,125 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import os  # log directory, environment
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# modules only create their logger with logging.getLogger(__name__), the
+# application entry point calls setupLogging once
+
+_defaultLevel = 'INFO'
+_payloadLimit = 4096  # characters of a zeep payload written to the log
+_infoFileName = 'CiscoInfo.log'
+_debugFileName = 'CiscoDebug.log'
+_envelopeFileName = 'zeepDebug.log'
+_logFormat = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_lock = threading.Lock()
+_listener = None
+_queueHandler = None
+
+
+class lazyPayload:
+    # wraps a zeep object (or anything large) so it is only turned into text
+    # when the record is logged at the current level, and then truncated
+
+    __slots__ = ('_payload', '_limit')
+
+    def __init__(self, payload, limit=None):
+        self._payload = payload
+        self._limit = _payloadLimit if limit is None else limit
+
+    def __str__(self):
+        text = str(self._payload)
+        if self._limit and len(text) > self._limit:
+            return '{0}... [{1} chars]'.format(text[:self._limit], len(text))
+        return text
+
+
+class _deferredQueueHandler(QueueHandler):
+    # The message is merged with its arguments in the calling thread, so a
+    # zeep object is rendered before the caller can change it again (a
+    # package reused for a retry, a shared profile). Formatting, the
+    # timestamp and the traceback are left to the listener.
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def getLevel(level=None):
+    # level name or number, else CISCO_LOG_LEVEL, else INFO
+    if level is None:
+        level = os.environ.get('CISCO_LOG_LEVEL', _defaultLevel)
+    if isinstance(level, str):
+        levelNumber = logging.getLevelName(level.upper())
+        if not isinstance(levelNumber, int):
+            raise Exception("Unknown log level {0}".format(level))
+        return levelNumber
+    return level
+
+
+def _fileHandler(logDir, fileName, level, append):
+    fileHandler = logging.FileHandler(os.path.join(logDir, fileName),
+                                      mode='a' if append else 'w')
+    fileHandler.setLevel(level)
+    fileHandler.setFormatter(logging.Formatter(_logFormat))
+    return fileHandler
+
+
+def setupLogging(level=None, logDir=None, captureEnvelopes=False,
+                 append=False):
+    # routes every logger through one queue to a background writer thread.
+    # Safe to call more than once, later calls only change the level.
+    global _listener, _queueHandler
+    levelNumber = getLevel(level)
+    rootLogger = logging.getLogger()
+    with _lock:
+        rootLogger.setLevel(levelNumber)
+        if _listener is not None:
+            return
+        logDir = logDir or os.getcwd()
+        handlers = [_fileHandler(logDir, _infoFileName,
+                                 max(levelNumber, logging.INFO), append)]
+        if levelNumber <= logging.DEBUG:
+            handlers.append(_fileHandler(logDir, _debugFileName,
+                                         logging.DEBUG, append))
+
+        zeepLogger = logging.getLogger('zeep.transports')
+        if captureEnvelopes:
+            # full SOAP envelopes, only when asked for
+            zeepLogger.setLevel(logging.DEBUG)
+            zeepLogger.propagate = False
+            zeepLogger.addHandler(_fileHandler(logDir, _envelopeFileName,
+                                               logging.DEBUG, append))
+        else:
+            logging.getLogger('zeep').setLevel(
+                max(levelNumber, logging.WARNING))
+
+        logQueue = queue.Queue(-1)
+        _queueHandler = _deferredQueueHandler(logQueue)
+        rootLogger.addHandler(_queueHandler)
+        _listener = QueueListener(logQueue, *handlers,
+                                  respect_handler_level=True)
+        _listener.start()
+        atexit.register(stopLogging)
+
+
+def stopLogging():
+    # flushes the queue and closes the files
+    global _listener, _queueHandler
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for listenerHandler in _listener.handlers:
+            listenerHandler.close()
+        logging.getLogger().removeHandler(_queueHandler)
+        _listener = None
+        _queueHandler = None
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import os  # textfile directory
+import json
+import time
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+cmLogger = logging.getLogger(__name__)
+
+# seconds, the last bucket is +Inf
+_latencyBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+
+def soapOperation(headers):
+    # AXL sends SOAPAction: "CUCM:DB ver=12.5 getPhone"
+    action = headers.get('SOAPAction', '') if headers else ''
+    action = action.strip('"').split(' ')[-1]
+    return action or 'unknown'
+
+
+class _operationStats:
+
+    __slots__ = ('count', 'errors', 'notFound', 'seconds', 'maxSeconds',
+                 'bytesOut', 'bytesIn', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.notFound = 0  # expected misses of get / exists probes
+        self.seconds = 0.0
+        self.maxSeconds = 0.0
+        self.bytesOut = 0
+        self.bytesIn = 0
+        self.buckets = [0] * (len(_latencyBuckets) + 1)
+
+    def observe(self, seconds, error, notFound=False):
+        self.count += 1
+        if error:
+            self.errors += 1
+        if notFound:
+            self.notFound += 1
+        self.seconds += seconds
+        self.maxSeconds = max(self.maxSeconds, seconds)
+        for index, bound in enumerate(_latencyBuckets):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def quantile(self, fraction):
+        # upper bound of the bucket holding the quantile, good enough to
+        # tell a 50ms getPhone from a 2s addPhone
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, bucketCount in enumerate(self.buckets):
+            seen += bucketCount
+            if seen >= rank:
+                if index < len(_latencyBuckets):
+                    return _latencyBuckets[index]
+                return self.maxSeconds
+        return self.maxSeconds
+
+
+class ciscoMetrics:
+    # process wide call counts, error counts, bytes and latency histograms
+    # per (system, operation), system being 'axl' or 'cupi'
+
+    _stats = {}
+    _lock = threading.Lock()
+    _started = time.time()
+    _textfileThread = None
+    _textfileStop = None
+
+    @classmethod
+    def _get(cls, system, operation):
+        key = (system, operation)
+        stats = cls._stats.get(key)
+        if stats is None:
+            stats = cls._stats.setdefault(key, _operationStats())
+        return stats
+
+    @classmethod
+    def observe(cls, system, operation, seconds, error=False,
+                notFound=False):
+        with cls._lock:
+            cls._get(system, operation).observe(seconds, error, notFound)
+
+    @classmethod
+    def addBytes(cls, system, operation, bytesOut=0, bytesIn=0):
+        with cls._lock:
+            stats = cls._get(system, operation)
+            stats.bytesOut += bytesOut
+            stats.bytesIn += bytesIn
+
+    @classmethod
+    @contextmanager
+    def timer(cls, system, operation, isNotFound=None):
+        # times the block, an exception counts as an error and is re-raised.
+        # isNotFound(exception) tells the expected misses of a lookup, they
+        # are counted as notFound instead.
+        started = time.monotonic()
+        error = False
+        notFound = False
+        try:
+            yield
+        except BaseException as e:
+            if isNotFound is not None and isNotFound(e):
+                notFound = True
+            else:
+                error = True
+            raise
+        finally:
+            cls.observe(system, operation, time.monotonic() - started, error,
+                        notFound)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._stats = {}
+            cls._started = time.time()
+
+    @classmethod
+    def summary(cls):
+        # plain dict, suitable for json.dumps
+        with cls._lock:
+            items = sorted(cls._stats.items())
+            operations = {}
+            for (system, operation), stats in items:
+                operations.setdefault(system, {})[operation] = {
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "notFound": stats.notFound,
+                    "bytesOut": stats.bytesOut,
+                    "bytesIn": stats.bytesIn,
+                    "totalSeconds": round(stats.seconds, 6),
+                    "avgSeconds": round(stats.seconds / stats.count, 6)
+                    if stats.count else 0.0,
+                    "p50Seconds": stats.quantile(0.5),
+                    "p95Seconds": stats.quantile(0.95),
+                    "maxSeconds": round(stats.maxSeconds, 6)}
+            return {"elapsedSeconds": round(time.time() - cls._started, 3),
+                    "operations": operations}
+
+    @classmethod
+    def toJson(cls):
+        return json.dumps(cls.summary(), indent=2, sort_keys=True)
+
+    @staticmethod
+    def _labels(system, operation, extra=''):
+        text = 'system="{0}",operation="{1}"'.format(
+            system, operation.replace('\\', '\\\\').replace('"', '\\"'))
+        return '{' + text + extra + '}'
+
+    @classmethod
+    def toPrometheus(cls):
+        # Prometheus text exposition format (node_exporter textfile or
+        # the daemon's GET /metrics)
+        lines = []
+        with cls._lock:
+            items = sorted(cls._stats.items())
+            counters = [
+                ('cisco_requests_total', 'Requests sent', 'count'),
+                ('cisco_request_errors_total', 'Requests that failed',
+                 'errors'),
+                ('cisco_request_not_found_total',
+                 'Lookups answered with not found', 'notFound'),
+                ('cisco_request_bytes_sent_total', 'Request body bytes',
+                 'bytesOut'),
+                ('cisco_response_bytes_received_total',
+                 'Response body bytes', 'bytesIn')]
+            for name, helpText, attribute in counters:
+                lines.append('# HELP {0} {1}'.format(name, helpText))
+                lines.append('# TYPE {0} counter'.format(name))
+                for (system, operation), stats in items:
+                    lines.append('{0}{1} {2}'.format(
+                        name, cls._labels(system, operation),
+                        getattr(stats, attribute)))
+            name = 'cisco_request_duration_seconds'
+            lines.append('# HELP {0} Request latency'.format(name))
+            lines.append('# TYPE {0} histogram'.format(name))
+            for (system, operation), stats in items:
+                cumulative = 0
+                for bound, bucketCount in zip(_latencyBuckets + ('+Inf',),
+                                              stats.buckets):
+                    cumulative += bucketCount
+                    lines.append('{0}_bucket{1} {2}'.format(
+                        name, cls._labels(system, operation,
+                                          ',le="{0}"'.format(bound)),
+                        cumulative))
+                lines.append('{0}_sum{1} {2:.6f}'.format(
+                    name, cls._labels(system, operation), stats.seconds))
+                lines.append('{0}_count{1} {2}'.format(
+                    name, cls._labels(system, operation), stats.count))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def writeTextfile(cls, fileName):
+        # atomic, the textfile collector must never read a partial file
+        directory = os.path.dirname(os.path.abspath(fileName))
+        fileFd, tempFileName = tempfile.mkstemp(dir=directory,
+                                                suffix='.tmp')
+        try:
+            with os.fdopen(fileFd, 'w') as textFile:
+                textFile.write(cls.toPrometheus())
+            os.chmod(tempFileName, 0o644)
+            os.replace(tempFileName, fileName)
+        finally:
+            if os.path.exists(tempFileName):
+                os.remove(tempFileName)
+
+    @classmethod
+    def writeSummary(cls, fileName):
+        with open(fileName, 'w') as summaryFile:
+            summaryFile.write(cls.toJson())
+
+    @classmethod
+    def startTextfileWriter(cls, fileName, interval=15):
+        # rewrites the textfile every interval seconds until stopped
+        cls.stopTextfileWriter()
+        stop = threading.Event()
+
+        def writer():
+            while not stop.wait(interval):
+                try:
+                    cls.writeTextfile(fileName)
+                except Exception as e:
+                    cmLogger.info("Metrics textfile not written: %s", e)
+            cls.writeTextfile(fileName)
+
+        cls._textfileStop = stop
+        cls._textfileThread = threading.Thread(target=writer,
+                                               name='ciscoMetrics',
+                                               daemon=True)
+        cls._textfileThread.start()
+
+    @classmethod
+    def stopTextfileWriter(cls):
+        if cls._textfileThread is not None:
+            cls._textfileStop.set()
+            cls._textfileThread.join()
+            cls._textfileThread = None
+            cls._textfileStop = None
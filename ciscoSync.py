@@ -0,0 +1,175 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import json
+import time
+import logging
+import sqlite3
+from ciscoBatchWriter import ciscoBatchWriter, provisioningFields, rowHash, \
+    buildVoicemailWriter, voicemailEnabled, statusFailures
+
+csLogger = logging.getLogger(__name__)
+
+# Incremental sync from an HR / LDAP export. Every user of the export is
+# hashed over the ciscoWriter provisioning fields and compared with the
+# hash stored after the last successful push:
+#  * new users are created (writeJabber and the voicemail import)
+#  * changed users are reconciled (only drifted CUCM objects are written)
+#    and their mailbox is brought in line (imported, extension set or
+#    deleted)
+#  * users missing from the export are deleted (cleanJabber, voicemail)
+#  * unchanged users are skipped
+# A user's stored hash is only written or removed after its action
+# succeeded, without an error or a "Fail" status, so a failed user is
+# retried by the next run. A user whose create failed is stored without a
+# hash and retried as a reconcile, which only adds what is missing. See
+# ciscoBatchWriter.statusFailures for what counts as failed.
+
+
+class ciscoSyncStore:
+    # username -> hash and fields of the last successful push, in SQLite
+
+    def __init__(self, fileName):
+        self._db = sqlite3.connect(fileName)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS users ('
+                'username TEXT PRIMARY KEY, hash TEXT NOT NULL, '
+                'fields TEXT NOT NULL, synced REAL NOT NULL)')
+
+    def hashes(self):
+        return dict(self._db.execute('SELECT username, hash FROM users'))
+
+    def getRow(self, username):
+        found = self._db.execute('SELECT fields FROM users WHERE '
+                                 'username = ?', (username,)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def markSynced(self, username, digest, row):
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO users (username, hash, fields, '
+                'synced) VALUES (?, ?, ?, ?)',
+                (username, digest, json.dumps(provisioningFields(row)),
+                 time.time()))
+
+    def markPending(self, username, row):
+        # known but not synced, the next run reconciles the user
+        self.markSynced(username, '', row)
+
+    def remove(self, username):
+        with self._db:
+            self._db.execute('DELETE FROM users WHERE username = ?',
+                             (username,))
+
+    def getUserCount(self):
+        return self._db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+class ciscoSync:
+
+    def __init__(self, store, workers=4, session=None, remove=True):
+        # remove=False leaves users missing from the export alone
+        self._store = store
+        self._workers = workers
+        self._session = session
+        self._remove = remove
+        self.counts = {}
+
+    def _changedRows(self, rows, known, pending):
+        # new and changed rows of the export, then the removed users. The
+        # store is only read here, on the thread consuming the results.
+        seen = set()
+        for row in rows:
+            username = row.get('username')
+            if username in seen:
+                csLogger.info("Duplicate user %s in the export skipped",
+                              username)
+                continue
+            seen.add(username)
+            digest = rowHash(row)
+            if username and known.get(username) == digest:
+                self.counts['unchanged'] += 1
+                continue
+            previous = None
+            if username in known:
+                perform, count = 'reconcile', 'changed'
+                previous = self._store.getRow(username)
+            else:
+                perform, count = 'create', 'new'
+            self.counts[count] += 1
+            row = dict(row, perform=perform)
+            pending[username] = (digest, row, previous)
+            yield row
+
+        if not self._remove:
+            return
+        if not seen:
+            # an empty export is far more likely a broken HR feed than
+            # everybody leaving
+            csLogger.info("Export is empty, no users are removed")
+            return
+        for username in sorted(set(known) - seen):
+            row = self._store.getRow(username)
+            row['perform'] = 'delete'
+            self.counts['removed'] += 1
+            pending[username] = (None, row, None)
+            yield row
+
+    def _pushVoicemail(self, row, previous):
+        # the Unity Connection side of a reconciled user, from the mailbox
+        # as it is: imported when voicemail is on and there is none, its
+        # extension set when the DID changed, deleted when voicemail is
+        # off. The template only applies to an import.
+        writer = buildVoicemailWriter(row, session=self._session)
+        try:
+            objectId = writer.findVmObjectId()
+            if voicemailEnabled(row):
+                if objectId is None:
+                    return writer.importNewVoicemail()
+                if previous is None or previous.get('did') != row['did']:
+                    return writer.updateVoicemailExtension(objectId)
+            elif objectId is not None:
+                return writer.deleteVoicemail(objectId)
+        except Exception as e:
+            csLogger.info("Voicemail of %s not synced: %s", row['username'],
+                          e)
+            return "Fail: {0}".format(e)
+        return None
+
+    def run(self, rows):
+        # yields one batch result per dispatched user, see ciscoBatchWriter
+        self.counts = {'new': 0, 'changed': 0, 'unchanged': 0, 'removed': 0,
+                       'failed': 0}
+        known = self._store.hashes()
+        pending = {}
+        batch = ciscoBatchWriter('create', workers=self._workers,
+                                 session=self._session)
+        for result in batch.run(self._changedRows(rows, known, pending)):
+            username = result.get('username')
+            digest, row, previous = pending.pop(username, (None, None, None))
+            if username is not None and 'error' not in result and \
+                    result['action'] == 'reconcile':
+                # reconcile covers CUCM only
+                cxn = self._pushVoicemail(row, previous)
+                if cxn is not None:
+                    result['cxn'] = cxn
+            failures = statusFailures(result)
+            if 'error' in result or username is None or failures:
+                self.counts['failed'] += 1
+                if failures:
+                    csLogger.info("%s not synced: %s", username,
+                                  '; '.join(failures))
+                if username is not None and result['action'] == 'create':
+                    self._store.markPending(username, row)
+            elif result['action'] == 'delete':
+                self._store.remove(username)
+            else:
+                self._store.markSynced(username, digest, row)
+            yield result
+        csLogger.info("Sync completed: %s", json.dumps(self.counts,
+                                                      sort_keys=True))
@@ -6,28 +6,22 @@ import sys
 import logging
 import json
 from optparse import OptionParser
+from ciscoBatchWriter import ciscoBatchWriter, processUser, readBatchFile
+from ciscoBatchWriter import normalizeRow
+from ciscoSync import ciscoSync, ciscoSyncStore
+from ciscoJournal import ciscoJournal
+from ciscoClusters import ciscoClusters, ciscoClusterBatchWriter
+from ciscoWriterDaemon import sendJob
 from cucmJabberWriter import cucmJabberWriter
-from cupiRestWriter import cupiRestWriter
+from cucmAxlWriter import cucmAxlWriter, axlWriterRegistry
+from ciscoLogging import setupLogging
+from ciscoMetrics import ciscoMetrics
 
 cwLogger = logging.getLogger(__name__)
-cwLogger.setLevel(logging.DEBUG)
-infoHandler = logging.FileHandler('CiscoInfo.log', mode='w')
-infoHandler.setLevel(logging.INFO)
-debugHandler = logging.FileHandler('CiscoDebug.log', mode='w')
-debugHandler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - \
-                                %(message)s')
-infoHandler.setFormatter(formatter)
-debugHandler.setFormatter(formatter)
-cwLogger.addHandler(infoHandler)
-cwLogger.addHandler(debugHandler)
-cwLogger.addHandler(logging.StreamHandler(sys.stdout))
-cwLogger.info("Begin CiscoWriter Info Logging")
-cwLogger.debug("Begin CiscoWriter Debug Logging")
 
 parser = OptionParser()
 parser.add_option("-a", "--action", action="store", type="string",
-                  dest="perform", help="create/delete")
+                  dest="perform", help="create/delete/reconcile/plan/sync")
 parser.add_option("-u", "--username", action="store", type="string",
                   dest="username", help="username of jabber user")
 parser.add_option("-f", "--firstname", action="store", type="string",
@@ -66,8 +60,64 @@ parser.add_option("-r", "--singlenumberreach", action="store", type="string",
                   dest="snr", help="jabber user Single Number Reach T/F")
 parser.add_option("-m", "--snrdid", action="store", type="string",
                   dest="snrphone", help="Mobile Phone of jabber SNR user")
+parser.add_option("-x", "--batchfile", action="store", type="string",
+                  dest="batchfile",
+                  help="CSV or JSONL file of users to create/delete")
+parser.add_option("-n", "--workers", action="store", type="int",
+                  dest="workers", default=4,
+                  help="Number of concurrent workers for a batch file")
+parser.add_option("-j", "--deviceworkers", action="store", type="int",
+                  dest="deviceworkers", default=1,
+                  help="Jabber device types written concurrently per user")
+parser.add_option("--axlreadrate", action="store", type="float",
+                  dest="axlreadrate", help="AXL read requests per second")
+parser.add_option("--axlwriterate", action="store", type="float",
+                  dest="axlwriterate", help="AXL write requests per second")
+parser.add_option("--replicationlag", action="store", type="float",
+                  dest="replicationlag", help="Seconds an object written by "
+                  "this run is read from the publisher, not a subscriber")
+parser.add_option("--daemon", action="store", type="string", dest="daemon",
+                  help="Send the job to ciscoWriterDaemon, e.g. "
+                  "http://127.0.0.1:8088 or unix:///run/ciscoWriter.sock")
+parser.add_option("--daemontoken", action="store", type="string",
+                  dest="daemontoken", help="Job token file of the daemon, "
+                  "default ~/.ciscoWriterDaemon.token")
+parser.add_option("--loglevel", action="store", type="string",
+                  dest="loglevel", help="DEBUG/INFO/WARNING, default "
+                  "$CISCO_LOG_LEVEL or INFO")
+parser.add_option("--envelopes", action="store_true", dest="envelopes",
+                  default=False, help="Log full SOAP envelopes to "
+                  "zeepDebug.log")
+parser.add_option("--metrics", action="store", type="string",
+                  dest="metrics", help="Write a JSON summary of AXL / CUPI "
+                  "call counts and latencies to this file")
+parser.add_option("--promfile", action="store", type="string",
+                  dest="promfile", help="Write the same metrics as a "
+                  "Prometheus textfile")
+parser.add_option("--journal", action="store", type="string", dest="journal",
+                  help="SQLite journal of the per user steps of a batch file")
+parser.add_option("--resume", action="store_true", dest="resume",
+                  default=False, help="Continue the run recorded in "
+                  "--journal, skipping the steps it finished")
+parser.add_option("--syncdb", action="store", type="string", dest="syncdb",
+                  default="ciscoSync.db",
+                  help="SQLite state of the sync action (default ciscoSync.db)")
+parser.add_option("--syncnoremove", action="store_true", dest="syncnoremove",
+                  default=False, help="Sync never deletes users missing "
+                  "from the export")
+parser.add_option("--fastserialize", action="store_true",
+                  dest="fastserialize", default=False,
+                  help="Render the hot AXL write envelopes from templates")
+parser.add_option("--clusters", action="store", type="string",
+                  dest="clusters", help="JSON file of the CUCM / Unity "
+                  "clusters, users are routed by site, subsite or --cluster")
+parser.add_option("--cluster", action="store", type="string", dest="cluster",
+                  help="Cluster of the user, from --clusters")
 (options, args) = parser.parse_args()
 
+setupLogging(level=options.loglevel, captureEnvelopes=options.envelopes)
+cwLogger.addHandler(logging.StreamHandler(sys.stdout))
+
 '''./ciscoWriter.py -a create -u tdurden -e 223611 -d 2065551234 -s Tampa
  -i Northwoods -g 54321 -v True -p CUST-No-Voicemail -b tdurden@apitest.org
  -t voicemailusertemplate -c International -r False -m 4255551212'''
@@ -84,41 +134,85 @@ Line Calling Search Space
 "<City> <CoS> CSS"	e.g.  "Beaverton International CSS"
 '''
 
-myJabber = cucmJabberWriter(sAMAccountName=options.username,
-                            DID=options.did,
-                            EpriseExt=options.extension,
-                            device_pool=options.building,
-                            City=options.city,
-                            VM=options.vm,
-                            VMprofile=options.vmprofile,
-                            CoS=options.cos,
-                            SNR=options.snr,
-                            SNRphone=options.snrphone,
-                            PIN=options.pin,
-                            gFirstName=options.firstname,
-                            gLastName=options.lastname,
-                            country_code=options.country_code,
-                            cfw_css=options.cfw_css,
-                            device_css=options.device_css)
+cucmJabberWriter.setDeviceWorkers(options.deviceworkers)
+if options.axlreadrate or options.axlwriterate or options.fastserialize \
+        or options.replicationlag is not None:
+    axlWriterRegistry.setFactory(
+        lambda: cucmAxlWriter(readRate=options.axlreadrate,
+                              writeRate=options.axlwriterate,
+                              fastSerialize=options.fastserialize,
+                              replicationLag=options.replicationlag))
 
-myVoicemail = cupiRestWriter(Alias=options.username,
-                             Extension="+1" + options.did,
-                             FirstName=options.firstname,
-                             LastName=options.lastname,
-                             EmailAddress=options.emailaddress,
-                             Template=options.vmtemplate)
+myClusters = None
+if options.clusters:
+    if options.perform == 'sync' or options.daemon:
+        parser.error("--clusters is not supported with sync or --daemon")
+    myClusters = ciscoClusters(options.clusters,
+                               readRate=options.axlreadrate,
+                               writeRate=options.axlwriterate,
+                               fastSerialize=options.fastserialize,
+                               replicationLag=options.replicationlag)
 
-status = {}
-if options.perform == 'create':
-    status.update({"ccm": myJabber.writeJabber()})
-    # myVoicemail.createNewVoicemail()  # would use for non LDAP use case
-    if options.vm.lower() in ['true', '1', 't', 'y', 'yes']:
-        status.update({"cxn": myVoicemail.importNewVoicemail()})
+if options.perform == 'sync':
+    # the batch file is the full export, only differences are pushed
+    if not options.batchfile:
+        parser.error("sync requires the export as -x / --batchfile")
+    syncStore = ciscoSyncStore(options.syncdb)
+    try:
+        mySync = ciscoSync(syncStore, workers=options.workers,
+                           remove=not options.syncnoremove)
+        for result in mySync.run(readBatchFile(options.batchfile)):
+            print(json.dumps(result))
+            sys.stdout.flush()
+        print(json.dumps({"sync": mySync.counts}))
+    finally:
+        syncStore.close()
+elif options.batchfile:
+    # one JSON result per row, printed as each row completes
+    if options.resume and not options.journal:
+        parser.error("--resume requires --journal")
+    myJournal = None
+    if options.journal:
+        myJournal = ciscoJournal(options.journal, resume=options.resume)
+    try:
+        if myClusters is not None:
+            # each cluster runs with its own workers, in parallel
+            myBatch = ciscoClusterBatchWriter(myClusters, options.perform,
+                                              journal=myJournal)
+        else:
+            myBatch = ciscoBatchWriter(perform=options.perform,
+                                       workers=options.workers,
+                                       journal=myJournal)
+        for result in myBatch.run(readBatchFile(options.batchfile)):
+            print(json.dumps(result))
+            sys.stdout.flush()
+    finally:
+        if myJournal is not None:
+            myJournal.close()
+        if myClusters is not None:
+            myClusters.close()
+elif options.perform in ['create', 'delete', 'reconcile', 'plan'] and \
+        options.daemon:
+    # the daemon already holds warm AXL / CUPI clients
+    status = sendJob(options.daemon, options.perform,
+                     normalizeRow(vars(options)),
+                     tokenFile=options.daemontoken)
+    print(json.dumps(status))
+elif options.perform in ['create', 'delete', 'reconcile', 'plan'] and \
+        myClusters is not None:
+    myCluster = myClusters.route(vars(options))
+    status = processUser(vars(options), options.perform,
+                         session=myCluster.getSession(),
+                         axlWriter=myCluster.getAxlWriter(),
+                         cxnConfig=myCluster.getCxnConfig())
     print(json.dumps(status))
-elif options.perform == 'delete':
-    status.update({"ccm": myJabber.cleanJabber()})
-    status.update({"cxn": myVoicemail.deleteVoicemail()})
+elif options.perform in ['create', 'delete', 'reconcile', 'plan']:
+    status = processUser(vars(options), options.perform)
     print(json.dumps(status))
 else:
     print("Invalid / No Option selected")
+if options.metrics:
+    ciscoMetrics.writeSummary(options.metrics)
+if options.promfile:
+    ciscoMetrics.writeTextfile(options.promfile)
 cwLogger.info("CiscoWriter Completed")
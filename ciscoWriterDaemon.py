@@ -0,0 +1,341 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import os  # remove stale socket
+import sys
+import hmac
+import json
+import stat
+import secrets
+import socket
+import ipaddress
+import logging
+import threading
+import http.client
+from urllib.parse import urlparse
+from optparse import OptionParser
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from ciscoBatchWriter import normalizeRow, processUser
+from cucmAxlWriter import axlWriterRegistry
+from cupiRestWriter import cupiRestWriter, cupiSessionPool
+from ciscoLogging import setupLogging
+from ciscoMetrics import ciscoMetrics
+
+cwdLogger = logging.getLogger(__name__)
+
+_actions = ['create', 'delete', 'reconcile', 'plan']
+_tokenHeader = 'X-Cisco-Writer-Token'
+_tokenFile = os.path.join(os.path.expanduser('~'), '.ciscoWriterDaemon.token')
+
+
+def readToken(tokenFile=None):
+    # the shared job token. The file has to belong to this user and be
+    # closed to everyone else.
+    tokenFile = tokenFile or _tokenFile
+    fileStat = os.lstat(tokenFile)
+    if not stat.S_ISREG(fileStat.st_mode) or \
+            fileStat.st_mode & (stat.S_IRWXG | stat.S_IRWXO) or \
+            (hasattr(os, 'getuid') and fileStat.st_uid != os.getuid()):
+        raise Exception("{0} has to be a file of this user with mode "
+                        "0600".format(tokenFile))
+    with open(tokenFile) as tokenData:
+        token = tokenData.read().strip()
+    if not token:
+        raise Exception("{0} holds no token".format(tokenFile))
+    return token
+
+
+def createToken(tokenFile=None):
+    # writes a random token to a new 0600 file, an existing file is kept
+    tokenFile = tokenFile or _tokenFile
+    try:
+        fd = os.open(tokenFile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return readToken(tokenFile)
+    with os.fdopen(fd, 'w') as tokenData:
+        tokenData.write(secrets.token_hex(32) + '\n')
+    cwdLogger.info("Job token written to %s", tokenFile)
+    return readToken(tokenFile)
+
+
+class _tcpServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _unixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class _jobHandler(BaseHTTPRequestHandler):
+    # POST /create, /delete, /reconcile or /plan with a JSON object of
+    # ciscoWriter fields,
+    # GET /health, /metrics (Prometheus) and /metrics.json. Jobs reply with
+    # the same JSON status ciscoWriter prints. A job needs the token header
+    # and Content-Type application/json, which a browser can not send
+    # cross site without a preflight.
+
+    writerDaemon = None  # set per server by ciscoWriterDaemon.serve
+
+    def address_string(self):
+        # a UNIX socket has no client address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        cwdLogger.info("%s - %s", self.address_string(), format % args)
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _replyText(self, code, text):
+        data = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path == '/health':
+            health = {"status": "ok",
+                      "axlReady": axlWriterRegistry.hasWriter()}
+            if axlWriterRegistry.hasWriter():
+                # subscribers taking the reads, see axlNodePool
+                health["axlNodes"] = \
+                    axlWriterRegistry.getWriter().getReadNodeStates()
+            self._reply(200, health)
+        elif path == '/metrics':
+            self._replyText(200, ciscoMetrics.toPrometheus())
+        elif path == '/metrics.json':
+            self._reply(200, ciscoMetrics.summary())
+        else:
+            self._reply(404, {"error": "Unknown path"})
+
+    def do_POST(self):
+        perform = self.path.strip('/')
+        if perform not in _actions:
+            self._reply(404, {"error": "Unknown action {0}".format(perform)})
+            return
+        contentType = self.headers.get('Content-Type', '')
+        if contentType.split(';')[0].strip().lower() != 'application/json':
+            self._reply(415, {"error": "Content-Type has to be "
+                                       "application/json"})
+            return
+        if not self.writerDaemon.isAuthorized(self.headers.get(_tokenHeader)):
+            self._reply(401, {"error": "Missing or wrong job token"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            row = normalizeRow(json.loads(self.rfile.read(length) or b'{}'))
+        except Exception as e:
+            self._reply(400, {"error": "Invalid job: {0}".format(e)})
+            return
+        if not row['username'] or not row['did']:
+            self._reply(400, {"error": "username and did are required"})
+            return
+        try:
+            status = self.writerDaemon.runJob(perform, row)
+        except Exception as e:
+            cwdLogger.info("%s %s failed: %s", perform, row['username'], e)
+            self._reply(500, {"error": str(e)})
+            return
+        self._reply(200, status)
+
+
+class ciscoWriterDaemon:
+    # keeps the AXL client, the CUPI session and both configs warm and runs
+    # create / delete jobs received over local HTTP or a UNIX socket. Jobs
+    # carry the token of tokenFile, created on the first start.
+
+    _host = '127.0.0.1'
+    _port = 8088
+    _socketPath = None
+    _tokenFile = None  # None: ~/.ciscoWriterDaemon.token
+    _token = None
+    _workers = 8  # jobs running at the same time, others wait
+    _server = None
+
+    def __init__(self, host=None, port=None, socketPath=None, workers=None,
+                 tokenFile=None):
+        # TCP is only served on loopback; other hosts reach the daemon
+        # through a proxy or a UNIX socket
+        if host is not None:
+            if not socketPath and not self.isLoopback(host):
+                raise Exception("Refusing to listen on {0}, only loopback "
+                                "addresses are served".format(host))
+            self._host = host
+        if port is not None:
+            self._port = port
+        if socketPath is not None:
+            self._socketPath = socketPath
+        if workers is not None:
+            self._workers = workers
+        if tokenFile is not None:
+            self._tokenFile = tokenFile
+        self._jobSlots = threading.BoundedSemaphore(self._workers)
+
+    def warmUp(self):
+        # loads ucm.cfg / cxn.cfg, the WSDL and the sessions before the
+        # first job arrives
+        axlWriterRegistry.getWriter()
+        cupiRestWriter.getSharedConfig()
+        cupiSessionPool.configure(poolSize=self._workers)
+        cupiSessionPool.getSession()
+        cwdLogger.info("Clients warm")
+
+    def isAuthorized(self, token):
+        if not token or self._token is None:
+            return False
+        return hmac.compare_digest(token.encode('utf-8'),
+                                   self._token.encode('utf-8'))
+
+    def runJob(self, perform, row):
+        with self._jobSlots:
+            return processUser(row, perform)
+
+    @staticmethod
+    def isLoopback(host):
+        # True when every address host resolves to is a loopback address
+        try:
+            addresses = set(info[4][0] for info in socket.getaddrinfo(
+                host, None, proto=socket.IPPROTO_TCP))
+        except socket.gaierror:
+            return False
+        return bool(addresses) and all(
+            ipaddress.ip_address(address.split('%')[0]).is_loopback
+            for address in addresses)
+
+    def _removeSocket(self):
+        # only a stale socket is removed, never a file in its place
+        try:
+            pathStat = os.lstat(self._socketPath)
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(pathStat.st_mode):
+            raise Exception("{0} exists and is not a socket".format(
+                self._socketPath))
+        os.remove(self._socketPath)
+
+    def getAddress(self):
+        if self._socketPath:
+            return 'unix://' + self._socketPath
+        return 'http://{0}:{1}'.format(self._host, self._port)
+
+    def serve(self):
+        self._token = createToken(self._tokenFile)
+        jobHandler = type('jobHandler', (_jobHandler,),
+                          {'writerDaemon': self})
+        if self._socketPath:
+            self._removeSocket()
+            # owner only from the moment it is bound
+            oldUmask = os.umask(0o177)
+            try:
+                self._server = _unixServer(self._socketPath, jobHandler)
+            finally:
+                os.umask(oldUmask)
+            os.chmod(self._socketPath, 0o600)
+        else:
+            self._server = _tcpServer((self._host, self._port), jobHandler)
+        cwdLogger.info("Listening on %s", self.getAddress())
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if self._socketPath:
+                self._removeSocket()
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class _unixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socketPath, timeout):
+        http.client.HTTPConnection.__init__(self, 'localhost',
+                                            timeout=timeout)
+        self._socketPath = socketPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socketPath)
+
+
+def sendJob(address, perform, row, timeout=300, tokenFile=None):
+    # thin client: runs one job on a daemon at http://host:port or
+    # unix:///path and returns its JSON status. tokenFile is the daemon's,
+    # default ~/.ciscoWriterDaemon.token.
+    headers = {'Content-Type': 'application/json',
+               _tokenHeader: readToken(tokenFile)}
+    parsed = urlparse(address)
+    if parsed.scheme == 'unix':
+        connection = _unixHTTPConnection(parsed.path, timeout)
+    else:
+        connection = http.client.HTTPConnection(parsed.hostname,
+                                                parsed.port or 80,
+                                                timeout=timeout)
+    try:
+        body = json.dumps({key: value for key, value in row.items()
+                           if value is not None})
+        connection.request('POST', '/' + perform, body=body, headers=headers)
+        response = connection.getresponse()
+        result = json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise Exception("Daemon {0}: {1}".format(response.status,
+                                                 result.get('error')))
+    return result
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-l", "--listen", action="store", type="string",
+                      dest="listen", default="127.0.0.1:8088",
+                      help="host:port to listen on, loopback only")
+    parser.add_option("-u", "--socket", action="store", type="string",
+                      dest="socket", help="UNIX socket path to listen on")
+    parser.add_option("-t", "--tokenfile", action="store", type="string",
+                      dest="tokenfile", help="Job token file, created with "
+                      "mode 0600 if missing, default "
+                      "~/.ciscoWriterDaemon.token")
+    parser.add_option("-n", "--workers", action="store", type="int",
+                      dest="workers", default=8,
+                      help="Number of jobs run at the same time")
+    parser.add_option("--loglevel", action="store", type="string",
+                      dest="loglevel", help="DEBUG/INFO/WARNING, default "
+                      "$CISCO_LOG_LEVEL or INFO")
+    parser.add_option("--promfile", action="store", type="string",
+                      dest="promfile", help="Prometheus textfile rewritten "
+                      "every 15 seconds")
+    (options, args) = parser.parse_args()
+
+    # a long running daemon keeps its logs across restarts
+    setupLogging(level=options.loglevel, append=True)
+
+    host, port = options.listen.rsplit(':', 1)
+    myDaemon = ciscoWriterDaemon(host=host, port=int(port),
+                                 socketPath=options.socket,
+                                 workers=options.workers,
+                                 tokenFile=options.tokenfile)
+    myDaemon.warmUp()
+    print("ciscoWriterDaemon listening on", myDaemon.getAddress())
+    sys.stdout.flush()
+    if options.promfile:
+        ciscoMetrics.startTextfileWriter(options.promfile)
+    try:
+        myDaemon.serve()
+    except KeyboardInterrupt:
+        cwdLogger.info("ciscoWriterDaemon stopped")
+    finally:
+        ciscoMetrics.stopTextfileWriter()
@@ -11,33 +11,29 @@ import ssl  # download ssl cert
 import OpenSSL  # download ssl cert
 from optparse import OptionParser
 from appConfig import appConfig
+from ciscoLogging import setupLogging
 
 confLogger = logging.getLogger(__name__)
-confLogger.setLevel(logging.DEBUG)
-infoHandler = logging.FileHandler('CiscoInfo.log', mode='w')
-infoHandler.setLevel(logging.INFO)
-debugHandler = logging.FileHandler('CiscoDebug.log', mode='w')
-debugHandler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - \
-                                %(message)s')
-infoHandler.setFormatter(formatter)
-debugHandler.setFormatter(formatter)
-confLogger.addHandler(infoHandler)
-confLogger.addHandler(debugHandler)
-# confLogger.addHandler(logging.StreamHandler(sys.stdout))
-confLogger.info("Begin configCreator Info Logging")
-confLogger.debug("Begin configCreator Debug Logging")
 
 parser = OptionParser()
 parser.add_option("--ccm", action="store_const", const="ucm.cfg",
                   help="Setup config for Comm. Manager", dest="filename")
 parser.add_option("--cxn", action="store_const", const="cxn.cfg",
                   help="Setup config for Voicemail", dest="filename")
+parser.add_option("--cluster", action="store", type="string", dest="cluster",
+                  help="Cluster of a multi cluster setup, e.g. emea writes "
+                  "ucm-emea.cfg / cxn-emea.cfg")
 (options, args) = parser.parse_args()
 
+setupLogging()
+
 if not options.filename:
     parser.error("No option selected. Use -h or --help for help")
     sys.exit()
+if options.cluster:
+    # ucm-<cluster>.cfg, the ucm prefix is what locates the AXL WSDL
+    options.filename = '{0}-{1}.cfg'.format(
+        os.path.splitext(options.filename)[0], options.cluster)
 
 
 class configCreator(appConfig):
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import ssl
+import asyncio
+import logging
+import aiohttp
+from zeep.asyncio import AsyncTransport
+from cucmAxlWriter import cucmAxlWriter, axlExistenceSnapshot
+from axlRateLimiter import axlGatedService, axlThrottledError
+from ciscoMetrics import ciscoMetrics, soapOperation
+from ciscoLogging import lazyPayload
+
+caawLogger = logging.getLogger(__name__)
+
+
+class meteredAsyncTransport(AsyncTransport):
+    # AsyncTransport counterpart of cucmAxlWriter.meteredTransport
+
+    async def post(self, address, message, headers):
+        ciscoMetrics.addBytes('axl', soapOperation(headers),
+                              bytesOut=len(message))
+        return await AsyncTransport.post(self, address, message, headers)
+
+    async def post_xml(self, address, envelope, headers):
+        response = await AsyncTransport.post_xml(self, address, envelope,
+                                                 headers)
+        ciscoMetrics.addBytes('axl', soapOperation(headers),
+                              bytesIn=len(response.content))
+        return response
+
+
+class cucmAxlAsyncWriter(cucmAxlWriter):
+    # asyncio counterpart of cucmAxlWriter. Payloads are built by the same
+    # factory methods, requests go through zeep's AsyncTransport (aiohttp)
+    # and the same request gate, so hundreds of operations can be in flight
+    # from one thread. The per thread transaction read cache is not used
+    # here; an existence snapshot from prefetchExistence still is.
+
+    _concurrency = 100  # open connections to CUCM
+    _offloadReads = False  # every call goes to the publisher
+    _loop = None
+    _httpSession = None
+
+    def __init__(self, loop=None, readRate=None, writeRate=None,
+                 concurrency=None):
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        if concurrency is not None:
+            self._concurrency = concurrency
+        cucmAxlWriter.__init__(self, readRate=readRate, writeRate=writeRate)
+
+    def _buildTransport(self, myCucmConfig):
+        # aiohttp 2.x, zeep 2.4's AsyncTransport needs aiohttp.Timeout
+        if myCucmConfig.getAppVerify():
+            caawLogger.info("Session Security ENABLED")
+            sslArgs = {'ssl_context': ssl.create_default_context(
+                cafile=myCucmConfig.getAppCert())}
+        else:
+            caawLogger.info("Session Security DISABLED")
+            sslArgs = {'verify_ssl': False}
+        connector = aiohttp.TCPConnector(limit=self._concurrency,
+                                         loop=self._loop, **sslArgs)
+        self._httpSession = aiohttp.ClientSession(
+            loop=self._loop, connector=connector,
+            auth=aiohttp.BasicAuth(myCucmConfig.getAppUsername(),
+                                   myCucmConfig.getAppPassword()))
+        caawLogger.info("Async Session Created")
+        return meteredAsyncTransport(self._loop, session=self._httpSession)
+
+    def _gateService(self, service, gate=None):
+        return axlGatedService(service, gate or self.gate, asyncMode=True)
+
+    async def close(self):
+        if self._httpSession is not None:
+            await self._httpSession.close()
+
+    async def sqlQuery(self, sql):
+        return self._sqlRows(await self.service.executeSQLQuery(sql=sql))
+
+    async def prefetchExistence(self, usernames, patterns,
+                                partition='Internal PAR', snapshot=None):
+        if snapshot is None:
+            snapshot = axlExistenceSnapshot()
+        queries = list(self._prefetchQueries(usernames, patterns, partition))
+        results = await asyncio.gather(*[self.sqlQuery(sql)
+                                         for kind, chunk, sql in queries])
+        for (kind, chunk, sql), rows in zip(queries, results):
+            self._applyPrefetch(snapshot, kind, chunk, rows, partition)
+        caawLogger.info("Prefetched %s devices and %s lines",
+                        snapshot.getDeviceCount(), snapshot.getLineCount())
+        return snapshot
+
+    async def _listAll(self, opName, tag, searchCriteria, returnedTags,
+                       limit=None):
+        # every object matching searchCriteria, fetched page by page. With
+        # limit no page is fetched once more than limit objects are read.
+        operation = getattr(self.service, opName)
+        rows = []
+        while True:
+            page = self._listRows(await operation(
+                searchCriteria=searchCriteria,
+                first=self._listPageSize, skip=len(rows),
+                **self._tagsArgs(returnedTags)), tag)
+            rows.extend(page)
+            if len(page) < self._listPageSize or \
+                    (limit is not None and len(rows) > limit):
+                return rows
+
+    async def _listPages(self, opName, tag, searchCriteria, returnedTags,
+                         pageSize=None, readAhead=False):
+        # async generator counterpart of cucmAxlWriter._listPages, so the
+        # inherited iterPhones / iterLines / ... work with  async for
+        operation = getattr(self.service, opName)
+        pageSize = pageSize or self._listPageSize
+
+        def fetch(skip):
+            return asyncio.ensure_future(operation(
+                searchCriteria=searchCriteria, first=pageSize, skip=skip,
+                **self._tagsArgs(returnedTags)), loop=self._loop)
+
+        pending = fetch(0)
+        skip = 0
+        try:
+            while True:
+                rows = self._listRows(await pending, tag)
+                pending = None
+                skip += len(rows)
+                if readAhead and len(rows) == pageSize:
+                    pending = fetch(skip)
+                for row in rows:
+                    yield row
+                if len(rows) < pageSize:
+                    return
+                if pending is None:
+                    pending = fetch(skip)
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def resolveUserNames(self, usernames):
+        groups = list(self._userPrefixGroups(usernames))
+        pages = await asyncio.gather(*[
+            self._listAll('listUser', 'user', {'userid': search},
+                          self._userNameTags,
+                          limit=self._userScanLimit(group))
+            for search, group in groups])
+        resolved = {}
+        unresolved = []
+        for (search, group), users in zip(groups, pages):
+            limit = self._userScanLimit(group)
+            if not self._matchUsers(group, users, resolved, limit):
+                unresolved.extend(self._unresolved(search, group, resolved,
+                                                   limit))
+        users = await asyncio.gather(*[
+            self.userGet(username, returnedTags=self._userNameTags)
+            for username in unresolved])
+        for username, user in zip(unresolved, users):
+            user = self._resolvedUser(user)
+            if user is not None:
+                resolved[username] = user
+        caawLogger.info("Resolved %s of %s users", len(resolved),
+                        len(set(usernames)))
+        return resolved
+
+    async def userGet(self, username, returnedTags=None):
+        try:
+            obtainedUser = await self.service.getUser(
+                userid=username, **self._tagsArgs(returnedTags))
+            caawLogger.debug("%s", lazyPayload(obtainedUser))
+            return obtainedUser
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            caawLogger.debug("User NOT found. Error=%s", e)
+            return False
+
+    async def userExists(self, username):
+        return await self.userGet(
+            username, returnedTags=self._userExistsTags) is not False
+
+    async def userUpdate(self, username, extension, did, deviceList, pin,
+                         partition='Internal PAR'):
+        userPackage = self._userUpdatePackage(username, extension, did,
+                                              deviceList, partition)
+        result = await self.service.updateUser(**userPackage)
+        caawLogger.info("Update User Completed")
+        caawLogger.debug("%s", lazyPayload(result))
+
+    async def userUpdateFields(self, username, fields):
+        result = await self.service.updateUser(userid=username, **fields)
+        caawLogger.info("Update User Fields Completed")
+        caawLogger.debug("%s", lazyPayload(result))
+        return result
+
+    async def lineGet(self, extension, partition='Internal PAR',
+                      returnedTags=None):
+        try:
+            getLine = await self.service.getLine(
+                pattern=extension, routePartitionName=partition,
+                **self._tagsArgs(returnedTags))
+            caawLogger.debug("%s", lazyPayload(getLine))
+            return getLine
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            return False
+
+    async def lineExists(self, extension, partition='Internal PAR'):
+        if self._snapshot is not None:
+            known = self._snapshot.knowsLine(extension, partition)
+            if known is not None:
+                return known
+        return await self.lineGet(
+            extension, partition,
+            returnedTags=self._lineExistsTags) is not False
+
+    async def lineAdd(self, extension, firstname, lastname, device_pool, city,
+                      vm='True', vmProfileName="<None>",
+                      partition='Internal PAR', usage='Device',
+                      cfw_css='None'):
+        if await self.lineExists(extension):
+            raise Exception("Line already exists")
+        try:
+            addlinepackage = self._linePackage(extension, firstname, lastname,
+                                               device_pool, city, vm,
+                                               vmProfileName, partition,
+                                               usage, cfw_css)
+            self._markLine(extension, partition, None)
+            createdLine = await self.service.addLine(addlinepackage)
+            self._markLine(extension, partition, True)
+            caawLogger.debug("%s", lazyPayload(createdLine))
+            caawLogger.info("Add Line Completed")
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            caawLogger.debug("Add Line Error. Server error=%s", e)
+            raise Exception("Line could not be added")
+
+    async def lineUpdate(self, e164extension, eprise_extension, country_code):
+        self._markLine(e164extension, None, None)
+        result = await self.service.updateLine(
+            **self._lineUpdatePackage(e164extension, eprise_extension))
+        caawLogger.info("lineUpdate Completed")
+        caawLogger.debug("%s", lazyPayload(result))
+
+    async def lineUpdateFields(self, extension, fields,
+                               partition='Internal PAR'):
+        result = await self.service.updateLine(pattern=extension,
+                                               routePartitionName=partition,
+                                               **fields)
+        caawLogger.info("Update Line Fields Completed")
+        caawLogger.debug("%s", lazyPayload(result))
+        return result
+
+    async def lineDelete(self, extension, partition='Internal PAR'):
+        self._markLine(extension, partition, None)
+        try:
+            result = await self.service.removeLine(
+                pattern=extension, routePartitionName=partition)
+            self._markLine(extension, partition, False)
+            caawLogger.info("Remove Line Completed")
+            caawLogger.debug("%s", lazyPayload(result))
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            caawLogger.info("%s", e)
+
+    async def deviceGet(self, devicename, returnedTags=None):
+        try:
+            getDevice = await self.service.getPhone(
+                name=devicename, **self._tagsArgs(returnedTags))
+            caawLogger.debug("%s", lazyPayload(getDevice))
+            return getDevice
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            return False
+
+    async def deviceExists(self, devicename):
+        if self._snapshot is not None:
+            known = self._snapshot.knowsDevice(devicename)
+            if known is not None:
+                return known
+        return await self.deviceGet(
+            devicename, returnedTags=self._deviceExistsTags) is not False
+
+    async def deviceAdd(self, username, firstname, lastname, e164ext,
+                        extension, did, device_pool, calling_search_space,
+                        devicetype, partition='Internal PAR'):
+        deviceName = self.deviceGetName(username, devicetype)
+        self._deviceProduct(devicetype)  # rejects unknown types up front
+        if await self.deviceExists(deviceName):
+            return
+        try:
+            addphonepackage = self._devicePackage(
+                username, firstname, lastname, e164ext, extension, did,
+                device_pool, calling_search_space, devicetype, partition)
+            self._markDevice(deviceName, None)
+            createdPhone = await self.service.addPhone(addphonepackage)
+            self._markDevice(deviceName, True)
+            caawLogger.debug("%s", lazyPayload(createdPhone))
+            caawLogger.info("Add Phone Completed")
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            caawLogger.debug("Add Phone Error. Server error=%s", e)
+            raise Exception(e)
+
+    async def deviceUpdateFields(self, devicename, fields):
+        result = await self.service.updatePhone(name=devicename, **fields)
+        caawLogger.info("Update Phone Fields Completed")
+        caawLogger.debug("%s", lazyPayload(result))
+        return result
+
+    async def deviceDelete(self, username, devicetype):
+        deviceName = self.deviceGetName(username, devicetype)
+        self._markDevice(deviceName, None)
+        try:
+            result = await self.service.removePhone(name=deviceName)
+            self._markDevice(deviceName, False)
+            caawLogger.info("Remove Phone Completed")
+            caawLogger.debug("%s", lazyPayload(result))
+            return True
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            caawLogger.info("%s", e)
+            return False
+
+    async def rdpGet(self, name, returnedTags=None):
+        try:
+            getRdp = await self.service.getRemoteDestinationProfile(
+                name=name, **self._tagsArgs(returnedTags))
+            caawLogger.debug("%s", lazyPayload(getRdp))
+            return getRdp
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            return False
+
+    async def rdpExists(self, name):
+        if self._snapshot is not None:
+            known = self._snapshot.knowsDevice(name)
+            if known is not None:
+                return known
+        return await self.rdpGet(
+            name, returnedTags=self._rdpExistsTags) is not False
+
+    async def rdpAdd(self, username, firstname, lastname, e164ext, did,
+                     extension, device_pool, calling_search_space,
+                     partition='Internal PAR'):
+        deviceName = "RDP"+username
+        if await self.rdpExists(deviceName):
+            return None
+        try:
+            rdpPackage = self._rdpPackage(username, firstname, lastname,
+                                          e164ext, did, extension,
+                                          device_pool, calling_search_space,
+                                          partition)
+            self._markDevice(deviceName, None)
+            result = await self.service.addRemoteDestinationProfile(
+                rdpPackage)
+            self._markDevice(deviceName, True)
+            return result
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            caawLogger.debug("Add RDP Error. Server error=%s", e)
+            return e
+
+    async def rdpUpdateFields(self, name, fields):
+        result = await self.service.updateRemoteDestinationProfile(
+            name=name, **fields)
+        caawLogger.info("Update RDP Fields Completed")
+        caawLogger.debug("%s", lazyPayload(result))
+        return result
+
+    async def rdpDelete(self, name):
+        devName = "RDP"+name
+        self._markDevice(devName, None)
+        try:
+            result = await self.service.removeRemoteDestinationProfile(
+                name=devName)
+            self._markDevice(devName, False)
+            caawLogger.info("Remove RDP Completed")
+            caawLogger.debug("%s", lazyPayload(result))
+            return "Deleted"
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            caawLogger.info("%s", e)
+            return "NOT Deleted"
+
+    async def rDestGet(self, dest, returnedTags=None):
+        try:
+            getRDest = await self.service.getRemoteDestination(
+                destination=dest, **self._tagsArgs(returnedTags))
+            caawLogger.info("get Remote Dest Completed")
+            caawLogger.debug("%s", lazyPayload(getRDest))
+            return getRDest
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            return False
+
+    async def rDestExists(self, dest):
+        return await self.rDestGet(
+            dest, returnedTags={'destination': ''}) is not False
+
+    async def rDestAdd(self, dest, userid, e164ext):
+        # see cucmAxlWriter.rDestAdd for the 11.5 schema issue
+        caawLogger.info("Remote Dest Add Started")
+        try:
+            result = await self.service.addRemoteDestination(
+                self._rDestPackage(dest, userid))
+            caawLogger.debug("%s", lazyPayload(result))
+            return result
+        except axlThrottledError:
+            raise
+        except Exception as e:
+            caawLogger.debug("Add Remote Dest Error. Server error=%s", e)
+            return e
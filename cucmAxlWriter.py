@@ -4,11 +4,19 @@ __author__ = 'Christopher Phillips'
 
 # import sys
 import logging
-import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import os.path
 from ucAppConfig import ccmAppConfig
+from ciscoLogging import lazyPayload
+from ciscoMetrics import ciscoMetrics, soapOperation
+from axlWsdlCache import axlWsdlCache
+from axlRateLimiter import axlRequestGate, axlGatedService, axlThrottledError
+from axlNodePool import axlNode, axlNodePool, axlRecentWrites
+from axlTemplateSerializer import axlTemplateSerializer
+from axlProfiles import axlProfileCache, jabberDeviceTypes, deviceType
 from zeep import Client
-from zeep.cache import SqliteCache
 from zeep.transports import Transport
 from requests import Session
 from requests.auth import HTTPBasicAuth
@@ -18,16 +26,157 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
 cawLogger = logging.getLogger(__name__)
-cawLogger.setLevel(logging.DEBUG)
-handler = logging.FileHandler('writerDebug.log', mode='w')
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - \
-                                %(message)s')
-handler.setFormatter(formatter)
-cawLogger.addHandler(handler)
-# cawLogger.addHandler(logging.StreamHandler(sys.stdout))
-cawLogger.info("Begin cucmAxlWriter Info Logging")
-cawLogger.debug("Begin cucmAxlWriter Debug Logging")
+
+
+def likeEscape(text):
+    # list* searchCriteria are matched with LIKE, where % and _ are
+    # wildcards; escaped they match only themselves
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace(
+        '_', '\\_')
+
+
+class meteredTransport(Transport):
+    # counts request and response bytes per AXL operation, the operation
+    # is taken from the SOAPAction header. post_xml serializes and calls
+    # post, templated envelopes are posted directly.
+
+    def post(self, address, message, headers):
+        response = Transport.post(self, address, message, headers)
+        ciscoMetrics.addBytes('axl', soapOperation(headers),
+                              bytesOut=len(message),
+                              bytesIn=len(response.content))
+        return response
+
+
+class axlReadCache:
+    # get results of one transaction keyed by (object type, name, ...).
+    # False (not found) is cached as well, any write to the object drops
+    # every entry for it.
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                return True, self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def store(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+
+    def invalidate(self, kind, name):
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key[0] == kind and key[1] == name]:
+                del self._entries[key]
+
+
+class axlExistenceSnapshot:
+    # which devices and lines of a batch exist, filled by bulk SQL queries.
+    # Only names that were queried are known, anything else returns None
+    # so the caller falls back to a normal get.
+
+    def __init__(self):
+        self._devices = {}  # NAME -> bool
+        self._lines = {}  # (pattern, partition) -> bool
+        self._lock = threading.Lock()
+
+    def knowsDevice(self, devicename):
+        with self._lock:
+            return self._devices.get(devicename.upper())
+
+    def knowsLine(self, pattern, partition):
+        with self._lock:
+            return self._lines.get((pattern, partition))
+
+    def markDevice(self, devicename, exists):
+        with self._lock:
+            self._devices[devicename.upper()] = exists
+
+    def markLine(self, pattern, partition, exists):
+        with self._lock:
+            self._lines[(pattern, partition)] = exists
+
+    def forgetDevice(self, devicename):
+        with self._lock:
+            self._devices.pop(devicename.upper(), None)
+
+    def forgetLine(self, pattern, partition=None):
+        with self._lock:
+            for key in [key for key in self._lines if key[0] == pattern and
+                        partition in (None, key[1])]:
+                del self._lines[key]
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+            self._lines.clear()
+
+    def getDeviceCount(self):
+        return len(self._devices)
+
+    def getLineCount(self):
+        return len(self._lines)
+
+
+class axlExistenceBlocks:
+    # the existence snapshots of the batch blocks whose rows are still
+    # running, consulted newest first. A write is marked in every block so
+    # none keeps a stale answer; a block is released when its last row
+    # completes.
+
+    def __init__(self):
+        self._blocks = []  # replaced, never changed in place
+        self._lock = threading.Lock()
+
+    def add(self, snapshot):
+        with self._lock:
+            self._blocks = [snapshot] + self._blocks
+
+    def release(self, snapshot):
+        with self._lock:
+            self._blocks = [block for block in self._blocks
+                            if block is not snapshot]
+
+    def getBlockCount(self):
+        return len(self._blocks)
+
+    def knowsDevice(self, devicename):
+        for block in self._blocks:
+            known = block.knowsDevice(devicename)
+            if known is not None:
+                return known
+        return None
+
+    def knowsLine(self, pattern, partition):
+        for block in self._blocks:
+            known = block.knowsLine(pattern, partition)
+            if known is not None:
+                return known
+        return None
+
+    def markDevice(self, devicename, exists):
+        for block in self._blocks:
+            block.markDevice(devicename, exists)
+
+    def markLine(self, pattern, partition, exists):
+        for block in self._blocks:
+            block.markLine(pattern, partition, exists)
+
+    def forgetDevice(self, devicename):
+        for block in self._blocks:
+            block.forgetDevice(devicename)
+
+    def forgetLine(self, pattern, partition=None):
+        for block in self._blocks:
+            block.forgetLine(pattern, partition)
 
 
 class cucmAxlWriter:
@@ -35,25 +184,76 @@ class cucmAxlWriter:
 
     factory = ''
     service = ''
+    templates = None  # axlTemplateSerializer with fastSerialize
+    reads = None  # axlNodePool of the subscribers, None reads the publisher
+    recentWrites = None  # axlRecentWrites, keeps their reads on the publisher
+    _offloadReads = True
+    _sqlChunkSize = 200  # names per IN () list of a prefetch query
+    _prefetchTypes = list(jabberDeviceTypes) + ['RDP']
+    _listPageSize = 500  # objects per list* call (first / skip)
+    _minUserPrefix = 3  # shortest userid prefix searched with a wildcard
+    _userScanFactor = 10  # users a wildcard may list per wanted user
+    _userNameTags = ['userid', 'firstName', 'lastName']
+    # list operation -> (reply tag, match-all searchCriteria, returnedTags)
+    _listTypes = {
+        'listPhone': ('phone', {'name': '%'},
+                      ['name', 'description', 'product', 'devicePoolName']),
+        'listLine': ('line', {'pattern': '%'},
+                     ['pattern', 'description', 'routePartitionName']),
+        'listUser': ('user', {'userid': '%'},
+                     ['userid', 'firstName', 'lastName']),
+        'listRemoteDestinationProfile': (
+            'remoteDestinationProfile', {'name': '%'},
+            ['name', 'description', 'userId'])}
+    _bindingName = "{http://www.cisco.com/AXLAPIService/}AXLAPIBinding"
+    # returnedTags of the exists checks, the smallest reply CUCM sends
+    _userExistsTags = ['userid']
+    _lineExistsTags = ['pattern']
+    _deviceExistsTags = ['name']
+    _rdpExistsTags = ['name']
 
-    def __init__(self):
-        myCucmConfig = ccmAppConfig('ucm.cfg')
-
-        zeeplogger = logging.getLogger('zeep.transports')
-        zeeplogger.setLevel(logging.DEBUG)
-        zeephandler = logging.FileHandler('zeepDebug.log', mode='w')
-        zeephandler.setLevel(logging.DEBUG)
-        zeepformatter = logging.Formatter('%(asctime)s - %(name)s - \
-                            %(levelname)s - %(message)s')
-        zeephandler.setFormatter(zeepformatter)
-        zeeplogger.addHandler(zeephandler)
-        zeeplogger.info("Begin zeep Logging")
-
-        tempzeep = os.path.join(tempfile.gettempdir(), 'wsdlsqlite.db')
-        cache = SqliteCache(path=tempzeep, timeout=60)
-        transport = Transport(cache=cache)
-        #client = Client(myCucmConfig.getwsdlFileName(), transport=transport)
+    def __init__(self, readRate=None, writeRate=None, fastSerialize=False,
+                 cfgFileName='ucm.cfg', subscribers=None, replicationLag=None):
+        # cfgFileName selects the cluster, see ciscoClusters. subscribers:
+        # AXL URLs that take the reads, None uses the subscribers of the
+        # config file and [] reads from the publisher only. replicationLag:
+        # seconds an object written here is read from the publisher.
+        self._txnState = threading.local()
+        self._snapshot = None
+        # constant payload parts per site, see axlProfiles
+        self.profiles = axlProfileCache()
+        myCucmConfig = ccmAppConfig(cfgFileName)
+
+        # zeep parses the WSDL and the AXL schema on every start
+        self.wsdlCache = axlWsdlCache(myCucmConfig.getwsdlFileName(),
+                                      myCucmConfig.getAxlVersion())
+        # SOAP envelopes: setupLogging(captureEnvelopes=True)
+        transport = self._buildTransport(myCucmConfig)
+        self.client = Client(wsdl=self.wsdlCache.getWsdlFileName(),
+                             transport=transport)
+        cawLogger.info("Client Created")
+
+        self.factory = self.client.type_factory('ns0')
+        cawLogger.info("Factory Created")
+
+        service = self.client.create_service(self._bindingName,
+                                             myCucmConfig.getAppApiUrl())
+        # all calls share one budget per writer, so concurrent callers are
+        # limited to what the cluster sustains
+        self.gate = axlRequestGate(readRate=readRate, writeRate=writeRate)
+        self.service = self._gateService(service)
+        cawLogger.info("Service Created")
+        self.recentWrites = axlRecentWrites(lag=replicationLag)
+        if subscribers is None:
+            subscribers = myCucmConfig.getSubscriberApiUrls()
+        if subscribers and self._offloadReads:
+            self.reads = self._buildReadPool(subscribers, readRate)
+        if fastSerialize:
+            # addLine / addPhone / addRemoteDestinationProfile / updateUser
+            # envelopes are rendered from templates checked against zeep
+            self.templates = axlTemplateSerializer(self.client, service)
 
+    def _buildTransport(self, myCucmConfig):
         session = Session()
         if myCucmConfig.getAppVerify():
             cawLogger.info("Session Security ENABLED")
@@ -65,263 +265,687 @@ class cucmAxlWriter:
         session.auth = HTTPBasicAuth(myCucmConfig.getAppUsername(),
                                      myCucmConfig.getAppPassword())
         cawLogger.info("Auth Created")
+        return meteredTransport(session=session)
 
-        client = Client(wsdl=myCucmConfig.getwsdlFileName(),
-                        transport=Transport(session=session))
-        cawLogger.info("Client Created")
+    def _gateService(self, service, gate=None):
+        return axlGatedService(service, gate or self.gate)
 
-        self.factory = client.type_factory('ns0')
-        cawLogger.info("Factory Created")
+    def _buildReadPool(self, urls, readRate):
+        # a service and a read budget per subscriber, AXL throttles every
+        # node on its own. Writes never reach these services.
+        nodes = [axlNode(url, self._gateService(
+            self.client.create_service(self._bindingName, url),
+            axlRequestGate(readRate=readRate))) for url in urls]
+        cawLogger.info("Reads offloaded to %s subscribers", len(nodes))
+        return axlNodePool(self.service, nodes)
 
-        self.service = client.create_service(
-            "{http://www.cisco.com/AXLAPIService/}AXLAPIBinding",
-            myCucmConfig.getAppApiUrl())
-        cawLogger.info("Service Created")
+    def _reader(self, *objects):
+        # service for a read of objects, (kind, name) as in _invalidate: a
+        # subscriber, unless one of them was written within the lag
+        if self.reads is None:
+            return self.service
+        if any(self.recentWrites.isRecent(kind, name)
+               for kind, name in objects):
+            return self.service
+        return self.reads
+
+    def getReadNodeStates(self):
+        # health of the subscribers taking reads, [] without offloading
+        if self.reads is None:
+            return []
+        return self.reads.getStates()
+
+    def _sendPackage(self, opName, packageMethod, slots, fixed=None,
+                     keywords=False):
+        # calls opName with the package built by packageMethod(**slots,
+        # **fixed). With fastSerialize the envelope is rendered from a
+        # template instead, unless a slot value needs zeep (None, non str).
+        def build(**values):
+            package = packageMethod(**values)
+            return ((), package) if keywords else ((package,), {})
 
-    def userGet(self, username):
+        if self.templates is not None:
+            # a template compiles from placeholder values, the profiles
+            # built from them are not kept
+            with self.profiles.uncached():
+                rendered = self.templates.render(opName, build, slots, fixed)
+            if rendered is not None:
+                return self.gate.call(opName, self.templates.send, opName,
+                                      *rendered)
+        args, kwargs = build(**dict(slots, **(fixed or {})))
+        return getattr(self.service, opName)(*args, **kwargs)
+
+    def checkTemplate(self, opName, packageMethod, slots, fixed=None,
+                      keywords=False):
+        # True when the template renders exactly zeep's envelope for these
+        # values, e.g. checkTemplate('addLine', writer._linePackage, {...})
+        if self.templates is None:
+            return False
+
+        def build(**values):
+            package = packageMethod(**values)
+            return ((), package) if keywords else ((package,), {})
+        with self.profiles.uncached():
+            return self.templates.checkEquivalence(opName, build, slots,
+                                                   fixed)
+
+    @contextmanager
+    def transaction(self):
+        # caches get / exists results of the calling thread until the block
+        # exits. A nested transaction joins the outer one.
+        cache = getattr(self._txnState, 'cache', None)
+        if cache is not None:
+            yield cache
+            return
+        cache = axlReadCache()
+        self._txnState.cache = cache
+        try:
+            yield cache
+        finally:
+            self._txnState.cache = None
+            cawLogger.info("Transaction read cache hits=%s misses=%s",
+                           cache.hits, cache.misses)
+
+    def currentTransaction(self):
+        return getattr(self._txnState, 'cache', None)
+
+    @contextmanager
+    def joinTransaction(self, cache):
+        # lets a worker thread share the read cache of the calling thread
+        previous = getattr(self._txnState, 'cache', None)
+        self._txnState.cache = cache
         try:
-            obtainedUser = self.service.getUser(userid=username)
-            cawLogger.debug(obtainedUser)
+            yield cache
+        finally:
+            self._txnState.cache = previous
+
+    def _cachedGet(self, key, fetch):
+        cache = getattr(self._txnState, 'cache', None)
+        if cache is None:
+            return fetch()
+        found, value = cache.lookup(key)
+        if found:
+            cawLogger.debug("Read cache hit %s", key)
+            return value
+        value = fetch()
+        cache.store(key, value)
+        return value
+
+    @classmethod
+    def _tagsKey(cls, returnedTags):
+        # cache key part of a projection, None is the full object
+        if returnedTags is None:
+            return None
+        if isinstance(returnedTags, dict):
+            return tuple(sorted(
+                (tag, cls._tagsKey(value) if isinstance(value, dict)
+                 else value) for tag, value in returnedTags.items()))
+        return tuple(sorted(returnedTags))
+
+    @staticmethod
+    def _tagsArgs(returnedTags):
+        # AXL returnedTags are empty elements named after the wanted fields.
+        # A dict is passed as is, for nested projections like
+        # {'lines': {'line': {'dirn': {'pattern': ''}}}}
+        if returnedTags is None:
+            return {}
+        if isinstance(returnedTags, dict):
+            return {'returnedTags': returnedTags}
+        return {'returnedTags': {tag: '' for tag in returnedTags}}
+
+    def _invalidate(self, kind, name):
+        # called before every write of an object
+        if self.recentWrites is not None:
+            self.recentWrites.record(kind, name)
+        cache = getattr(self._txnState, 'cache', None)
+        if cache is not None:
+            cache.invalidate(kind, name)
+
+    def sqlQuery(self, sql, objects=()):
+        # returns the rows of an executeSQLQuery as a list of dicts. objects:
+        # (kind, name) the query reads, see _reader
+        return self._sqlRows(self._reader(*objects).executeSQLQuery(sql=sql))
+
+    @staticmethod
+    def _sqlRows(result):
+        rows = []
+        if result['return'] and result['return']['row']:
+            for row in result['return']['row']:
+                rows.append({column.tag: column.text for column in row})
+        cawLogger.debug("executeSQLQuery returned %s rows", len(rows))
+        return rows
+
+    @staticmethod
+    def _sqlList(values):
+        return ', '.join("'{0}'".format(value.replace("'", "''"))
+                         for value in values)
+
+    @staticmethod
+    def _chunks(values, size):
+        values = sorted(set(values))
+        for start in range(0, len(values), size):
+            yield values[start:start + size]
+
+    def _prefetchQueries(self, usernames, patterns, partition):
+        # yields (kind, names, sql) for every chunk of a prefetch
+        deviceNames = [deviceType + username
+                       for username in usernames
+                       for deviceType in self._prefetchTypes]
+        for chunk in self._chunks(deviceNames, self._sqlChunkSize // 2):
+            # device.name is indexed and case sensitive, the column is
+            # compared as is against the name as written here and its
+            # upper case form
+            spellings = set(chunk) | set(name.upper() for name in chunk)
+            yield ('device', [name.upper() for name in chunk],
+                   "select name from device where name in ({0})".format(
+                       self._sqlList(sorted(spellings))))
+        for chunk in self._chunks(patterns, self._sqlChunkSize):
+            yield ('line', chunk,
+                   "select n.dnorpattern from numplan n inner join "
+                   "routepartition rp on n.fkroutepartition = rp.pkid "
+                   "where rp.name = {0} and n.dnorpattern in ({1})".format(
+                       self._sqlList([partition]), self._sqlList(chunk)))
+
+    @staticmethod
+    def _applyPrefetch(snapshot, kind, chunk, rows, partition):
+        if kind == 'device':
+            found = set(row['name'].upper() for row in rows)
+            for deviceName in chunk:
+                snapshot.markDevice(deviceName, deviceName in found)
+        else:
+            found = set(row['dnorpattern'] for row in rows)
+            for pattern in chunk:
+                snapshot.markLine(pattern, partition, pattern in found)
+
+    def prefetchExistence(self, usernames, patterns,
+                          partition='Internal PAR', snapshot=None):
+        # resolves with a few executeSQLQuery calls which Jabber devices, RDPs
+        # and lines of a batch already exist. Extends snapshot if given.
+        if snapshot is None:
+            snapshot = axlExistenceSnapshot()
+        for kind, chunk, sql in self._prefetchQueries(usernames, patterns,
+                                                      partition):
+            objectKind = 'phone' if kind == 'device' else 'line'
+            rows = self.sqlQuery(sql, [(objectKind, name) for name in chunk])
+            self._applyPrefetch(snapshot, kind, chunk, rows, partition)
+        cawLogger.info("Prefetched %s devices and %s lines",
+                       snapshot.getDeviceCount(), snapshot.getLineCount())
+        return snapshot
+
+    def usePrefetch(self, snapshot):
+        # exists checks consult the snapshot first, None switches it off
+        self._snapshot = snapshot
+
+    def _markDevice(self, devicename, exists):
+        if self._snapshot is not None:
+            if exists is None:
+                self._snapshot.forgetDevice(devicename)
+            else:
+                self._snapshot.markDevice(devicename, exists)
+
+    def _markLine(self, pattern, partition, exists):
+        if self._snapshot is not None:
+            if exists is None:
+                self._snapshot.forgetLine(pattern, partition)
+            else:
+                self._snapshot.markLine(pattern, partition, exists)
+
+    @staticmethod
+    def _listRows(result, tag):
+        # objects of a list* reply, e.g. result['return']['user']
+        if not result['return']:
+            return []
+        return result['return'][tag] or []
+
+    def _listPages(self, opName, tag, searchCriteria, returnedTags,
+                   pageSize=None, readAhead=False):
+        # yields every object matching searchCriteria, one page at a time.
+        # With readAhead the next page is requested while the caller works
+        # through the current one; at most two pages are held.
+        operation = getattr(self._reader(), opName)
+        pageSize = pageSize or self._listPageSize
+
+        def fetch(skip):
+            return self._listRows(operation(
+                searchCriteria=searchCriteria, first=pageSize, skip=skip,
+                **self._tagsArgs(returnedTags)), tag)
+
+        if not readAhead:
+            skip = 0
+            while True:
+                rows = fetch(skip)
+                for row in rows:
+                    yield row
+                if len(rows) < pageSize:
+                    return
+                skip += len(rows)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(fetch, 0)
+            skip = 0
+            while True:
+                rows = pending.result()
+                if len(rows) < pageSize:
+                    break
+                skip += len(rows)
+                pending = pool.submit(fetch, skip)
+                for row in rows:
+                    yield row
+        for row in rows:
+            yield row
+
+    def _iterList(self, opName, searchCriteria, returnedTags, pageSize,
+                  readAhead):
+        tag, matchAll, defaultTags = self._listTypes[opName]
+        return self._listPages(opName, tag, searchCriteria or matchAll,
+                               returnedTags or defaultTags,
+                               pageSize=pageSize, readAhead=readAhead)
+
+    # The iterators below page through the whole cluster with skip / first
+    # and yield one zeep object at a time. searchCriteria defaults to every
+    # object, e.g. {'name': 'CSF%'} narrows it; returnedTags defaults to a
+    # few identifying fields.
+
+    def iterPhones(self, searchCriteria=None, returnedTags=None,
+                   pageSize=None, readAhead=False):
+        return self._iterList('listPhone', searchCriteria, returnedTags,
+                              pageSize, readAhead)
+
+    def iterLines(self, searchCriteria=None, returnedTags=None,
+                  pageSize=None, readAhead=False):
+        return self._iterList('listLine', searchCriteria, returnedTags,
+                              pageSize, readAhead)
+
+    def iterUsers(self, searchCriteria=None, returnedTags=None,
+                  pageSize=None, readAhead=False):
+        return self._iterList('listUser', searchCriteria, returnedTags,
+                              pageSize, readAhead)
+
+    def iterRdps(self, searchCriteria=None, returnedTags=None,
+                 pageSize=None, readAhead=False):
+        return self._iterList('listRemoteDestinationProfile',
+                              searchCriteria, returnedTags, pageSize,
+                              readAhead)
+
+    def _userPrefixGroups(self, usernames):
+        # yields (userid search, usernames it covers). Sorted usernames that
+        # share at least _minUserPrefix leading characters are found with
+        # one listUser wildcard, any other name is searched exactly.
+        group = []
+        prefix = ''
+        for username in sorted(set(usernames)):
+            shared = os.path.commonprefix([prefix, username])
+            if group and len(shared) >= self._minUserPrefix:
+                group.append(username)
+                prefix = shared
+                continue
+            if group:
+                yield self._userSearch(prefix, group), group
+            group = [username]
+            prefix = username
+        if group:
+            yield self._userSearch(prefix, group), group
+
+    @staticmethod
+    def _userSearch(prefix, group):
+        # % and _ in a userid are literal
+        if len(group) == 1:
+            return likeEscape(group[0])
+        return likeEscape(prefix) + '%'
+
+    def _userScanLimit(self, group):
+        # users a group's wildcard may list before its members are read
+        # one by one, e.g. two users under a prefix shared by thousands
+        return max(self._listPageSize, self._userScanFactor * len(group))
+
+    @staticmethod
+    def _userNames(user):
+        return {'userid': user['userid'],
+                'firstName': user['firstName'],
+                'lastName': user['lastName']}
+
+    def _matchUsers(self, group, users, resolved, limit=None):
+        # a wildcard also returns users outside the batch, keep the wanted.
+        # False when more than limit users came back, the rest is not read
+        wanted = {username.lower(): username for username in group}
+        for count, user in enumerate(users, start=1):
+            if limit is not None and count > limit:
+                return False
+            username = wanted.get((user['userid'] or '').lower())
+            if username is not None:
+                resolved[username] = self._userNames(user)
+        return True
+
+    def _unresolved(self, search, group, resolved, limit):
+        # the users of a group a stopped wildcard did not find
+        missing = [username for username in group
+                   if username not in resolved]
+        cawLogger.info("%s lists more than %s users, %s read one by one",
+                       search, limit, len(missing))
+        return missing
+
+    def _resolvedUser(self, user):
+        # names of a getUser reply, None when the user is missing
+        if not user:
+            return None
+        return self._userNames(user['return']['user'])
+
+    def resolveUserNames(self, usernames):
+        # first and last name of many users with a few listUser calls.
+        # Returns {username: {'userid', 'firstName', 'lastName'}}, users
+        # missing in CUCM are left out.
+        resolved = {}
+        for search, group in self._userPrefixGroups(usernames):
+            limit = self._userScanLimit(group)
+            if self._matchUsers(group, self._listPages('listUser', 'user',
+                                                       {'userid': search},
+                                                       self._userNameTags),
+                                resolved, limit):
+                continue
+            for username in self._unresolved(search, group, resolved, limit):
+                user = self._resolvedUser(self.userGet(
+                    username, returnedTags=self._userNameTags))
+                if user is not None:
+                    resolved[username] = user
+        cawLogger.info("Resolved %s of %s users", len(resolved),
+                       len(set(usernames)))
+        return resolved
+
+    def userGet(self, username, returnedTags=None):
+        # returnedTags, e.g. ['firstName', 'lastName'], limits the reply to
+        # those fields
+        return self._cachedGet(('user', username,
+                                self._tagsKey(returnedTags)),
+                               lambda: self._userGet(username, returnedTags))
+
+    def _userGet(self, username, returnedTags=None):
+        try:
+            obtainedUser = self._reader(('user', username)).getUser(
+                userid=username, **self._tagsArgs(returnedTags))
+            cawLogger.debug("%s", lazyPayload(obtainedUser))
             return obtainedUser
+        except axlThrottledError:
+            raise
         except Exception as e:
             # If user does not exist
             cawLogger.debug("User NOT found. Error=%s", e)
             return False
 
     def userExists(self, username):
-        try:
-            self.userGet(username)
-            return True
-        except Exception as e:
-            cawLogger.debug("User NOT found. Error=%s", e)
-            return False
+        return self.userGet(username,
+                            returnedTags=self._userExistsTags) is not False
 
     def userAdd(self, username):
         # current users will be LDAP synced
         return False
 
-    def userUpdate(self, username, extension, did, deviceList, pin,
-                   partition='Internal PAR'):
+    def _userUpdatePackage(self, username, extension, did, deviceList,
+                           partition='Internal PAR'):
         userGroups = ['Standard CTI Enabled',
                       'Standard CCM End Users',
                       'Standard CTI Allow Control of Phones supporting '
                       + 'Connected Xfer and conf',
                       'Standard CTI Allow Control of Phones supporting '
                       + 'Rollover Mode']
-        result = self.service.updateUser(
-                        userid=username,
-                        selfService=did,
-                        associatedDevices={'device': deviceList},
-                        primaryExtension={'pattern': extension,
-                                          'routePartitionName': partition},
-                        associatedGroups={'userGroup': userGroups},
-                        homeCluster='true',
-                        imAndPresenceEnable='true',
-                        enableUserToHostConferenceNow='true',
-                        attendeesAccessCode='232323',
-                        enableMobility='true')
+        return {'userid': username,
+                'selfService': did,
+                'associatedDevices': {'device': deviceList},
+                'primaryExtension': {'pattern': extension,
+                                     'routePartitionName': partition},
+                'associatedGroups': {'userGroup': userGroups},
+                'homeCluster': 'true',
+                'imAndPresenceEnable': 'true',
+                'enableUserToHostConferenceNow': 'true',
+                'attendeesAccessCode': '232323',
+                'enableMobility': 'true'}
+
+    def userUpdate(self, username, extension, did, deviceList, pin,
+                   partition='Internal PAR'):
+        self._invalidate('user', username)
+        result = self._sendPackage(
+            'updateUser', self._userUpdatePackage,
+            {'username': username, 'extension': extension, 'did': did,
+             'deviceList': deviceList, 'partition': partition},
+            keywords=True)
         cawLogger.info("Update User Completed")
-        cawLogger.debug(result)
+        cawLogger.debug("%s", lazyPayload(result))
+
+    def userUpdateFields(self, username, fields):
+        # updateUser with only the given fields, e.g. from a reconcile plan
+        self._invalidate('user', username)
+        result = self.service.updateUser(userid=username, **fields)
+        cawLogger.info("Update User Fields Completed")
+        cawLogger.debug("%s", lazyPayload(result))
+        return result
 
     def userDelete(self, username):
         return True
 
-    def lineGet(self, extension, partition='Internal PAR'):
+    def lineGet(self, extension, partition='Internal PAR',
+                returnedTags=None):
+        return self._cachedGet(('line', extension, partition,
+                                self._tagsKey(returnedTags)),
+                               lambda: self._lineGet(extension, partition,
+                                                     returnedTags))
+
+    def _lineGet(self, extension, partition, returnedTags=None):
         try:
-            getLine = self.service.getLine(pattern=extension,
-                                           routePartitionName=partition)
+            getLine = self._reader(('line', extension)).getLine(
+                pattern=extension, routePartitionName=partition,
+                **self._tagsArgs(returnedTags))
             cawLogger.info("getLine Completed")
-            cawLogger.debug(getLine)
+            cawLogger.debug("%s", lazyPayload(getLine))
             return getLine
+        except axlThrottledError:
+            raise
         except Exception as e:
             return False
 
     def lineExists(self, extension, partition='Internal PAR'):
         cawLogger.debug("lineExists Called")
-        try:
-            getLine = self.service.getLine(pattern=extension,
-                                           routePartitionName=partition)
-            cawLogger.debug(getLine)
-            cawLogger.info("Line Exists")
-            return True
-        except Exception as e:
+        if self._snapshot is not None:
+            known = self._snapshot.knowsLine(extension, partition)
+            if known is not None:
+                return known
+        if self.lineGet(extension, partition,
+                        returnedTags=self._lineExistsTags) is False:
             return False
+        cawLogger.info("Line Exists")
+        return True
+
+    def _linePackage(self, extension, firstname, lastname, device_pool, city,
+                     vm='True', vmProfileName="<None>",
+                     partition='Internal PAR', usage='Device', cfw_css='None'):
+        # TODO: How to change this based on other CSS changes
+        # call forwarding, voicemail and partition come from the site
+        # profile, only the pattern and names are per user
+        profile = self.profiles.lineProfile(city, vm, vmProfileName,
+                                            partition, usage, cfw_css)
+        nameString = firstname + " " + lastname
+
+        addlinepackage = self.factory.XLine(**profile)
+        addlinepackage.pattern = extension
+        addlinepackage.alertingName = nameString
+        addlinepackage.asciiAlertingName = nameString
+        addlinepackage.description = nameString
+
+        cawLogger.info("Line Factory Completed")
+        cawLogger.debug("%s", lazyPayload(addlinepackage))
+        return addlinepackage
 
     def lineAdd(self, extension, firstname, lastname, device_pool, city,
                 vm='True', vmProfileName="<None>", partition='Internal PAR',
                 usage='Device', cfw_css='None'):
         if not self.lineExists(extension):
             try:
-                # devCss = city+' International CSS'
-                # TODO: How to change this based on other CSS changes
-                # TODO: Make this a variables passed in to fix other problems
-                fwdCss = cfw_css
-                # lineCss = 'Class - International'
-                vmConfig = {
-                    'forwardToVoiceMail': vm,
-                    'callingSearchSpaceName': fwdCss}
-                nameString = firstname + " " + lastname
-
-                addlinepackage = self.factory.XLine()
-                addlinepackage.pattern = extension
-                addlinepackage.usage = usage
-                addlinepackage.routePartitionName = partition
-                # addlinepackage.shareLineAppearanceCssName = lineCss
-                addlinepackage.callForwardAll = {
-                    'forwardToVoiceMail': 'False',
-                    'callingSearchSpaceName': fwdCss
-                    # 'secondaryCallingSearchSpaceName': lineCss
-                    }
-                addlinepackage.callForwardBusy = vmConfig
-                addlinepackage.callForwardBusyInt = vmConfig
-                addlinepackage.callForwardNoAnswer = vmConfig
-                addlinepackage.callForwardNoAnswerInt = vmConfig
-                addlinepackage.callForwardNoCoverage = vmConfig
-                addlinepackage.callForwardNoCoverageInt = vmConfig
-                addlinepackage.callForwardOnFailure = vmConfig
-                addlinepackage.callForwardAlternateParty = vmConfig
-                addlinepackage.callForwardNotRegistered = vmConfig
-                addlinepackage.callForwardNotRegisteredInt = vmConfig
-                # addlinepackage.voiceMailProfileName = vmProfileName
-                addlinepackage.alertingName = nameString
-                addlinepackage.asciiAlertingName = nameString
-                addlinepackage.description = nameString
-                addlinepackage.voiceMailProfileName = vmProfileName
-                addlinepackage.shareLineAppearanceCssName = city
-
-                cawLogger.info("Line Factory Completed")
-                cawLogger.debug(addlinepackage)
-
-                createdLine = self.service.addLine(addlinepackage)
+                self._invalidate('line', extension)
+                self._markLine(extension, partition, None)
+                createdLine = self._sendPackage(
+                    'addLine', self._linePackage,
+                    {'extension': extension, 'firstname': firstname,
+                     'lastname': lastname, 'device_pool': device_pool,
+                     'city': city, 'vm': vm, 'vmProfileName': vmProfileName,
+                     'partition': partition, 'usage': usage,
+                     'cfw_css': cfw_css})
+                self._markLine(extension, partition, True)
                 cawLogger.debug("Line Created")
-                cawLogger.debug(createdLine)
+                cawLogger.debug("%s", lazyPayload(createdLine))
                 cawLogger.info("Add Line Completed")
+            except axlThrottledError:
+                raise
             except Exception as e:
                 cawLogger.debug("Add Line Error. Server error=%s", e)
                 raise Exception("Line could not be added")
         else:
             raise Exception("Line already exists")
 
+    def _lineUpdatePackage(self, e164extension, eprise_extension):
+        return {'pattern': e164extension,
+                'e164AltNum': {'numMask': eprise_extension,
+                               'isUrgent': 'false',
+                               'addLocalRoutePartition': 'true',
+                               'routePartition': 'Internal PAR',
+                               'advertiseGloballyIls': 'true'}}
+
     def lineUpdate(self, e164extension, eprise_extension, country_code):
-        result = self.service.updateLine(pattern=e164extension,
-                                         e164AltNum={'numMask': eprise_extension,
-                                                     'isUrgent': 'false',
-                                                     'addLocalRoutePartition': 'true',
-                                                     'routePartition': 'Internal PAR',
-                                                     'advertiseGloballyIls': 'true'})
+        self._invalidate('line', e164extension)
+        self._markLine(e164extension, None, None)
+        result = self.service.updateLine(
+            **self._lineUpdatePackage(e164extension, eprise_extension))
         cawLogger.info("lineUpdate Completed")
-        cawLogger.debug(result)
+        cawLogger.debug("%s", lazyPayload(result))
+
+    def lineUpdateFields(self, extension, fields, partition='Internal PAR'):
+        self._invalidate('line', extension)
+        result = self.service.updateLine(pattern=extension,
+                                         routePartitionName=partition,
+                                         **fields)
+        cawLogger.info("Update Line Fields Completed")
+        cawLogger.debug("%s", lazyPayload(result))
+        return result
 
     def lineDelete(self, extension, partition='Internal PAR'):
+        self._invalidate('line', extension)
+        self._markLine(extension, partition, None)
         try:
             result = self.service.removeLine(pattern=extension,
                                              routePartitionName=partition)
+            self._markLine(extension, partition, False)
             cawLogger.info("Remove Line Completed")
-            cawLogger.info(result)
+            cawLogger.debug("%s", lazyPayload(result))
+        except axlThrottledError:
+            raise
         except Exception as e:
-            cawLogger.info(e)
+            cawLogger.info("%s", e)
 
     def deviceGetName(self, username, devicetype):
-        if devicetype == 'CSF':
-            deviceName = 'CSF'+username
-        elif devicetype == 'TCT':
-            deviceName = 'TCT'+username
-        elif devicetype == 'BOT':
-            deviceName = 'BOT'+username
-        elif devicetype == 'TAB':
-            deviceName = 'TAB'+username
-
-        deviceName = deviceName.upper()
-        return deviceName
-
-    def deviceGet(self, devicename):
+        deviceType(devicetype)  # rejects unknown types
+        return (devicetype + username).upper()
+
+    def deviceGet(self, devicename, returnedTags=None):
+        # device names are case insensitive in CUCM
+        return self._cachedGet(('phone', devicename.upper(),
+                                self._tagsKey(returnedTags)),
+                               lambda: self._deviceGet(devicename,
+                                                       returnedTags))
+
+    def _deviceGet(self, devicename, returnedTags=None):
         try:
-            getDevice = self.service.getPhone(name=devicename)
+            getDevice = self._reader(('phone', devicename.upper())).getPhone(
+                name=devicename, **self._tagsArgs(returnedTags))
             cawLogger.info("getDevice Completed")
-            cawLogger.debug(getDevice)
+            cawLogger.debug("%s", lazyPayload(getDevice))
             return getDevice
+        except axlThrottledError:
+            raise
         except Exception as e:
             return False
 
     def deviceExists(self, devicename):
-        try:
-            getPhone = self.service.getPhone(name=devicename)
-            cawLogger.info("getPhone Completed")
-            cawLogger.debug(getPhone)
-            return True
-        except Exception as e:
-            return False
+        if self._snapshot is not None:
+            known = self._snapshot.knowsDevice(devicename)
+            if known is not None:
+                return known
+        return self.deviceGet(devicename,
+                              returnedTags=self._deviceExistsTags) is not False
+
+    def _deviceProduct(self, devicetype):
+        # returns product, model of a Jabber device type
+        productModel = deviceType(devicetype)
+        return productModel['product'], productModel['model']
+
+    def _devicePackage(self, username, firstname, lastname, e164ext,
+                       extension, did, device_pool, calling_search_space,
+                       devicetype, partition='Internal PAR',
+                       deviceName=None):
+        # deviceName: the name from deviceGetName. deviceAdd passes it as a
+        # template slot of its own, the upper cased username would not keep
+        # the username placeholder.
+        nameString = firstname + " " + lastname
+        if deviceName is None:
+            deviceName = self.deviceGetName(username, devicetype)
+        # product, model, device pool, CSS and the fixed settings
+        profile = self.profiles.phoneProfile(device_pool,
+                                             calling_search_space,
+                                             devicetype)
+
+        # directory number / line, required for a PhoneLine
+        # line must allready exist
+        tempDirN1 = self.factory.XDirn()
+        tempDirN1.pattern = e164ext
+        tempDirN1.routePartitionName = partition
+        cawLogger.debug("%s", lazyPayload(tempDirN1))
+
+        # PhoneLine is how a DirectoryNumber and a Phone are merged
+        tempPhoneLine1 = self.factory.XPhoneLine()
+        tempPhoneLine1.index = 1
+        tempPhoneLine1.dirn = tempDirN1
+        tempPhoneLine1.label = nameString + " " + extension
+        tempPhoneLine1.display = nameString
+        tempPhoneLine1.displayAscii = nameString
+        # TODO: I think this is just the normal mask if that is so it needs to be removed
+        # tempPhoneLine1.e164Mask = did
+
+        tempPhoneLine1.associatedEndusers = {'enduser':
+                                             {'userId': username}}
+
+        cawLogger.debug("%s", lazyPayload(tempPhoneLine1))
+
+        addphonepackage = self.factory.XPhone(**profile)
+        addphonepackage.name = deviceName
+        addphonepackage.description = nameString + " x" + extension
+        addphonepackage.lines = {'line': tempPhoneLine1}
+        addphonepackage.ownerUserName = username
+        addphonepackage.mobilityUserIdName = username
+        cawLogger.debug("%s", lazyPayload(addphonepackage))
+        return addphonepackage
 
     def deviceAdd(self, username, firstname, lastname, e164ext, extension, did,
                   device_pool, calling_search_space, devicetype, partition='Internal PAR'):
 
-        nameString = firstname + " " + lastname
-        nameDevicePool = device_pool
         deviceName = self.deviceGetName(username, devicetype)
-        tempPhoneConfigName = 'Standard Common Phone Profile'
-        devCss = calling_search_space
-
-        if devicetype == 'CSF':
-            tempProduct = 'Cisco Unified Client Services Framework'
-            tempModel = 'Cisco Unified Client Services Framework'
-        elif devicetype == 'TCT':
-            tempProduct = 'Cisco Dual Mode for iPhone'
-            tempModel = 'Cisco Dual Mode for iPhone'
-        elif devicetype == 'BOT':
-            tempProduct = 'Cisco Dual Mode for Android'
-            tempModel = 'Cisco Dual Mode for Android'
-        elif devicetype == 'TAB':
-            tempProduct = 'Cisco Jabber for Tablet'
-            tempModel = 'Cisco Jabber for Tablet'
-        else:
-            raise Exception("Invalid Device Type Specified, unrecoverable")
+        self._deviceProduct(devicetype)  # rejects unknown types up front
 
         if not self.deviceExists(deviceName):
             try:
-                #  create device
-                #  join line to device
-                # directory number / line, required for a PhoneLine
-                # line must allready exist
-                tempDirN1 = self.factory.XDirn()
-                tempDirN1.pattern = e164ext
-                tempDirN1.routePartitionName = partition
-                cawLogger.debug(tempDirN1)
-
-                # PhoneLine is how a DirectoryNumber and a Phone are merged
-                tempPhoneLine1 = self.factory.XPhoneLine()
-                tempPhoneLine1.index = 1
-                tempPhoneLine1.dirn = tempDirN1
-                tempPhoneLine1.label = nameString + " " + extension
-                tempPhoneLine1.display = nameString
-                tempPhoneLine1.displayAscii = nameString
-                # TODO: I think this is just the normal mask if that is so it needs to be removed
-                # tempPhoneLine1.e164Mask = did
-
-                tempPhoneLine1.associatedEndusers = {'enduser':
-                                                     {'userId': username}}
-
-                cawLogger.debug(tempPhoneLine1)
-
-                addphonepackage = self.factory.XPhone()
-                addphonepackage.name = deviceName
-                addphonepackage.description = nameString + " x" + extension
-                addphonepackage.product = tempProduct
-                addphonepackage.model = tempModel
-                addphonepackage['class'] = 'Phone'
-                addphonepackage.protocol = 'SIP'
-                addphonepackage.commonPhoneConfigName = tempPhoneConfigName
-                addphonepackage.locationName = 'Hub_None'
-                addphonepackage.devicePoolName = nameDevicePool
-                addphonepackage.lines = {'line': tempPhoneLine1}
-                addphonepackage.ownerUserName = username
-                addphonepackage.mobilityUserIdName = username
-                addphonepackage.callingSearchSpaceName = devCss
-                cawLogger.debug(addphonepackage)
-
-                createdPhone = self.service.addPhone(addphonepackage)
-                cawLogger.debug(createdPhone)
+                self._invalidate('phone', deviceName)
+                self._markDevice(deviceName, None)
+                # the device type picks product and model, one template
+                # per type
+                createdPhone = self._sendPackage(
+                    'addPhone', self._devicePackage,
+                    {'username': username, 'firstname': firstname,
+                     'lastname': lastname, 'e164ext': e164ext,
+                     'extension': extension, 'did': did,
+                     'device_pool': device_pool,
+                     'calling_search_space': calling_search_space,
+                     'partition': partition, 'deviceName': deviceName},
+                    {'devicetype': devicetype})
+                self._markDevice(deviceName, True)
+                cawLogger.debug("%s", lazyPayload(createdPhone))
                 cawLogger.debug("Phone Created")
                 cawLogger.info("Add Phone Completed")
+            except axlThrottledError:
+                raise
             except Exception as e:
                 cawLogger.debug("Add Phone Error. Server error=%s", e)
                 # raise Exception("Phone could not be added")
@@ -330,75 +954,101 @@ class cucmAxlWriter:
     def deviceUpdate(self, username):
         return False
 
+    def deviceUpdateFields(self, devicename, fields):
+        self._invalidate('phone', devicename.upper())
+        result = self.service.updatePhone(name=devicename, **fields)
+        cawLogger.info("Update Phone Fields Completed")
+        cawLogger.debug("%s", lazyPayload(result))
+        return result
+
     def deviceDelete(self, username, devicetype):
         deviceName = self.deviceGetName(username, devicetype)
+        self._invalidate('phone', deviceName)
+        self._markDevice(deviceName, None)
         try:
             result = self.service.removePhone(name=deviceName)
+            self._markDevice(deviceName, False)
             cawLogger.info("Remove Phone Completed")
-            cawLogger.info(result)
+            cawLogger.debug("%s", lazyPayload(result))
             return True
+        except axlThrottledError:
+            raise
         except Exception as e:
-            cawLogger.info(e)
+            cawLogger.info("%s", e)
             return False
 
-    def rdpGet(self, name):
+    def rdpGet(self, name, returnedTags=None):
+        return self._cachedGet(('rdp', name.upper(),
+                                self._tagsKey(returnedTags)),
+                               lambda: self._rdpGet(name, returnedTags))
+
+    def _rdpGet(self, name, returnedTags=None):
         try:
-            getRdp = self.service.getRemoteDestinationProfile(name=name)
+            getRdp = self._reader(
+                ('rdp', name.upper())).getRemoteDestinationProfile(
+                    name=name, **self._tagsArgs(returnedTags))
             cawLogger.info("getRdp Completed")
-            cawLogger.debug(getRdp)
+            cawLogger.debug("%s", lazyPayload(getRdp))
             return getRdp
+        except axlThrottledError:
+            raise
         except Exception as e:
             return False
 
     def rdpExists(self, name):
-        try:
-            getRdp = self.service.getRemoteDestinationProfile(name=name)
-            cawLogger.info("getRdp Completed")
-            cawLogger.debug(getRdp)
-            return True
-        except Exception as e:
-            return False
+        if self._snapshot is not None:
+            known = self._snapshot.knowsDevice(name)
+            if known is not None:
+                return known
+        return self.rdpGet(name,
+                           returnedTags=self._rdpExistsTags) is not False
+
+    def _rdpPackage(self, username, firstname, lastname, e164ext, did,
+                    extension, device_pool, calling_search_space,
+                    partition='Internal PAR'):
+        deviceName = "RDP"+username
+        nameString = firstname + " " + lastname
+
+        tempDirN1 = self.factory.XDirn()
+        tempDirN1.pattern = e164ext
+        tempDirN1.routePartitionName = partition
+        cawLogger.debug("%s", lazyPayload(tempDirN1))
+
+        # XPhoneLine is how a DirectoryNumber and a Phone are merged
+        tempPhoneLine1 = self.factory.XPhoneLine()
+        tempPhoneLine1.index = 1
+        tempPhoneLine1.dirn = tempDirN1
+
+        cawLogger.debug("%s", lazyPayload(tempPhoneLine1))
+
+        rdpPackage = self.factory.XRemoteDestinationProfile(
+            **self.profiles.rdpProfile(device_pool, calling_search_space))
+        rdpPackage.name = deviceName
+        rdpPackage.description = nameString + " x" + extension
+        rdpPackage.lines = {'line': tempPhoneLine1}
+        rdpPackage.userId = username
+        rdpPackage.primaryPhoneName = "CSF" + username
+        return rdpPackage
 
     def rdpAdd(self, username, firstname, lastname, e164ext, did, extension,
                device_pool, calling_search_space, partition='Internal PAR'):
         deviceName = "RDP"+username
         if not self.deviceExists(deviceName):
             try:
-                nameString = firstname + " " + lastname
-
-                tempDirN1 = self.factory.XDirn()
-                tempDirN1.pattern = e164ext
-                tempDirN1.routePartitionName = partition
-                cawLogger.debug(tempDirN1)
-
-                # XPhoneLine is how a DirectoryNumber and a Phone are merged
-                tempPhoneLine1 = self.factory.XPhoneLine()
-                tempPhoneLine1.index = 1
-                tempPhoneLine1.dirn = tempDirN1
-
-                cawLogger.debug(tempPhoneLine1)
-
-                nameCss = calling_search_space
-                nameDevicePool = device_pool
-
-                rdpPackage = self.factory.XRemoteDestinationProfile()
-                rdpPackage.name = deviceName
-                rdpPackage.description = nameString + " x" + extension
-                rdpPackage.product = 'Remote Destination Profile'
-                rdpPackage.model = 'Remote Destination Profile'
-                rdpPackage['class'] = 'Remote Destination Profile'
-                rdpPackage.protocol = 'Remote Destination'
-                rdpPackage.protocolSide = 'User'
-                rdpPackage.callingSearchSpaceName = nameCss
-                rdpPackage.devicePoolName = nameDevicePool
-                rdpPackage.lines = {'line': tempPhoneLine1}
-                rdpPackage.callInfoPrivacyStatus = 'Default'
-                rdpPackage.userId = username
-                rdpPackage.rerouteCallingSearchSpaceName = nameCss
-                rdpPackage.primaryPhoneName = "CSF" + username
-
-                result = self.service.addRemoteDestinationProfile(rdpPackage)
+                self._invalidate('rdp', deviceName.upper())
+                self._invalidate('phone', deviceName.upper())
+                self._markDevice(deviceName, None)
+                result = self._sendPackage(
+                    'addRemoteDestinationProfile', self._rdpPackage,
+                    {'username': username, 'firstname': firstname,
+                     'lastname': lastname, 'e164ext': e164ext, 'did': did,
+                     'extension': extension, 'device_pool': device_pool,
+                     'calling_search_space': calling_search_space,
+                     'partition': partition})
+                self._markDevice(deviceName, True)
                 return result
+            except axlThrottledError:
+                raise
             except Exception as e:
                 cawLogger.debug("Add Phone Error. Server error=%s", e)
                 # raise Exception("Phone could not be added")
@@ -408,37 +1058,72 @@ class cucmAxlWriter:
     def rdpUpdate(self, name):
         return False
 
+    def rdpUpdateFields(self, name, fields):
+        self._invalidate('rdp', name.upper())
+        self._invalidate('phone', name.upper())
+        result = self.service.updateRemoteDestinationProfile(name=name,
+                                                             **fields)
+        cawLogger.info("Update RDP Fields Completed")
+        cawLogger.debug("%s", lazyPayload(result))
+        return result
+
     def rdpDelete(self, name):
         devName = "RDP"+name
+        self._invalidate('rdp', devName.upper())
+        self._invalidate('phone', devName.upper())
+        self._markDevice(devName, None)
         try:
             result = self.service.removeRemoteDestinationProfile(name=devName)
+            self._markDevice(devName, False)
             cawLogger.info("Remove RDP Completed")
-            cawLogger.info(result)
+            cawLogger.debug("%s", lazyPayload(result))
             return "Deleted"
+        except axlThrottledError:
+            raise
         except Exception as e:
-            cawLogger.info(e)
+            cawLogger.info("%s", e)
             return "NOT Deleted"
 
     def rDestGet(self, dest):
         try:
             getRDest = self.service.getRemoteDestination(destination=dest)
-            print(getRDest)
             cawLogger.info("get Remote Dest Completed")
-            cawLogger.debug(getRDest)
+            cawLogger.debug("%s", lazyPayload(getRDest))
             return getRDest
+        except axlThrottledError:
+            raise
         except Exception as e:
             return False
 
     def rDestExists(self, dest):
         try:
-            getRDest = self.service.getRemoteDestination(destination=dest)
-            print(getRDest)
+            getRDest = self.service.getRemoteDestination(
+                destination=dest, returnedTags={'destination': ''})
             cawLogger.info("get Remote Dest Completed")
-            cawLogger.debug(getRDest)
+            cawLogger.debug("%s", lazyPayload(getRDest))
             return True
+        except axlThrottledError:
+            raise
         except Exception as e:
             return False
 
+    def _rDestPackage(self, dest, userid):
+        devName = "RD"+userid
+        rdPackage = self.factory.XRemoteDestination()
+        # not required or unique
+        rdPackage.name = devName
+        # required AND unique
+        rdPackage.destination = dest
+        rdPackage.answerTooSoonTimer = 1500
+        rdPackage.answerTooLateTimer = 19000
+        rdPackage.delayBeforeRingingCell = 4000
+        rdPackage.ownerUserId = userid
+        rdPackage.remoteDestinationProfileName = "RDP" + userid
+        rdPackage.isMobilePhone = 'true'
+        rdPackage.enableMobileConnect = 'true'
+        # rdPackage.dualModeDeviceName = "BOT" + userid
+        return rdPackage
+
     def rDestAdd(self, dest, userid, e164ext):
         '''Bug in 11.5 and earlier API will prevent this from working.
         In AXLSoap.xsd both dualModeDeviceName and
@@ -454,26 +1139,16 @@ class cucmAxlWriter:
         everything builds correctly.'''
 
         cawLogger.info("Remote Dest Add Started")
-        devName = "RD"+userid
         try:
-            rdPackage = self.factory.XRemoteDestination()
-            # not required or unique
-            rdPackage.name = devName
-            # required AND unique
-            rdPackage.destination = dest
-            rdPackage.answerTooSoonTimer = 1500
-            rdPackage.answerTooLateTimer = 19000
-            rdPackage.delayBeforeRingingCell = 4000
-            rdPackage.ownerUserId = userid
-            rdPackage.remoteDestinationProfileName = "RDP" + userid
-            rdPackage.isMobilePhone = 'true'
-            rdPackage.enableMobileConnect = 'true'
-            # rdPackage.dualModeDeviceName = "BOT" + userid
-            print(rdPackage)
+            rdPackage = self._rDestPackage(dest, userid)
+            cawLogger.debug("%s", lazyPayload(rdPackage))
 
             result = self.service.addRemoteDestination(rdPackage)
-            print(result)
+            cawLogger.info("Remote Dest Add Completed")
+            cawLogger.debug("%s", lazyPayload(result))
             return result
+        except axlThrottledError:
+            raise
         except Exception as e:
             cawLogger.debug("Add Remote Dest Error. Server error=%s", e)
             # raise Exception("Phone could not be added")
@@ -485,3 +1160,44 @@ class cucmAxlWriter:
 
     def rDestDelete(self):
         return False
+
+
+class axlWriterRegistry:
+    # process wide home of the cucmAxlWriter. The writer is built on first
+    # use and then shared by every caller; tests or tools can inject their
+    # own writer or factory instead.
+
+    _writer = None
+    _factory = cucmAxlWriter
+    _lock = threading.Lock()
+
+    @classmethod
+    def getWriter(cls):
+        if cls._writer is None:
+            with cls._lock:
+                if cls._writer is None:
+                    cawLogger.info("Building shared cucmAxlWriter")
+                    cls._writer = cls._factory()
+        return cls._writer
+
+    @classmethod
+    def setWriter(cls, writer):
+        with cls._lock:
+            cls._writer = writer
+
+    @classmethod
+    def setFactory(cls, factory):
+        # factory is any callable returning a cucmAxlWriter like object
+        with cls._lock:
+            cls._factory = factory
+            cls._writer = None
+
+    @classmethod
+    def hasWriter(cls):
+        return cls._writer is not None
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._writer = None
+            cls._factory = cucmAxlWriter
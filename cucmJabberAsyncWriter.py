@@ -0,0 +1,192 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import json
+import asyncio
+import logging
+from cucmJabberWriter import cucmJabberWriter
+from cucmJabberReconciler import cucmJabberAsyncReconciler
+from ciscoLogging import lazyPayload
+
+cjawLogger = logging.getLogger(__name__)
+
+
+class cucmJabberAsyncWriter(cucmJabberWriter):
+    # asyncio counterpart of cucmJabberWriter, driven by a cucmAxlAsyncWriter.
+    # Build it with  await cucmJabberAsyncWriter.create(..., axlWriter=w)
+    # so the CUCM user lookup is awaited as well.
+    #
+    # writeJabber keeps the line -> devices -> user ordering but awaits
+    # independent steps together: the e164AltNum update runs alongside the
+    # four devices, and the user update alongside the RDP.
+
+    _pendingNames = ('GetAD!', 'GetAD!')
+
+    def _loadUser(self, gFirstName, gLastName):
+        # the lookup is awaited by create()
+        self._pendingNames = (gFirstName, gLastName)
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        if kwargs.get('axlWriter') is None:
+            raise Exception("cucmJabberAsyncWriter needs a cucmAxlAsyncWriter")
+        writer = cls(*args, **kwargs)
+        if writer._resolvedUser is not None:
+            user = writer._resolvedUserReply()
+        else:
+            user = await writer.myCucmAxlWriter.userGet(
+                username=writer.getsAMAccountName(),
+                returnedTags=cls._userTags)
+        writer._setUser(user, *writer._pendingNames)
+        return writer
+
+    async def _deleteJabberLine(self):
+        cjawLogger.info("deleteJabberLine called")
+        if await self.myCucmAxlWriter.lineExists(self.getE164Ext()):
+            await self.myCucmAxlWriter.lineDelete(self.getE164Ext())
+            return "Success"  # Deleted
+        cjawLogger.info("Line does not exist to delete")
+        return "Fail"  # Did not delete
+
+    async def _createJabberLine(self):
+        cjawLogger.info("createJabberLine called")
+        if await self.myCucmAxlWriter.lineExists(self.getE164Ext()):
+            cjawLogger.info("createJabberLine already exists")
+            return "Fail"  # Line already exists
+        # vm= is always 'True', see cucmJabberWriter._createJabberLine
+        await self.myCucmAxlWriter.lineAdd(extension=self.getE164Ext(),
+                                           firstname=self.getFirstName(),
+                                           lastname=self.getLastName(),
+                                           device_pool=self.getBuilding(),
+                                           city=self.getCity(),
+                                           cfw_css=self.cfw_css,
+                                           vm='True',
+                                           vmProfileName=self.getVMprofile())
+        cjawLogger.info("createJabberLine Completed")
+        return "Success"  # Line Created
+
+    async def _updateJabberLine(self):
+        cjawLogger.info("updateJabberLine called")
+        if not await self.myCucmAxlWriter.lineExists(self.getE164Ext()):
+            cjawLogger.info("updateJabberLine does NOT exist")
+            return "Fail"  # Attempted to update a line that does not exist
+        await self.myCucmAxlWriter.lineUpdate(
+            e164extension=self.getE164Ext(),
+            eprise_extension=self.getEpriseExt(),
+            country_code=self.country_code)
+        return "Success"  # Line Updated
+
+    async def _forEachJabberTypeAsync(self, operation):
+        results = await asyncio.gather(*[operation(jabberType)
+                                         for jabberType in self._jabberTypes])
+        return {"{0}".format(jabberType): result
+                for jabberType, result in zip(self._jabberTypes, results)
+                if result is not None}
+
+    async def _deleteJabberDevice(self, jabberType):
+        if await self.myCucmAxlWriter.deviceExists(jabberType +
+                                                   self.getsAMAccountName()):
+            await self.myCucmAxlWriter.deviceDelete(self.getsAMAccountName(),
+                                                    jabberType)
+            return "Success"
+        return None
+
+    async def _deleteJabberDevices(self):
+        cjawLogger.info("deleteJabberDevice called")
+        return await self._forEachJabberTypeAsync(self._deleteJabberDevice)
+
+    async def _createJabberDevice(self, jabberType):
+        if await self.myCucmAxlWriter.deviceExists(jabberType +
+                                                   self.getsAMAccountName()):
+            return "Fail"
+        await self.myCucmAxlWriter.deviceAdd(
+            self.getsAMAccountName(),
+            firstname=self.getFirstName(),
+            lastname=self.getLastName(),
+            extension=self.getEpriseExt(),
+            e164ext=self.getE164Ext(),
+            did=self.getDID(),
+            device_pool=self.getBuilding(),
+            calling_search_space=self.device_css,
+            devicetype=jabberType)
+        cjawLogger.info("%s createJabberDevice done", jabberType)
+        return "Success"
+
+    async def _createJabberDevices(self):
+        cjawLogger.info("createJabberDevices called")
+        return await self._forEachJabberTypeAsync(self._createJabberDevice)
+
+    async def _updateJabberUser(self):
+        deviceList = []
+        for jabberType in self._jabberTypes:
+            deviceList.insert(0, jabberType+self.getsAMAccountName())
+        await self.myCucmAxlWriter.userUpdate(
+            username=self.getsAMAccountName(),
+            extension=self.getE164Ext(),
+            did=self.getDID(),
+            deviceList=deviceList,
+            pin="232323")
+        cjawLogger.info("updateJabberUser completed")
+        return "Success"  # User Updated
+
+    async def _createRdpDevice(self):
+        cjawLogger.info("createRdpDevice called")
+        result = await self.myCucmAxlWriter.rdpAdd(
+            self.getsAMAccountName(),
+            firstname=self.getFirstName(),
+            lastname=self.getLastName(),
+            e164ext=self.getE164Ext(),
+            did=self.getDID(),
+            extension=self.getEpriseExt(),
+            device_pool=self.getBuilding(),
+            calling_search_space=self.getCity())
+        cjawLogger.debug("%s", lazyPayload(result))
+        if isinstance(result, Exception):
+            # rdpAdd hands back the AXL error instead of raising it
+            return "Fail: {0}".format(result)
+        return "Success"
+
+    async def _deleteRdpDevice(self):
+        cjawLogger.info("deleteRdpDevice called")
+        result = await self.myCucmAxlWriter.rdpDelete(
+            name=self.getsAMAccountName())
+        cjawLogger.debug("%s", lazyPayload(result))
+        return "Success"
+
+    async def writeJabber(self):
+        status = {}
+        cjawLogger.info("writeJabber called")
+        # create line, needed for all other associations
+        status.update({"lineCreate": await self._createJabberLine()})
+        # e164AltNum and the devices only need the line
+        lineUpdate, deviceCreate = await asyncio.gather(
+            self._updateJabberLine(), self._createJabberDevices())
+        status.update({"lineUpdate": lineUpdate})
+        status.update({"deviceCreate": deviceCreate})
+        # user associations need the devices, the RDP needs the CSF device
+        endUserUpdate, rdpCreate = await asyncio.gather(
+            self._updateJabberUser(), self._createRdpDevice())
+        status.update({"endUserUpdate": endUserUpdate})
+        status.update({"rdpCreate": rdpCreate})
+        cjawLogger.info("writeJabber completed")
+        return json.dumps(status)
+
+    async def reconcileJabber(self, dryRun=False):
+        cjawLogger.info("reconcileJabber called")
+        status = await cucmJabberAsyncReconciler(self).reconcile(
+            dryRun=dryRun)
+        cjawLogger.info("reconcileJabber completed")
+        return status
+
+    async def cleanJabber(self):
+        status = {}
+        cjawLogger.info("cleanJabber called")
+        # devices and RDP are independent, the line goes last
+        deviceDelete, rdpDelete = await asyncio.gather(
+            self._deleteJabberDevices(), self._deleteRdpDevice())
+        status.update({"deviceDelete": deviceDelete})
+        status.update({"rdpDelete": rdpDelete})
+        status.update({"lineDelete": await self._deleteJabberLine()})
+        cjawLogger.info("cleanJabber completed")
+        return json.dumps(status)
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import json
+import asyncio
+import logging
+
+cjrLogger = logging.getLogger(__name__)
+
+# Reconcile mode for cucmJabberWriter: the desired line, devices, RDP and
+# user associations are built by the same package methods writeJabber
+# uses, the current objects are read with projected gets, and only the
+# missing objects and the fields that differ are written. A user that is
+# already correct costs the reads only.
+
+
+def _value(obj, key):
+    # field of a zeep object or a dict, None when it is not there
+    if obj is None:
+        return None
+    try:
+        return obj[key]
+    except (KeyError, AttributeError, TypeError, IndexError):
+        return None
+
+
+def _text(value):
+    # CUCM foreign keys come back as {'_value_1': name, 'uuid': ...}
+    if value is None:
+        return ''
+    named = _value(value, '_value_1')
+    if named is not None or not isinstance(value, (str, int, bool)):
+        value = named
+    return '' if value is None else str(value).strip()
+
+
+def _caseless(value):
+    return _text(value).lower()
+
+
+def _asList(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _linePatterns(lines):
+    # patterns of the lines of a phone / RDP, by line index
+    return tuple(sorted(
+        (_text(_value(line, 'index')), _text(_value(_value(line, 'dirn'),
+                                                     'pattern')))
+        for line in _asList(_value(lines, 'line'))))
+
+
+def _altNumMask(e164AltNum):
+    return _text(_value(e164AltNum, 'numMask'))
+
+
+def _extensionPattern(primaryExtension):
+    return _text(_value(primaryExtension, 'pattern'))
+
+
+def _deviceNames(associatedDevices):
+    return frozenset(_caseless(device) for device in
+                     _asList(_value(associatedDevices, 'device')))
+
+
+class reconcileStep:
+    # one write of a plan: create an object or update some of its fields.
+    # changes holds (current, desired) per field for the report, values the
+    # field values sent with the update.
+
+    def __init__(self, action, objectType, name, changes=None, values=None):
+        self.action = action
+        self.objectType = objectType
+        self.name = name
+        self.changes = changes or {}
+        self.values = values or {}
+        self.result = None
+
+    def toDict(self):
+        step = {"action": self.action, "object": self.objectType,
+                "name": self.name}
+        if self.changes:
+            step["fields"] = {field: {"current": current,
+                                      "desired": desired}
+                              for field, (current, desired)
+                              in self.changes.items()}
+        if self.result is not None:
+            step["result"] = self.result
+        return step
+
+
+class cucmJabberReconciler:
+    # field -> normalizer, both sides are normalized before they are
+    # compared. The returnedTags ask for exactly these fields.
+    _lineFields = {'description': _text, 'alertingName': _text,
+                   'asciiAlertingName': _text,
+                   'voiceMailProfileName': _text,
+                   'shareLineAppearanceCssName': _text}
+    _phoneFields = {'description': _text, 'devicePoolName': _text,
+                    'callingSearchSpaceName': _text,
+                    'ownerUserName': _caseless,
+                    'mobilityUserIdName': _caseless,
+                    'lines': _linePatterns}
+    _rdpFields = {'description': _text, 'devicePoolName': _text,
+                  'callingSearchSpaceName': _text,
+                  'rerouteCallingSearchSpaceName': _text,
+                  'userId': _caseless, 'lines': _linePatterns}
+    _userFields = {'primaryExtension': _extensionPattern,
+                   'selfService': _text, 'homeCluster': _caseless,
+                   'imAndPresenceEnable': _caseless,
+                   'enableMobility': _caseless}
+    _lineTags = dict({'pattern': '', 'e164AltNum': {'numMask': ''}},
+                     **{field: '' for field in _lineFields})
+    _linesTags = {'line': {'index': '', 'dirn': {'pattern': ''}}}
+    _phoneTags = dict({'name': '', 'lines': _linesTags},
+                      **{field: '' for field in _phoneFields
+                         if field != 'lines'})
+    _rdpTags = dict({'name': '', 'lines': _linesTags},
+                    **{field: '' for field in _rdpFields
+                       if field != 'lines'})
+    _userTags = dict({'userid': '', 'associatedDevices': {'device': ''},
+                      'primaryExtension': {'pattern': ''}},
+                     **{field: '' for field in _userFields
+                        if field != 'primaryExtension'})
+    _partition = 'Internal PAR'
+
+    def __init__(self, jabberWriter):
+        self._jabber = jabberWriter
+
+    @property
+    def axl(self):
+        return self._jabber.myCucmAxlWriter
+
+    def _deviceName(self, jabberType):
+        return self.axl.deviceGetName(self._jabber.getsAMAccountName(),
+                                      jabberType)
+
+    def _rdpName(self):
+        return "RDP" + self._jabber.getsAMAccountName()
+
+    # desired state, built like writeJabber builds its payloads
+
+    def _desiredLine(self):
+        jabber = self._jabber
+        return self.axl._linePackage(
+            jabber.getE164Ext(), jabber.getFirstName(), jabber.getLastName(),
+            jabber.getBuilding(), jabber.getCity(), vm='True',
+            vmProfileName=jabber.getVMprofile(), partition=self._partition,
+            cfw_css=jabber.cfw_css)
+
+    def _desiredAltNum(self):
+        return self.axl._lineUpdatePackage(
+            self._jabber.getE164Ext(),
+            self._jabber.getEpriseExt())['e164AltNum']
+
+    def _desiredPhone(self, jabberType):
+        jabber = self._jabber
+        return self.axl._devicePackage(
+            jabber.getsAMAccountName(), jabber.getFirstName(),
+            jabber.getLastName(), jabber.getE164Ext(), jabber.getEpriseExt(),
+            jabber.getDID(), jabber.getBuilding(), jabber.device_css,
+            jabberType, self._partition)
+
+    def _desiredRdp(self):
+        jabber = self._jabber
+        return self.axl._rdpPackage(
+            jabber.getsAMAccountName(), jabber.getFirstName(),
+            jabber.getLastName(), jabber.getE164Ext(), jabber.getDID(),
+            jabber.getEpriseExt(), jabber.getBuilding(), jabber.getCity(),
+            self._partition)
+
+    def _desiredUser(self):
+        jabber = self._jabber
+        deviceList = [jabberType + jabber.getsAMAccountName()
+                      for jabberType in reversed(jabber._jabberTypes)]
+        return self.axl._userUpdatePackage(
+            jabber.getsAMAccountName(), jabber.getE164Ext(), jabber.getDID(),
+            deviceList, self._partition)
+
+    # current state, projected reads through the transaction cache
+
+    @staticmethod
+    def _reply(result, tag):
+        if result is False or result is None:
+            return None
+        return _value(_value(result, 'return'), tag)
+
+    def currentState(self):
+        # {'line': obj, 'phones': {type: obj}, 'rdp': obj, 'user': obj},
+        # None for an object that does not exist
+        axl = self.axl
+        jabber = self._jabber
+        return {
+            'line': self._reply(axl.lineGet(jabber.getE164Ext(),
+                                            self._partition,
+                                            returnedTags=self._lineTags),
+                                'line'),
+            'phones': {jabberType: self._reply(
+                axl.deviceGet(self._deviceName(jabberType),
+                              returnedTags=self._phoneTags), 'phone')
+                for jabberType in jabber._jabberTypes},
+            'rdp': self._reply(axl.rdpGet(self._rdpName(),
+                                          returnedTags=self._rdpTags),
+                               'remoteDestinationProfile'),
+            'user': self._reply(axl.userGet(jabber.getsAMAccountName(),
+                                            returnedTags=self._userTags),
+                                'user')}
+
+    # plan
+
+    @staticmethod
+    def _fieldChanges(fields, current, desired):
+        changes = {}
+        values = {}
+        for field, normalize in fields.items():
+            have = normalize(_value(current, field))
+            want = normalize(_value(desired, field))
+            if have != want:
+                changes[field] = (have, want)
+                values[field] = _value(desired, field)
+        return changes, values
+
+    def _objectSteps(self, objectType, name, fields, current, desired):
+        if current is None:
+            return [reconcileStep('create', objectType, name)]
+        changes, values = self._fieldChanges(fields, current, desired)
+        if not changes:
+            return []
+        return [reconcileStep('update', objectType, name, changes, values)]
+
+    def plan(self, current=None):
+        # the writes that bring CUCM to the desired state, in apply order:
+        # line, devices, user, RDP
+        if current is None:
+            with self.axl.transaction():
+                current = self.currentState()
+        jabber = self._jabber
+        e164 = jabber.getE164Ext()
+        steps = self._objectSteps('line', e164, self._lineFields,
+                                  current['line'], self._desiredLine())
+        # a new line gets its e164AltNum from the update, as in writeJabber
+        desiredMask = _altNumMask(self._desiredAltNum())
+        currentMask = _altNumMask(_value(current['line'], 'e164AltNum'))
+        if currentMask != desiredMask:
+            steps.append(reconcileStep(
+                'update', 'e164AltNum', e164,
+                {'numMask': (currentMask, desiredMask)}))
+
+        for jabberType in jabber._jabberTypes:
+            steps.extend(self._objectSteps(
+                'phone', self._deviceName(jabberType), self._phoneFields,
+                current['phones'][jabberType],
+                self._desiredPhone(jabberType)))
+
+        steps.extend(self._userSteps(current['user']))
+        steps.extend(self._objectSteps('rdp', self._rdpName(),
+                                       self._rdpFields, current['rdp'],
+                                       self._desiredRdp()))
+        return steps
+
+    def _userSteps(self, currentUser):
+        # the user is LDAP synced and never created here. Devices already
+        # associated with the user are kept.
+        if currentUser is None:
+            raise Exception("User does NOT exist in CUCM, unrecoverable")
+        desired = self._desiredUser()
+        changes, values = self._fieldChanges(self._userFields, currentUser,
+                                             desired)
+        currentDevices = _asList(_value(_value(currentUser,
+                                               'associatedDevices'),
+                                        'device'))
+        have = _deviceNames({'device': currentDevices})
+        want = _deviceNames(desired['associatedDevices'])
+        if not want <= have:
+            missing = [device for device in
+                       desired['associatedDevices']['device']
+                       if device.lower() not in have]
+            changes['associatedDevices'] = (sorted(have),
+                                            sorted(have | want))
+            values['associatedDevices'] = {
+                'device': [_text(device) for device in currentDevices] +
+                missing}
+        if not changes:
+            return []
+        return [reconcileStep('update', 'user',
+                              self._jabber.getsAMAccountName(), changes,
+                              values)]
+
+    # apply
+
+    def _stepCall(self, step):
+        # (method, args, kwargs) of the writer call that applies step
+        jabber = self._jabber
+        axl = self.axl
+        if step.action == 'create' and step.objectType == 'line':
+            return jabber._createJabberLine, (), {}
+        elif step.objectType == 'e164AltNum':
+            return axl.lineUpdate, (), {
+                'e164extension': jabber.getE164Ext(),
+                'eprise_extension': jabber.getEpriseExt(),
+                'country_code': jabber.country_code}
+        elif step.action == 'create' and step.objectType == 'phone':
+            jabberTypes = {self._deviceName(jabberType): jabberType
+                           for jabberType in jabber._jabberTypes}
+            return jabber._createJabberDevice, (jabberTypes[step.name],), {}
+        elif step.action == 'create' and step.objectType == 'rdp':
+            return axl.rdpAdd, (
+                jabber.getsAMAccountName(), jabber.getFirstName(),
+                jabber.getLastName(), jabber.getE164Ext(), jabber.getDID(),
+                jabber.getEpriseExt(), jabber.getBuilding(), jabber.getCity(),
+                self._partition), {}
+        elif step.objectType == 'line':
+            return axl.lineUpdateFields, (step.name, step.values,
+                                          self._partition), {}
+        elif step.objectType == 'phone':
+            return axl.deviceUpdateFields, (step.name, step.values), {}
+        elif step.objectType == 'rdp':
+            return axl.rdpUpdateFields, (step.name, step.values), {}
+        elif step.objectType == 'user':
+            return axl.userUpdateFields, (step.name, step.values), {}
+        raise Exception("Unknown reconcile step {0} {1}".format(
+            step.action, step.objectType))
+
+    def _applyStep(self, step):
+        method, args, kwargs = self._stepCall(step)
+        result = method(*args, **kwargs)
+        if isinstance(result, Exception):
+            # rdpAdd hands back the AXL error instead of raising it
+            raise result
+
+    def apply(self, steps):
+        # runs the steps in order, a failed step is reported and the rest
+        # still run
+        for step in steps:
+            try:
+                self._applyStep(step)
+                step.result = "Success"
+            except Exception as e:
+                cjrLogger.info("%s %s %s failed: %s", step.action,
+                               step.objectType, step.name, e)
+                step.result = "Fail: {0}".format(e)
+        return steps
+
+    def reconcile(self, dryRun=False):
+        # plan, and unless dryRun apply it. Returns the JSON status.
+        with self.axl.transaction():
+            steps = self.plan(self.currentState())
+            cjrLogger.info("Reconcile %s: %s writes planned",
+                           self._jabber.getsAMAccountName(), len(steps))
+            if steps and not dryRun:
+                self.apply(steps)
+        return json.dumps({"dryRun": dryRun,
+                           "plan": [step.toDict() for step in steps]})
+
+
+class cucmJabberAsyncReconciler(cucmJabberReconciler):
+    # reconcile mode of cucmJabberAsyncWriter: the reads of the current
+    # state are awaited together, the planned writes one after the other
+    # in the order of the plan
+
+    async def currentState(self):
+        axl = self.axl
+        jabber = self._jabber
+        jabberTypes = list(jabber._jabberTypes)
+        line, rdp, user, *phones = await asyncio.gather(
+            axl.lineGet(jabber.getE164Ext(), self._partition,
+                        returnedTags=self._lineTags),
+            axl.rdpGet(self._rdpName(), returnedTags=self._rdpTags),
+            axl.userGet(jabber.getsAMAccountName(),
+                        returnedTags=self._userTags),
+            *[axl.deviceGet(self._deviceName(jabberType),
+                            returnedTags=self._phoneTags)
+              for jabberType in jabberTypes])
+        return {'line': self._reply(line, 'line'),
+                'phones': {jabberType: self._reply(phone, 'phone')
+                           for jabberType, phone in zip(jabberTypes, phones)},
+                'rdp': self._reply(rdp, 'remoteDestinationProfile'),
+                'user': self._reply(user, 'user')}
+
+    async def plan(self, current=None):
+        if current is None:
+            current = await self.currentState()
+        return cucmJabberReconciler.plan(self, current)
+
+    async def _applyStep(self, step):
+        method, args, kwargs = self._stepCall(step)
+        result = await method(*args, **kwargs)
+        if isinstance(result, Exception):
+            raise result
+
+    async def apply(self, steps):
+        for step in steps:
+            try:
+                await self._applyStep(step)
+                step.result = "Success"
+            except Exception as e:
+                cjrLogger.info("%s %s %s failed: %s", step.action,
+                               step.objectType, step.name, e)
+                step.result = "Fail: {0}".format(e)
+        return steps
+
+    async def reconcile(self, dryRun=False):
+        steps = await self.plan()
+        cjrLogger.info("Reconcile %s: %s writes planned",
+                       self._jabber.getsAMAccountName(), len(steps))
+        if steps and not dryRun:
+            await self.apply(steps)
+        return json.dumps({"dryRun": dryRun,
+                           "plan": [step.toDict() for step in steps]})
@@ -5,28 +5,19 @@ __author__ = 'Christopher Phillips'
 # import sys
 import logging
 import json
-from cucmAxlWriter import cucmAxlWriter
+from concurrent.futures import ThreadPoolExecutor
+from cucmAxlWriter import axlWriterRegistry
+from axlProfiles import jabberDeviceTypes
+from cucmJabberReconciler import cucmJabberReconciler
+from ciscoLogging import lazyPayload
 
 cjwLogger = logging.getLogger(__name__)
-cjwLogger.setLevel(logging.DEBUG)
-infoHandler = logging.FileHandler('jabberInfo.log', mode='w')
-infoHandler.setLevel(logging.INFO)
-debugHandler = logging.FileHandler('jabberDebug.log', mode='w')
-debugHandler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - \
-                                %(message)s')
-infoHandler.setFormatter(formatter)
-debugHandler.setFormatter(formatter)
-cjwLogger.addHandler(infoHandler)
-cjwLogger.addHandler(debugHandler)
-# cjwLogger.addHandler(logging.StreamHandler(sys.stdout))
-cjwLogger.info("Begin JabberWriter Info Logging")
-cjwLogger.debug("Begin JabberWriter Debug Logging")
 
 
 class cucmJabberWriter:
     # uses cucmAxlWriter to write Jabber devices lines users to CUCM
-    _jabberTypes = ['CSF', 'TCT', 'BOT', 'TAB']
+    _jabberTypes = list(jabberDeviceTypes)  # CSF, TCT, BOT, TAB
+    _userTags = ['firstName', 'lastName']  # all _setUser reads of getUser
 
     # jabberWriter will take all data about user, below
     # data obtained based on given data
@@ -45,13 +36,25 @@ class cucmJabberWriter:
     _givenSNR = ''  # Bool
     _givenSNRphone = ''  # IF T - Cell Phone Number required
     # Meet me config? (maybe)
-    myCucmAxlWriter = cucmAxlWriter()
+    _axlWriter = None  # None uses the shared writer from axlWriterRegistry
+    _resolvedUser = None  # names resolved in bulk for a batch
+    _deviceWorkers = 1  # more than 1 runs the per type device calls at once
+    _journal = None  # ciscoJournal.journalUser, skips steps done earlier
 
     def __init__(self, sAMAccountName, DID, EpriseExt, device_pool, City, VM='f',
                  VMprofile='voicemailusertemplate', CoS='International',
                  SNR='f', SNRphone='', PIN='232323', gFirstName='GetAD!',
-                 gLastName='GetAD!', country_code="1", cfw_css="None", device_css="None"):
-
+                 gLastName='GetAD!', country_code="1", cfw_css="None", device_css="None",
+                 axlWriter=None, device_workers=None, resolvedUser=None,
+                 journal=None):
+        # resolvedUser: names from cucmAxlWriter.resolveUserNames, skips
+        # the getUser round trip
+
+        self._axlWriter = axlWriter
+        self._resolvedUser = resolvedUser
+        self._journal = journal
+        if device_workers is not None:
+            self._deviceWorkers = device_workers
         self._setsAMAccountName(sAMAccountName)
         self._setDID(DID)
         self._setEpriseExt(EpriseExt)
@@ -65,8 +68,22 @@ class cucmJabberWriter:
         self.country_code = country_code
         self.cfw_css = cfw_css
         self.device_css = device_css
-        user = self.myCucmAxlWriter.userGet(username=self.getsAMAccountName())
-        cjwLogger.debug(user)
+        self._loadUser(gFirstName, gLastName)
+
+    def _loadUser(self, gFirstName, gLastName):
+        if self._resolvedUser is not None:
+            user = self._resolvedUserReply()
+        else:
+            user = self.myCucmAxlWriter.userGet(
+                username=self.getsAMAccountName(), returnedTags=self._userTags)
+        self._setUser(user, gFirstName, gLastName)
+
+    def _resolvedUserReply(self):
+        # same shape as the getUser reply _setUser reads
+        return {'return': {'user': self._resolvedUser}}
+
+    def _setUser(self, user, gFirstName, gLastName):
+        cjwLogger.debug("%s", lazyPayload(user))
 
         if not user:
             raise Exception("User does NOT exist in CUCM, unrecoverable")
@@ -84,6 +101,21 @@ class cucmJabberWriter:
         self._setFirstName(tempFirstName)
         self._setLastName(tempLastName)
 
+    @property
+    def myCucmAxlWriter(self):
+        # the AXL client is only built when a writer first talks to CUCM
+        if self._axlWriter is None:
+            self._axlWriter = axlWriterRegistry.getWriter()
+        return self._axlWriter
+
+    @classmethod
+    def setDeviceWorkers(cls, workers):
+        # default parallelism of the device stage for new writers
+        cls._deviceWorkers = workers
+
+    def getDeviceWorkers(self):
+        return self._deviceWorkers
+
     def _setsAMAccountName(self, username):
         self._usersAMAccountName = username
 
@@ -103,7 +135,12 @@ class cucmJabberWriter:
         return self._userEpriseExt
 
     def getE164Ext(self):
-        return "\+" + self.country_code + self._userDID
+        return self.e164Pattern(self.country_code, self._userDID)
+
+    @staticmethod
+    def e164Pattern(country_code, did):
+        # line pattern as stored in CUCM, the + is escaped
+        return "\+" + country_code + did
 
     def _set_device_pool(self, device_pool):
         self._givenBuilding = device_pool
@@ -208,41 +245,71 @@ class cucmJabberWriter:
             cjwLogger.info("updateJabberLine does NOT exist")
             return "Fail"  # Attempted to update a line that does not exist"
 
-    def _deleteJabberDevices(self):
+    def _forEachJabberType(self, operation):
+        # runs operation(jabberType) for every Jabber type, concurrently when
+        # more than one device worker is set. Returns {jabberType: result},
+        # a result of None is left out.
         status = {}
+        workers = min(self._deviceWorkers, len(self._jabberTypes))
+        if workers <= 1:
+            for jabberType in self._jabberTypes:
+                status[jabberType] = operation(jabberType)
+        else:
+            axlWriter = self.myCucmAxlWriter
+            cache = axlWriter.currentTransaction()
+
+            def runOperation(jabberType):
+                with axlWriter.joinTransaction(cache):
+                    return operation(jabberType)
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [(jabberType, pool.submit(runOperation, jabberType))
+                           for jabberType in self._jabberTypes]
+                for jabberType, future in futures:
+                    status[jabberType] = future.result()
+        return {"{0}".format(jabberType): result
+                for jabberType, result in status.items()
+                if result is not None}
+
+    def _deleteJabberDevice(self, jabberType):
+        result = None
+        if self.myCucmAxlWriter.deviceExists(jabberType +
+                                             self.getsAMAccountName()):
+            cjwLogger.info("%s Device exists", jabberType)
+            self.myCucmAxlWriter.deviceDelete(self.getsAMAccountName(),
+                                              jabberType)
+            result = "Success"
+            # result = "Fail"
+        cjwLogger.info("%s deleteJabberDevice done", jabberType)
+        return result
+
+    def _deleteJabberDevices(self):
         cjwLogger.info("deleteJabberDevice called")
-        for jabberType in self._jabberTypes:
-            if self.myCucmAxlWriter.deviceExists(jabberType +
+        return self._forEachJabberType(self._deleteJabberDevice)
+
+    def _createJabberDevice(self, jabberType):
+        if not self.myCucmAxlWriter.deviceExists(jabberType +
                                                  self.getsAMAccountName()):
-                cjwLogger.info("%s Device exists", jabberType)
-                self.myCucmAxlWriter.deviceDelete(self.getsAMAccountName(),
-                                                  jabberType)
-                status.update({"{0}".format(jabberType): "Success"})
-                # status.update({"{0}".format(jabberType): "Fail"})
-            cjwLogger.info("%s deleteJabberDevice done", jabberType)
-        return status
+            cjwLogger.info("%s Device does NOT exist", jabberType)
+            self.myCucmAxlWriter.deviceAdd(self.getsAMAccountName(),
+                                           firstname=self.getFirstName(),
+                                           lastname=self.getLastName(),
+                                           extension=self.getEpriseExt(),
+                                           e164ext=self.getE164Ext(),
+                                           did=self.getDID(),
+                                           device_pool=self.getBuilding(),
+                                           calling_search_space=self.device_css,
+                                           devicetype=jabberType)
+            cjwLogger.info("%s createJabberDevice done", jabberType)
+            return "Success"
+        return "Fail"
 
     def _createJabberDevices(self):
-        status = {}
         cjwLogger.info("createJabberDevices called")
-        for jabberType in self._jabberTypes:
-            if not self.myCucmAxlWriter.deviceExists(jabberType +
-                                                     self.getsAMAccountName()):
-                cjwLogger.info("%s Device does NOT exist", jabberType)
-                self.myCucmAxlWriter.deviceAdd(self.getsAMAccountName(),
-                                               firstname=self.getFirstName(),
-                                               lastname=self.getLastName(),
-                                               extension=self.getEpriseExt(),
-                                               e164ext=self.getE164Ext(),
-                                               did=self.getDID(),
-                                               device_pool=self.getBuilding(),
-                                               calling_search_space=self.device_css,
-                                               devicetype=jabberType)
-                status.update({"{0}".format(jabberType): "Success"})
-                cjwLogger.info("%s createJabberDevice done", jabberType)
-            else:
-                status.update({"{0}".format(jabberType): "Fail"})
-        return status
+        return self._forEachJabberType(
+            lambda jabberType: self._journaled('deviceCreate.' + jabberType,
+                                               self._createJabberDevice,
+                                               jabberType))
 
     def _updateJabberUser(self):
         deviceList = []
@@ -266,39 +333,63 @@ class cucmJabberWriter:
                                              extension=self.getEpriseExt(),
                                              device_pool=self.getBuilding(),
                                              calling_search_space=self.getCity())
-        cjwLogger.debug(result)
+        cjwLogger.debug("%s", lazyPayload(result))
+        if isinstance(result, Exception):
+            # rdpAdd hands back the AXL error instead of raising it
+            return "Fail: {0}".format(result)
         return "Success"
 
     def _deleteRdpDevice(self):
         cjwLogger.info("deleteRdpDevice called")
         result = self.myCucmAxlWriter.rdpDelete(name=self.getsAMAccountName())
-        cjwLogger.debug(result)
+        cjwLogger.debug("%s", lazyPayload(result))
         return "Success"
 
+    def _journaled(self, step, operation, *args):
+        # runs a writeJabber step, through the journal when there is one
+        if self._journal is None:
+            return operation(*args)
+        return self._journal.run(step, operation, *args)
+
     def writeJabber(self):
         status = {}
         cjwLogger.info("writeJabber called")
-        # create line, needed for all other associations
-        status.update({"lineCreate": self._createJabberLine()})
-        # required for adding an e164AltNum
-        status.update({"lineUpdate": self._updateJabberLine()})
-        # create ALL jabber devices in CUCM
-        status.update({"deviceCreate": self._createJabberDevices()})
-        # update user to associate devices
-        status.update({"endUserUpdate": self._updateJabberUser()})
-        # add Remote Destination Profile
-        status.update({"rdpCreate": self._createRdpDevice()})
+        # exists checks are answered once per run from the read cache
+        with self.myCucmAxlWriter.transaction():
+            # create line, needed for all other associations
+            status.update({"lineCreate": self._journaled(
+                'lineCreate', self._createJabberLine)})
+            # required for adding an e164AltNum
+            status.update({"lineUpdate": self._journaled(
+                'lineUpdate', self._updateJabberLine)})
+            # create ALL jabber devices in CUCM
+            status.update({"deviceCreate": self._createJabberDevices()})
+            # update user to associate devices
+            status.update({"endUserUpdate": self._journaled(
+                'endUserUpdate', self._updateJabberUser)})
+            # add Remote Destination Profile
+            status.update({"rdpCreate": self._journaled(
+                'rdpCreate', self._createRdpDevice)})
         cjwLogger.info("writeJabber completed")
         return json.dumps(status)
 
+    def reconcileJabber(self, dryRun=False):
+        # like writeJabber, but only missing objects and fields that drifted
+        # are written. dryRun returns the plan without writing.
+        cjwLogger.info("reconcileJabber called")
+        status = cucmJabberReconciler(self).reconcile(dryRun=dryRun)
+        cjwLogger.info("reconcileJabber completed")
+        return status
+
     def cleanJabber(self):
         status = {}
         cjwLogger.info("cleanJabber called")
-        # delete all devices
-        status.update({"deviceDelete": self._deleteJabberDevices()})
-        # delete RDP
-        status.update({"rdpDelete": self._deleteRdpDevice()})
-        # delete line
-        status.update({"lineDelete": self._deleteJabberLine()})
+        with self.myCucmAxlWriter.transaction():
+            # delete all devices
+            status.update({"deviceDelete": self._deleteJabberDevices()})
+            # delete RDP
+            status.update({"rdpDelete": self._deleteRdpDevice()})
+            # delete line
+            status.update({"lineDelete": self._deleteJabberLine()})
         cjwLogger.info("cleanJabber completed")
         return json.dumps(status)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import os  # common prefix
+import logging
+from cupiRestWriter import cupiConnection
+
+cbuLogger = logging.getLogger(__name__)
+
+# Unity Connection lookups for many users at once. cupiRestWriter looks up
+# the LDAP pkid (import) or the mailbox ObjectId (delete) of every user
+# with its own GET; here the ids of a whole batch are read with a few
+# paged queries: aliases sharing a prefix are found with one
+# (alias startswith ...) query, and when a batch would need too many such
+# queries the whole list is paged through once instead. Every lookup reads
+# the lists afresh, imports and deletes made in between change them.
+
+
+class cupiBulkWriter:
+
+    _minAliasPrefix = 3  # shortest alias prefix searched with startswith
+    _maxPrefixQueries = 50  # more prefix groups page the whole list once
+
+    def __init__(self, config=None, session=None):
+        # config: cxnAppConfig, None reads cxn.cfg
+        self._connection = cupiConnection(config=config, session=session)
+
+    def _aliasGroups(self, aliases):
+        # yields (query, aliases it covers), sorted aliases sharing at
+        # least _minAliasPrefix leading characters are one query
+        group = []
+        prefix = ''
+        for alias in sorted(set(alias.lower() for alias in aliases)):
+            shared = os.path.commonprefix([prefix, alias])
+            if group and len(shared) >= self._minAliasPrefix:
+                group.append(alias)
+                prefix = shared
+                continue
+            if group:
+                yield self._aliasQuery(prefix, group), group
+            group = [alias]
+            prefix = alias
+        if group:
+            yield self._aliasQuery(prefix, group), group
+
+    @staticmethod
+    def _aliasQuery(prefix, group):
+        if len(group) == 1:
+            return '(alias is {0})'.format(group[0])
+        return '(alias startswith {0})'.format(prefix)
+
+    def _fullIndex(self, path, key, aliasField, idField):
+        # lower case alias -> id of the whole list
+        index = {}
+        for page in self._connection.pages(path, key, readAhead=True):
+            for record in page:
+                index[(record.get(aliasField) or '').lower()] = \
+                    record.get(idField)
+        cbuLogger.info("%s paged, %s aliases", path, len(index))
+        return index
+
+    def _index(self, aliases, path, key, aliasField, idField):
+        # {alias: id} of the aliases found, in the case they were given
+        aliases = [alias for alias in aliases if alias]
+        groups = list(self._aliasGroups(aliases))
+        if len(groups) > self._maxPrefixQueries:
+            found = self._fullIndex(path, key, aliasField, idField)
+        else:
+            found = {}
+            for query, group in groups:
+                wanted = set(group)
+                for page in self._connection.pages(path, key,
+                                                   {'query': query}):
+                    for record in page:
+                        alias = (record.get(aliasField) or '').lower()
+                        if alias in wanted:
+                            found[alias] = record.get(idField)
+        index = {alias: found[alias.lower()] for alias in aliases
+                 if found.get(alias.lower())}
+        cbuLogger.info("%s: %s of %s aliases found", path, len(index),
+                       len(set(aliases)))
+        return index
+
+    def importPkids(self, aliases):
+        # {alias: pkid} of the LDAP users that can be imported
+        return self._index(aliases, 'import/users/ldap', 'ImportUser',
+                           'alias', 'pkid')
+
+    def objectIds(self, aliases):
+        # {alias: ObjectId} of the existing mailboxes
+        return self._index(aliases, 'users', 'User', 'Alias', 'ObjectId')
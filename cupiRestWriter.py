@@ -3,51 +3,262 @@ __version__ = '0.4'
 __author__ = 'Christopher Phillips'
 
 # import sys
+import time
 import logging
+import threading
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from ucAppConfig import cxnAppConfig
+from ciscoMetrics import ciscoMetrics
 
 import urllib3  # imported to disable the SAN warning for the cert
 urllib3.disable_warnings(urllib3.exceptions.SubjectAltNameWarning)
 
 cupiRLogger = logging.getLogger(__name__)
-cupiRLogger.setLevel(logging.DEBUG)
-infoHandler = logging.FileHandler('cupiInfo.log', mode='w')
-infoHandler.setLevel(logging.INFO)
-debugHandler = logging.FileHandler('cupiDebug.log', mode='w')
-debugHandler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - \
-                                %(message)s')
-infoHandler.setFormatter(formatter)
-debugHandler.setFormatter(formatter)
-cupiRLogger.addHandler(infoHandler)
-cupiRLogger.addHandler(debugHandler)
-# cupiRLogger.addHandler(logging.StreamHandler(sys.stdout))
-cupiRLogger.info("Begin CUPI Writer Info Logging")
-cupiRLogger.debug("Begin CUPI Writer Debug Logging")
+
+
+class cupiSessionPool:
+    # one keep-alive requests.Session per process, shared by every
+    # cupiRestWriter so consecutive calls reuse warm TLS connections
+
+    _session = None
+    _poolSize = 10  # connections kept open to Unity Connection
+    _retries = 3  # connect errors always, reads / 5xx only for GET, DELETE
+    _backoff = 0.5  # seconds, doubled on every retry
+    _lock = threading.Lock()
+
+    @classmethod
+    def getSession(cls):
+        if cls._session is None:
+            with cls._lock:
+                if cls._session is None:
+                    cls._session = cls.buildSession(cls._poolSize,
+                                                    cls._retries,
+                                                    cls._backoff)
+                    cupiRLogger.info("Shared CUPI session created, pool=%s",
+                                     cls._poolSize)
+        return cls._session
+
+    @classmethod
+    def configure(cls, poolSize=None, retries=None, backoff=None):
+        # the pool only grows. An open session that already has poolSize
+        # connections and the same retry policy is kept, other writers may
+        # be using it. Otherwise it is replaced, not closed: writers holding
+        # it finish on it and its connections go when they let go of it.
+        with cls._lock:
+            changed = False
+            if poolSize is not None and poolSize > cls._poolSize:
+                cls._poolSize = poolSize
+                changed = True
+            if retries is not None and retries != cls._retries:
+                cls._retries = retries
+                changed = True
+            if backoff is not None and backoff != cls._backoff:
+                cls._backoff = backoff
+                changed = True
+            if changed and cls._session is not None:
+                cls._session = None
+                cupiRLogger.info("Shared CUPI session replaced, pool=%s",
+                                 cls._poolSize)
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            cls._closeSession()
+
+    @classmethod
+    def _closeSession(cls):
+        if cls._session is not None:
+            cls._session.close()
+            cls._session = None
+
+    @staticmethod
+    def buildSession(poolSize, retries, backoff):
+        retryStatus = (502, 503, 504)
+        retryMethods = frozenset(['GET', 'DELETE'])
+        try:
+            retry = Retry(total=retries, backoff_factor=backoff,
+                          status_forcelist=retryStatus,
+                          allowed_methods=retryMethods,
+                          raise_on_status=False)
+        except TypeError:
+            # urllib3 < 1.26
+            retry = Retry(total=retries, backoff_factor=backoff,
+                          status_forcelist=retryStatus,
+                          method_whitelist=retryMethods,
+                          raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize,
+                              max_retries=retry, pool_block=True)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+class cupiConnection:
+    # URL, credentials and session of one Unity Connection. Every CUPI call
+    # goes through request() so it is timed and counted per operation.
+
+    _headers = {"Content-Type": "application/json",
+                "Accept": "application/json"}
+    _rowsPerPage = 500  # CUPI caps a page at 2000 rows
+
+    def __init__(self, config=None, session=None):
+        # config: cxnAppConfig, None reads cxn.cfg. The pooled session is
+        # shared unless one is given.
+        if config is None:
+            config = cupiRestWriter.getSharedConfig()
+        if session is None:
+            session = cupiSessionPool.getSession()
+        self.config = config
+        self._http = session
+        self.baseUrl = config.getAppApiUrl()
+        self._auth = (config.getAppUsername(), config.getAppPassword())
+        self._verify = config.getAppCert()
+
+    def request(self, method, path, operation=None, **kwargs):
+        # operation names the call in the metrics ('POST users',
+        # 'GET import/users/ldap', ...)
+        if operation is None:
+            operation = '{0} {1}'.format(method.upper(), path)
+        data = kwargs.get('data')
+        started = time.monotonic()
+        try:
+            resp = self._http.request(method.upper(),
+                                      self.baseUrl + path,
+                                      auth=self._auth,
+                                      verify=self._verify,
+                                      headers=self._headers,
+                                      **kwargs)
+        except Exception:
+            ciscoMetrics.observe('cupi', operation,
+                                 time.monotonic() - started, error=True)
+            raise
+        ciscoMetrics.observe('cupi', operation, time.monotonic() - started,
+                             error=resp.status_code >= 400)
+        ciscoMetrics.addBytes('cupi', operation,
+                              bytesOut=len(data) if data else 0,
+                              bytesIn=len(resp.content))
+        return resp
+
+    def getJson(self, path, params=None):
+        resp = self.request('get', path, params=params)
+        if resp.status_code != 200:
+            # This means something went wrong.
+            raise Exception('GET {0} {1}'.format(self.baseUrl + path,
+                                                 resp.status_code))
+        return resp.json()
+
+    @staticmethod
+    def records(data, key):
+        # CUPI returns a single record as an object, several as a list and
+        # none at all without the key
+        found = data.get(key)
+        if found is None:
+            return []
+        if isinstance(found, dict):
+            return [found]
+        return found
+
+    def _page(self, path, key, params, rowsPerPage, pageNumber):
+        # (records, @total) of one page
+        data = self.getJson(path, dict(params or {}, rowsPerPage=rowsPerPage,
+                                       pageNumber=pageNumber))
+        return self.records(data, key), int(data.get('@total') or 0)
+
+    def pages(self, path, key, params=None, rowsPerPage=None,
+              readAhead=False):
+        # yields the records of path one page (rowsPerPage / pageNumber) at
+        # a time, e.g. pages('users', 'User', {'query': '(alias startswith
+        # ab)'}). With readAhead the next page is requested while the
+        # caller works through the current one; at most two pages are held.
+        rowsPerPage = rowsPerPage or self._rowsPerPage
+
+        def fetch(pageNumber):
+            return self._page(path, key, params, rowsPerPage, pageNumber)
+
+        def isLast(pageNumber, records, total):
+            return len(records) < rowsPerPage or \
+                (total and pageNumber * rowsPerPage >= total)
+
+        pageNumber = 1
+        if not readAhead:
+            while True:
+                records, total = fetch(pageNumber)
+                yield records
+                if isLast(pageNumber, records, total):
+                    return
+                pageNumber += 1
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(fetch, pageNumber)
+            while True:
+                records, total = pending.result()
+                if isLast(pageNumber, records, total):
+                    break
+                pageNumber += 1
+                pending = pool.submit(fetch, pageNumber)
+                yield records
+        yield records
+
+    def _iterRecords(self, path, key, query, fields, rowsPerPage,
+                     readAhead):
+        params = {'query': query} if query else None
+        for page in self.pages(path, key, params, rowsPerPage, readAhead):
+            for record in page:
+                if fields:
+                    record = {field: record.get(field) for field in fields}
+                yield record
+
+    # The iterators below walk a whole list with rowsPerPage / pageNumber
+    # and yield one record (dict) at a time, so memory stays at one page
+    # (two with readAhead). query narrows the list, e.g. '(alias
+    # startswith ab)'; fields keeps only those keys of every record.
+
+    def iterUsers(self, query=None, fields=None, rowsPerPage=None,
+                  readAhead=False):
+        # mailboxes, e.g. fields=['Alias', 'ObjectId', 'DtmfAccessId']
+        return self._iterRecords('users', 'User', query, fields,
+                                 rowsPerPage, readAhead)
+
+    def iterImportUsers(self, query=None, fields=None, rowsPerPage=None,
+                        readAhead=False):
+        # LDAP users not imported yet, e.g. fields=['alias', 'pkid']
+        return self._iterRecords('import/users/ldap', 'ImportUser', query,
+                                 fields, rowsPerPage, readAhead)
 
 
 class cupiRestWriter:
 
     myCxnConfig = ''
-    __headers = {"Content-Type": "application/json",
-                 "Accept": "application/json"}
     __baseUrl = ''
-    __auth = ''
-    __verify = ''
     _template = 'voicemailusertemplate'
     _newUserData = ''
     _alias = ''
     _extension = ''
+    _sharedConfig = None  # cxn.cfg is read once per process
+    _configLock = threading.Lock()
+
+    @classmethod
+    def getSharedConfig(cls):
+        if cls._sharedConfig is None:
+            with cls._configLock:
+                if cls._sharedConfig is None:
+                    cls._sharedConfig = cxnAppConfig('cxn.cfg')
+        return cls._sharedConfig
 
     def __init__(self, Alias, Extension, FirstName, LastName, EmailAddress,
-                 Template):
+                 Template, session=None, config=None):
+        # config: cxnAppConfig of the target cluster, None reads cxn.cfg
         cupiRLogger.info("Rest Writer Started")
+        # writers share the pooled session unless one is given
+        self._connection = cupiConnection(config=config, session=session)
         self._alias = Alias
         self._extension = Extension
         self._template = Template
-        self.myCxnConfig = cxnAppConfig('cxn.cfg')
+        self.myCxnConfig = self._connection.config
 
         if '!' in FirstName or '!' in LastName:
             # Get from AD User
@@ -62,10 +273,7 @@ class cupiRestWriter:
                                                 EmailAddress,
                                                 Extension)
         cupiRLogger.debug(self._newUserData)
-        self.__baseUrl = self.myCxnConfig.getAppApiUrl()
-        self.__auth = (self.myCxnConfig.getAppUsername(),
-                       self.myCxnConfig.getAppPassword())
-        self.__verify = self.myCxnConfig.getAppCert()
+        self.__baseUrl = self._connection.baseUrl
 
     def getNewUserJSON(self, FirstName, LastName, Alias, EmailAddress,
                        DtmfAccessId):
@@ -80,16 +288,17 @@ class cupiRestWriter:
                            "DtmfAccessId": DtmfAccessId
                            })
 
+    def _request(self, method, path, operation=None, **kwargs):
+        return self._connection.request(method, path, operation=operation,
+                                        **kwargs)
+
     def createNewVoicemail(self):
         cupiRLogger.info("Create Voicemail Started")
         vmCreateUrl = 'users'
         url = self.__baseUrl + vmCreateUrl
         querystring = {"templateAlias": self._template}
 
-        resp = requests.post(url,
-                             auth=self.__auth,
-                             verify=self.__verify,
-                             headers=self.__headers,
+        resp = self._request('post', vmCreateUrl,
                              data=self._newUserData,
                              params=querystring)
         if resp.status_code != 201:
@@ -103,11 +312,7 @@ class cupiRestWriter:
         url = self.__baseUrl + vmImportUrl
         query = {"limit": "1", "query": "(alias is {0})".format(self._alias)}
 
-        resp = requests.get(url,
-                            auth=self.__auth,
-                            verify=self.__verify,
-                            headers=self.__headers,
-                            params=query)
+        resp = self._request('get', vmImportUrl, params=query)
         if resp.status_code != 200:
             # This means something went wrong.
             raise Exception('GET {0} {1}'.format(url,
@@ -119,22 +324,20 @@ class cupiRestWriter:
             return("KeyError: VM will NOT be created")
         return pkid
 
-    def importNewVoicemail(self):
+    def importNewVoicemail(self, pkid=None):
+        # pkid: of the LDAP user when already known, see cupiBulkWriter
         status = {}
         cupiRLogger.info("Import Voicemail Started")
 
-        pkid = self.getImportUserPkid()
+        if pkid is None:
+            pkid = self.getImportUserPkid()
         status.update({"vmLdapUserFound": "Success"})
         userData = json.dumps({"dtmfAccessId": self._extension, "pkid": pkid})
         vmCreateUrl = 'import/users/ldap'
         url = self.__baseUrl + vmCreateUrl
         query = {"templateAlias": self._template}
 
-        resp = requests.post(url,
-                             auth=self.__auth,
-                             verify=self.__verify,
-                             headers=self.__headers,
-                             data=userData,
+        resp = self._request('post', vmCreateUrl, data=userData,
                              params=query)
         if resp.status_code != 201:
             # This means something went wrong.
@@ -146,10 +349,7 @@ class cupiRestWriter:
     def getTemplate(self):
         getTemplateUrl = 'usertemplates'
         url = self.__baseUrl + getTemplateUrl
-        resp = requests.post(url,
-                             auth=self.__auth,
-                             verify=self.__verify,
-                             headers=self.__headers)
+        resp = self._request('post', getTemplateUrl)
         if resp.status_code != 201:
             # This means something went wrong.
             raise Exception('POST {0} {1}'.format(url,
@@ -160,11 +360,7 @@ class cupiRestWriter:
         url = self.__baseUrl + vmGetUrl
         query = {"query": "(alias is {0})".format(self._alias)}
 
-        resp = requests.get(url,
-                            auth=self.__auth,
-                            verify=self.__verify,
-                            headers=self.__headers,
-                            params=query)
+        resp = self._request('get', vmGetUrl, params=query)
         data = resp.json()
         try:
             return data['User']['ObjectId']
@@ -175,16 +371,52 @@ class cupiRestWriter:
             raise Exception('GET {0} {1}'.format(url,
                                                  resp.status_code))
 
-    def deleteVoicemail(self):
+    def findVmObjectId(self):
+        # ObjectId of the mailbox, None when the user has none
+        userObjectId = self.getVmObjectId()
+        if userObjectId.startswith('KeyError'):
+            return None
+        return userObjectId
+
+    def updateVoicemailExtension(self, objectId=None):
+        # sets the mailbox extension (DtmfAccessId) to the writer's, e.g.
+        # after the user's DID changed
+        status = {}
+        cupiRLogger.info("Update Voicemail Extension Started")
+        userObjectId = objectId
+        if userObjectId is None:
+            userObjectId = self.findVmObjectId()
+        if userObjectId is None:
+            raise Exception("Mailbox of {0} not found".format(self._alias))
+        vmUpdateUrl = 'users/' + userObjectId
+        url = self.__baseUrl + vmUpdateUrl
+        resp = self._request('put', vmUpdateUrl,
+                             data=json.dumps({"DtmfAccessId":
+                                              self._extension}),
+                             operation='PUT users/{ObjectId}')
+        if resp.status_code != 204:
+            # This means something went wrong.
+            cupiRLogger.info('Put {0} {1}'.format(url, resp.status_code))
+            status.update({"mailboxUpdated": "Fail"})
+        else:
+            status.update({"mailboxUpdated": "Success"})
+        return json.dumps(status)
+
+    def deleteVoicemail(self, objectId=None):
+        # objectId: of the mailbox when already known, see cupiBulkWriter
         status = {}
         cupiRLogger.info("Delete Voicemail Started")
-        userObjectId = self.getVmObjectId()
+        userObjectId = objectId
+        if userObjectId is None:
+            userObjectId = self.findVmObjectId()
+        if userObjectId is None:
+            # nothing to delete, no DELETE is sent
+            status.update({"mailboxDeleted": "Not found"})
+            return json.dumps(status)
         vmDeleteUrl = 'users/' + userObjectId
         url = self.__baseUrl + vmDeleteUrl
-        resp = requests.delete(url,
-                               auth=self.__auth,
-                               verify=self.__verify,
-                               headers=self.__headers)
+        resp = self._request('delete', vmDeleteUrl,
+                             operation='DELETE users/{ObjectId}')
         if resp.status_code != 204:
             # This means something went wrong.
             cupiRLogger.info('Delete {0} {1}'.format(url,
@@ -7,5 +7,11 @@ setup(name='cucmAxlWriter',
       url='https://github.com/ChristopherUC/cucmAxlWriter',
       license='GNU GENERAL PUBLIC LICENSE Version 3',
       py_modules=['appConfig', 'ucAppConfig', 'configCreator', 'cucmAxlWriter',
-                  'cucmJabberWriter', 'cupiRestWriter'],
+                  'cucmJabberWriter', 'cupiRestWriter', 'ciscoBatchWriter',
+                  'axlWsdlCache', 'axlRateLimiter', 'cucmAxlAsyncWriter',
+                  'cucmJabberAsyncWriter', 'ciscoWriterDaemon',
+                  'ciscoLogging', 'ciscoMetrics', 'axlTemplateSerializer',
+                  'axlProfiles', 'cucmJabberReconciler',
+                  'ciscoSync', 'ciscoJournal', 'ciscoClusters',
+                  'axlNodePool', 'cupiBulkWriter'],
       )
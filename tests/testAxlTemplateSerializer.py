@@ -0,0 +1,181 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import os  # fixture path
+import sys
+import unittest
+from zeep import Client
+from zeep.transports import Transport
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from axlTemplateSerializer import axlTemplateSerializer  # noqa: E402
+from axlProfiles import axlProfileCache  # noqa: E402
+from cucmAxlWriter import cucmAxlWriter  # noqa: E402
+
+# The template serializer against zeep on a WSDL with the shape of the AXL
+# addLine / addPhone / addRemoteDestinationProfile / updateUser operations:
+# for every set of values the rendered envelope has to be byte for byte what
+# zeep sends, headers included. addPhone and addRemoteDestinationProfile
+# are built by cucmAxlWriter's own package methods.
+#
+#   python -m unittest discover tests
+
+_fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'axlTemplateFixture.wsdl')
+_bindingName = "{http://www.cisco.com/AXLAPIService/}AXLAPIBinding"
+
+# values that need escaping, or are not ASCII
+_awkwardValues = ['Smith & Wesson', 'a<b>c', '"quoted" \'single\'',
+                  'Zoë Ångström', '東京 オフィス', ']]>', '&amp; already',
+                  ' leading and trailing ', '']
+
+
+def _linePackage(extension, description, alertingName, partition):
+    return {'pattern': extension,
+            'description': description,
+            'usage': 'Device',
+            'routePartitionName': partition,
+            'alertingName': alertingName,
+            'asciiAlertingName': 'ascii',
+            'voiceMailProfileName': 'Default'}
+
+
+def _buildLine(**values):
+    # as cucmAxlWriter._sendPackage: the package is the one positional
+    return (_linePackage(**values),), {}
+
+
+def _buildUser(username, did, deviceList):
+    # updateUser is called with keywords
+    return (), {'userid': username, 'selfService': did,
+                'associatedDevices': {'device': deviceList},
+                'enableMobility': 'true'}
+
+
+def _person(username, firstname, lastname):
+    # the slots deviceAdd / rdpAdd pass
+    return {'username': username, 'firstname': firstname,
+            'lastname': lastname, 'e164ext': '\\+12065551234',
+            'extension': '51234', 'did': '2065551234',
+            'device_pool': 'Seattle DP', 'calling_search_space': 'Intl CSS',
+            'partition': 'Internal PAR'}
+
+
+class testAxlTemplateSerializer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = Client(wsdl=_fixture, transport=Transport())
+        cls.service = cls.client.create_service(
+            _bindingName, 'https://127.0.0.1:8443/axl/')
+
+    def setUp(self):
+        self.serializer = axlTemplateSerializer(self.client, self.service)
+        # a writer with the fixture client, without ucm.cfg or a server
+        self.writer = cucmAxlWriter.__new__(cucmAxlWriter)
+        self.writer.client = self.client
+        self.writer.factory = self.client.type_factory('ns0')
+        self.writer.profiles = axlProfileCache()
+        self.writer.templates = self.serializer
+
+    def writerBuild(self, packageMethod):
+        # as cucmAxlWriter._sendPackage for a positional package
+        def build(**values):
+            return (packageMethod(**values),), {}
+        return build
+
+    def phoneSlots(self, username, firstname='Tyler', lastname='Durden'):
+        return dict(_person(username, firstname, lastname),
+                    deviceName=self.writer.deviceGetName(username, 'CSF'))
+
+    def assertSameEnvelope(self, opName, build, slots):
+        rendered = self.serializer.render(opName, build, slots)
+        self.assertIsNotNone(rendered, "{0} was not templated".format(
+            opName))
+        args, kwargs = build(**slots)
+        body, headers = self.serializer.zeepEnvelope(opName, args, kwargs)
+        self.assertEqual(rendered[0], body)
+        self.assertEqual(rendered[1], headers)
+
+    def testLineMatchesZeep(self):
+        self.assertSameEnvelope('addLine', _buildLine, {
+            'extension': '+12065551234', 'description': 'Tyler Durden',
+            'alertingName': 'Tyler Durden', 'partition': 'Internal PAR'})
+
+    def testLineEscapingMatchesZeep(self):
+        for value in _awkwardValues:
+            with self.subTest(value=value):
+                self.assertSameEnvelope('addLine', _buildLine, {
+                    'extension': '\\+12065551234', 'description': value,
+                    'alertingName': value + ' x1', 'partition': value})
+
+    def testUserListMatchesZeep(self):
+        for count in [1, 4]:
+            devices = ['CSF{0}'.format(value) for value in
+                       _awkwardValues[:count]]
+            with self.subTest(count=count):
+                self.assertSameEnvelope('updateUser', _buildUser, {
+                    'username': 'zoë&<user>', 'did': '2065551234',
+                    'deviceList': devices})
+
+    def testPhoneMatchesZeep(self):
+        for username in ['tdurden', 'zoë&<user>', 'a_b%c']:
+            with self.subTest(username=username):
+                slots = self.phoneSlots(username, 'Zoë', 'R&D <lab>')
+                rendered = self.serializer.render(
+                    'addPhone', self.writerBuild(self.writer._devicePackage),
+                    slots, {'devicetype': 'CSF'})
+                self.assertIsNotNone(rendered, "addPhone was not templated")
+                body, headers = self.serializer.zeepEnvelope(
+                    'addPhone', *self.writerBuild(self.writer._devicePackage)(
+                        devicetype='CSF', **slots))
+                self.assertEqual(rendered, (body, headers))
+
+    def testPhoneTemplateCheck(self):
+        # what deviceAdd sends: the device name is a slot of its own, the
+        # upper cased username can not carry the username placeholder
+        self.assertTrue(self.writer.checkTemplate(
+            'addPhone', self.writer._devicePackage,
+            self.phoneSlots('jsmith'), {'devicetype': 'CSF'}))
+
+    def testRdpMatchesZeep(self):
+        for value in _awkwardValues:
+            with self.subTest(value=value):
+                self.assertSameEnvelope(
+                    'addRemoteDestinationProfile',
+                    self.writerBuild(self.writer._rdpPackage),
+                    _person('user' + value, value, value))
+
+    def testCompileKeepsNoProfiles(self):
+        # the placeholder and check values of a compilation are no site
+        # profiles
+        self.writer.checkTemplate('addPhone', self.writer._devicePackage,
+                                  self.phoneSlots('jsmith'),
+                                  {'devicetype': 'CSF'})
+        self.writer.checkTemplate('addRemoteDestinationProfile',
+                                  self.writer._rdpPackage,
+                                  _person('jsmith', 'John', 'Smith'))
+        self.assertEqual(self.writer.profiles.getProfileCount(), 0)
+
+    def testCheckEquivalence(self):
+        self.assertTrue(self.serializer.checkEquivalence(
+            'addLine', _buildLine, {
+                'extension': '1000', 'description': 'R&D <lab> é',
+                'alertingName': '"x"', 'partition': 'P'}))
+
+    def testValuesLeftToZeep(self):
+        # None drops the element and control characters are refused by
+        # lxml, neither may be rendered from a template
+        for value in [None, 'bell\x07', 42]:
+            with self.subTest(value=value):
+                self.assertIsNone(self.serializer.render(
+                    'addLine', _buildLine, {
+                        'extension': '1000', 'description': value,
+                        'alertingName': 'a', 'partition': 'P'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import os  # temp journal
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from ciscoJournal import ciscoJournal, journalUser  # noqa: E402
+from cucmJabberWriter import cucmJabberWriter  # noqa: E402
+
+# Resume semantics of the write-ahead journal, on a SQLite file in a temp
+# directory with fake steps: what is recorded as done, what a resumed run
+# skips and what it runs again.
+#
+#   python -m unittest discover tests
+
+
+class _step:
+    # a fake writer step answering with the given results in turn
+
+    def __init__(self, *results):
+        self._results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        result = self._results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class _rdpAxl:
+    # the cucmAxlWriter.rdpAdd of a writer, which hands AXL errors back
+
+    def __init__(self, *results):
+        self._results = list(results)
+        self.calls = 0
+
+    def rdpAdd(self, *args, **kwargs):
+        self.calls += 1
+        return self._results.pop(0)
+
+
+class testCiscoJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp(prefix='testCiscoJournal')
+        self.fileName = os.path.join(self.workDir, 'journal.db')
+        self.journals = []
+
+    def tearDown(self):
+        for journal in self.journals:
+            journal.close()
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def open(self, resume=False):
+        journal = ciscoJournal(self.fileName, resume=resume)
+        self.journals.append(journal)
+        return journal
+
+    def testSuccessIsDone(self):
+        step = _step("Success")
+        user = self.open().forUser('alice', 'h1')
+        self.assertEqual(user.run('lineCreate', step), "Success")
+        self.assertEqual(user.run('lineCreate', step), journalUser.skipped)
+        self.assertEqual(step.calls, 1)
+
+    def testIsSuccess(self):
+        self.assertTrue(journalUser.isSuccess("Success"))
+        self.assertTrue(journalUser.isSuccess(json.dumps(
+            {'import': "Success", 'pin': "Success"})))
+        for result in ["Fail", "Fail: 404", "Skipped", None, 42, "{}",
+                       json.dumps({'import': "Success", 'pin': "Fail"}),
+                       json.dumps(["Success"]), "{not json"]:
+            with self.subTest(result=result):
+                self.assertFalse(journalUser.isSuccess(result))
+
+    def testFailedStepRunsAgainOnResume(self):
+        step = _step("Fail: line exists", "Success")
+        self.open().forUser('alice', 'h1').run('lineCreate', step)
+        user = self.open(resume=True).forUser('alice', 'h1')
+        self.assertFalse(user.isDone('lineCreate'))
+        self.assertEqual(user.run('lineCreate', step), "Success")
+        self.assertEqual(step.calls, 2)
+        self.assertTrue(self.open(resume=True).forUser(
+            'alice', 'h1').isDone('lineCreate'))
+
+    def testPartlyFailedJsonRunsAgainOnResume(self):
+        step = _step(json.dumps({'import': "Success", 'pin': "Fail"}),
+                     json.dumps({'import': "Success", 'pin': "Success"}))
+        self.open().forUser('alice', 'h1').run('vmImport', step)
+        user = self.open(resume=True).forUser('alice', 'h1')
+        user.run('vmImport', step)
+        self.assertEqual(step.calls, 2)
+        self.assertTrue(user.isDone('vmImport'))
+
+    def testExceptionIsRecordedAndRaised(self):
+        journal = self.open()
+        user = journal.forUser('alice', 'h1')
+        with self.assertRaises(Exception):
+            user.run('lineCreate', _step(Exception("AXL down")))
+        self.assertEqual(journal.getCounts(), {'failed': 1})
+        self.assertFalse(user.isDone('lineCreate'))
+
+    def testChangedRowRunsAgain(self):
+        step = _step("Success", "Success")
+        self.open().forUser('alice', 'h1').run('lineCreate', step)
+        journal = self.open(resume=True)
+        self.assertTrue(journal.forUser('alice', 'h1').isDone('lineCreate'))
+        changed = journal.forUser('alice', 'h2')
+        self.assertFalse(changed.isDone('lineCreate'))
+        changed.run('lineCreate', step)
+        self.assertEqual(step.calls, 2)
+
+    def testResumeSkipsDoneSteps(self):
+        step = _step("Success")
+        self.open().forUser('alice', 'h1').run('lineCreate', step)
+        user = self.open(resume=True).forUser('alice', 'h1')
+        self.assertEqual(user.run('lineCreate', step), journalUser.skipped)
+        self.assertEqual(step.calls, 1)
+
+    def testNewRunClears(self):
+        step = _step("Success", "Success")
+        self.open().forUser('alice', 'h1').run('lineCreate', step)
+        journal = self.open(resume=False)
+        self.assertEqual(journal.getCounts(), {})
+        journal.forUser('alice', 'h1').run('lineCreate', step)
+        self.assertEqual(step.calls, 2)
+
+    def testRefusedRdpRunsAgainOnResume(self):
+        # rdpAdd hands the AXL error back, rdpCreate reports "Fail: ..."
+        axl = _rdpAxl(Exception("Could not insert"), {'return': '{uuid}'})
+
+        def writer(journal):
+            return cucmJabberWriter(
+                'alice', '2065551234', '51234', 'Northwoods DP', 'Tampa',
+                axlWriter=axl, journal=journal.forUser('alice', 'h1'),
+                resolvedUser={'firstName': 'Alice', 'lastName': 'Smith'})
+        first = writer(self.open())
+        result = first._journaled('rdpCreate', first._createRdpDevice)
+        self.assertTrue(result.startswith("Fail: "))
+        resumed = writer(self.open(resume=True))
+        self.assertEqual(resumed._journaled('rdpCreate',
+                                            resumed._createRdpDevice),
+                         "Success")
+        self.assertEqual(axl.calls, 2)
+        self.assertEqual(resumed._journaled('rdpCreate',
+                                            resumed._createRdpDevice),
+                         journalUser.skipped)
+
+
+if __name__ == '__main__':
+    unittest.main()
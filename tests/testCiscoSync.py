@@ -0,0 +1,224 @@
+#!/usr/bin/env python3.6
+__version__ = '0.4'
+__author__ = 'Christopher Phillips'
+
+import os  # temp store
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import functools
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import ciscoSync  # noqa: E402
+import ciscoBatchWriter  # noqa: E402
+from ciscoBatchWriter import normalizeRow, statusFailures  # noqa: E402
+
+# The decisions of the incremental sync against a SQLite store in a temp
+# directory: processUser is replaced by a stub that records the actions
+# and answers with the status a test asks for, nothing reaches CUCM or
+# Unity Connection.
+#
+#   python -m unittest discover tests
+
+_created = json.dumps({'lineCreate': 'Success', 'lineUpdate': 'Success',
+                       'deviceCreate': {'CSF': 'Success'},
+                       'endUserUpdate': 'Success', 'rdpCreate': 'Success'})
+_reconciled = json.dumps({'dryRun': False, 'plan': []})
+_deleted = json.dumps({'deviceDelete': {}, 'rdpDelete': 'Success',
+                       'lineDelete': 'Success'})
+
+
+def _row(username, did='2065551234', **fields):
+    return normalizeRow(dict({'username': username, 'did': did,
+                              'extension': did[-5:], 'city': 'Tampa',
+                              'building': 'Northwoods DP', 'vm': 'false'},
+                             **fields))
+
+
+class _voicemailStub:
+    # the cupiRestWriter calls of ciscoSync._pushVoicemail
+
+    def __init__(self, calls, objectId):
+        self._calls = calls
+        self._objectId = objectId
+
+    def findVmObjectId(self):
+        return self._objectId
+
+    def importNewVoicemail(self):
+        self._calls.append('import')
+        return "Success"
+
+    def updateVoicemailExtension(self, objectId):
+        self._calls.append('extension')
+        return "Success"
+
+    def deleteVoicemail(self, objectId):
+        self._calls.append('deleteVoicemail')
+        return "Success"
+
+
+class testCiscoSync(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp(prefix='testCiscoSync')
+        self.store = ciscoSync.ciscoSyncStore(
+            os.path.join(self.workDir, 'sync.db'))
+        self.calls = []  # (username, perform)
+        self.answers = {}  # (username, perform) -> status
+        self.voicemailCalls = []
+        self.objectId = None
+        patches = [
+            mock.patch.object(ciscoBatchWriter, 'processUser',
+                              self.processUser),
+            # no AXL writer for the existence prefetch
+            mock.patch.object(ciscoSync, 'ciscoBatchWriter',
+                              functools.partial(
+                                  ciscoBatchWriter.ciscoBatchWriter,
+                                  prefetch=False)),
+            mock.patch.object(ciscoSync, 'buildVoicemailWriter',
+                              lambda row, session=None: _voicemailStub(
+                                  self.voicemailCalls, self.objectId))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def processUser(self, row, perform, **kwargs):
+        self.calls.append((row['username'], perform))
+        default = {'create': {'ccm': _created, 'cxn': 'Success'},
+                   'reconcile': {'ccm': _reconciled},
+                   'delete': {'ccm': _deleted, 'cxn': 'Success'}}[perform]
+        answer = self.answers.get((row['username'], perform), default)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def sync(self, rows, remove=True):
+        self.calls = []
+        syncer = ciscoSync.ciscoSync(self.store, workers=2, session=object(),
+                                     remove=remove)
+        results = list(syncer.run(rows))
+        return syncer.counts, results
+
+    def testNewUsersAreCreatedOnce(self):
+        rows = [_row('alice'), _row('bob', '2065550000')]
+        counts, results = self.sync(rows)
+        self.assertEqual(counts['new'], 2)
+        self.assertEqual(sorted(self.calls), [('alice', 'create'),
+                                              ('bob', 'create')])
+        self.assertEqual(self.store.getUserCount(), 2)
+        counts, results = self.sync(rows)
+        self.assertEqual(counts['unchanged'], 2)
+        self.assertEqual(self.calls, [])
+
+    def testChangedUserIsReconciled(self):
+        self.sync([_row('alice')])
+        counts, results = self.sync([_row('alice', '2065559999')])
+        self.assertEqual(counts['changed'], 1)
+        self.assertEqual(self.calls, [('alice', 'reconcile')])
+        self.assertEqual(self.store.getRow('alice')['did'], '2065559999')
+        self.assertEqual(self.sync([_row('alice', '2065559999')])[0]
+                         ['unchanged'], 1)
+
+    def testChangedDidMovesTheMailbox(self):
+        self.sync([_row('alice', vm='true')])
+        self.objectId = 'abc-123'
+        self.sync([_row('alice', '2065559999', vm='true')])
+        self.assertEqual(self.voicemailCalls, ['extension'])
+
+    def testVoicemailTurnedOffDeletesTheMailbox(self):
+        self.sync([_row('alice', vm='true')])
+        self.objectId = 'abc-123'
+        counts, results = self.sync([_row('alice', vm='false')])
+        self.assertEqual(self.voicemailCalls, ['deleteVoicemail'])
+        self.assertEqual(results[0]['cxn'], "Success")
+
+    def testRemovedUserIsDeleted(self):
+        self.sync([_row('alice'), _row('bob', '2065550000')])
+        counts, results = self.sync([_row('alice')])
+        self.assertEqual(counts['removed'], 1)
+        self.assertEqual(self.calls, [('bob', 'delete')])
+        self.assertIsNone(self.store.getRow('bob'))
+        self.assertIsNotNone(self.store.getRow('alice'))
+
+    def testRemoveOff(self):
+        self.sync([_row('alice'), _row('bob', '2065550000')])
+        counts, results = self.sync([_row('alice')], remove=False)
+        self.assertEqual(counts['removed'], 0)
+        self.assertEqual(self.store.getUserCount(), 2)
+
+    def testEmptyExportRemovesNobody(self):
+        self.sync([_row('alice')])
+        counts, results = self.sync([])
+        self.assertEqual(counts['removed'], 0)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.store.getUserCount(), 1)
+
+    def testDuplicateUsernameIsSkipped(self):
+        counts, results = self.sync([_row('alice'),
+                                     _row('alice', '2065559999')])
+        self.assertEqual(self.calls, [('alice', 'create')])
+        self.assertEqual(counts['new'], 1)
+        self.assertEqual(self.store.getRow('alice')['did'], '2065551234')
+
+    def testFailedCreateIsRetriedAsReconcile(self):
+        self.answers[('alice', 'create')] = Exception("AXL down")
+        counts, results = self.sync([_row('alice')])
+        self.assertEqual(counts['failed'], 1)
+        # known, without a hash
+        self.assertEqual(self.store.hashes(), {'alice': ''})
+        del self.answers[('alice', 'create')]
+        counts, results = self.sync([_row('alice')])
+        self.assertEqual(self.calls, [('alice', 'reconcile')])
+        self.assertEqual(counts['failed'], 0)
+        self.assertNotEqual(self.store.hashes()['alice'], '')
+
+    def testFailStatusIsNotSynced(self):
+        self.sync([_row('alice')])
+        stored = self.store.hashes()['alice']
+        self.answers[('alice', 'reconcile')] = {'ccm': json.dumps(
+            {'dryRun': False, 'plan': [{'action': 'update', 'object': 'user',
+                                        'result': 'Fail: refused'}]})}
+        counts, results = self.sync([_row('alice', '2065559999')])
+        self.assertEqual(counts['failed'], 1)
+        # the old hash stays, the next run reconciles again
+        self.assertEqual(self.store.hashes()['alice'], stored)
+        self.assertEqual(self.store.getRow('alice')['did'], '2065551234')
+
+    def testAlreadyDoneFailIsSynced(self):
+        # a retried create finds its line and devices already there
+        self.answers[('alice', 'create')] = {'ccm': json.dumps(
+            {'lineCreate': 'Fail', 'lineUpdate': 'Success',
+             'deviceCreate': {'CSF': 'Fail'}, 'endUserUpdate': 'Success',
+             'rdpCreate': 'Success'})}
+        counts, results = self.sync([_row('alice')])
+        self.assertEqual(counts['failed'], 0)
+        self.assertNotEqual(self.store.hashes()['alice'], '')
+
+    def testStatusFailures(self):
+        self.assertEqual(statusFailures({'ccm': _created, 'cxn': 'Success'}),
+                         [])
+        self.assertEqual(statusFailures({'ccm': json.dumps(
+            {'lineCreate': 'Fail', 'lineDelete': 'Fail',
+             'deviceCreate': {'CSF': 'Fail'}})}), [])
+        self.assertEqual(statusFailures({'ccm': json.dumps(
+            {'lineCreate': 'Fail: no partition'})}),
+            ['ccm/lineCreate: Fail: no partition'])
+        self.assertEqual(statusFailures({'ccm': json.dumps(
+            {'endUserUpdate': 'Fail', 'rdpCreate': 'Fail: refused'})}),
+            ['ccm/endUserUpdate: Fail', 'ccm/rdpCreate: Fail: refused'])
+        self.assertEqual(statusFailures({'cxn': 'Fail: 404'}),
+                         ['cxn: Fail: 404'])
+
+
+if __name__ == '__main__':
+    unittest.main()
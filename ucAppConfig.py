@@ -7,14 +7,6 @@ import logging  # debug
 from appConfig import appConfig
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler('ucAppConfigDebug.log', mode='w')
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - \
-                                %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-logger.info("Begin ucAppConfig Logging")
 
 
 class ccmAppConfig(appConfig):
@@ -55,9 +47,21 @@ class ccmAppConfig(appConfig):
     def getwsdlFileName(self):
         return self._wsdlFileName
 
+    def getAxlVersion(self):
+        # the toolkit keeps each schema under axlsqltoolkit/schema/<version>/
+        return os.path.basename(os.path.dirname(self._wsdlFileName))
+
     def getAppApiUrl(self):
+        if self.getAppApiUrlOverride():
+            return self.getAppApiUrlOverride()
         return 'https://{0}:8443/axl/'.format(self.getAppHost())
 
+    def getSubscriberApiUrls(self):
+        # AXL URLs of the subscribers, a host becomes its default AXL URL
+        return [subscriber if '://' in subscriber else
+                'https://{0}:8443/axl/'.format(subscriber)
+                for subscriber in self.getAppSubscribers()]
+
     def _setAppUrl(self, ipOrHostname):
         self._appUrl = ipOrHostname
 
@@ -79,6 +83,8 @@ class cxnAppConfig(appConfig):
         self._loadAppCfgFile(self._appCfgFileName)
 
     def getAppApiUrl(self):
+        if self.getAppApiUrlOverride():
+            return self.getAppApiUrlOverride()
         return 'https://{0}/vmrest/'.format(self.getAppHost())
 
     def _setAppUrl(self, ipOrHostname):